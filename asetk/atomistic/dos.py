@@ -0,0 +1,195 @@
+"""Density of states from energy levels
+
+The density of states is obtained by broadening the levels with a Gaussian
+or Lorentzian of given full width at half maximum (FWHM).
+By default, levels are binned on an equidistant energy grid and the
+histogram is convolved with the tabulated broadening functions via FFT.
+Alternatively, the broadening functions are summed exactly at the grid
+points (method='exact'), which does not shift levels onto the grid.
+"""
+
+from __future__ import division
+import numpy as np
+import scipy.signal as signal
+import asetk.atomistic.fundamental as fu
+
+def energy_grid(energies, FWHM=0.1, bmethod='Gaussian', bepsilon=1e-3,
+                delta_e=0.005):
+    """Returns equidistant energy grid covering broadened levels
+
+    The grid extends Eb beyond the lowest and highest level, where Eb is
+    determined such that the integrated weight of the broadening function
+    outside of [-Eb, Eb] is < bepsilon (for the largest FWHM).
+    """
+    eb = max([-fu.get_broadening(bmethod, f)[1](bepsilon * 0.5)
+              for f in np.atleast_1d(FWHM)])
+    return np.r_[np.min(energies) - eb : np.max(energies) + eb : delta_e]
+
+def histogram(energies, egrid, weights=None):
+    """Returns histogram of levels on equidistant energy grid
+
+    The weight of each level is distributed linearly onto the two
+    neighbouring grid points, which preserves the mean energy of the levels.
+    Levels outside the grid are dropped.
+    For 2d weights of shape (nsets, nlevels), one histogram per row is
+    returned.
+    """
+    energies = np.asarray(energies, dtype=float)
+    ne = len(egrid)
+    delta_e = egrid[1] - egrid[0]
+    x = (energies - egrid[0]) / delta_e
+    inside = (x >= 0) & (x <= ne - 1)
+    x = x[inside]
+    n = np.minimum(np.floor(x).astype(int), ne - 2)
+    f = x - n
+
+    w = np.ones((1, len(energies))) if weights is None \
+        else np.atleast_2d(np.asarray(weights, dtype=float))
+    w = w[:, inside]
+
+    # one bincount for all rows and both neighbours
+    nsets = len(w)
+    offsets = (np.arange(nsets) * ne)[:, None]
+    bins = np.concatenate([(n + offsets).ravel(), (n + 1 + offsets).ravel()])
+    h = np.bincount(bins, np.concatenate([(w * (1 - f)).ravel(),
+                                          (w * f).ravel()]),
+                    minlength=nsets * ne).reshape(nsets, ne)
+
+    if weights is None or np.ndim(weights) == 1:
+        return h[0]
+    return h
+
+def kernels(FWHMs, delta_e, bmethod='Gaussian', bepsilon=1e-3):
+    """Returns broadening functions tabulated on symmetric grid
+
+    Returns array of shape (len(FWHMs), 2m+1), centered at index m.
+    Each function is set to zero beyond its own Eb.
+    """
+    tables = []
+    ebs = []
+    for FWHM in FWHMs:
+        broadening, quantile = fu.get_broadening(bmethod, FWHM)
+        ebs.append(-quantile(bepsilon * 0.5))
+        tables.append(broadening)
+
+    if np.max(ebs) / delta_e > 1e7:
+        raise ValueError("Broadening window too large for grid spacing.")
+    m = int(np.ceil(np.max(ebs) / delta_e))
+    x = np.arange(-m, m + 1) * delta_e
+    return np.array([np.where(np.abs(x) <= eb, b(x), 0.0)
+                     for b, eb in zip(tables, ebs)])
+
+def dos(energies, weights=None, egrid=None, bmethod='Gaussian', FWHM=0.1,
+        bepsilon=1e-3, delta_e=0.005, method='fft', chunksize=2**22):
+    """Returns (energy grid, density of states).
+
+    Parameters
+    ----------
+    energies: energies of the levels [eV]
+    weights: weights of the levels, defaults to 1. May be 2d array of
+        shape (nsets, nlevels), yielding one DOS per row.
+    egrid: equidistant energy grid [eV], see energy_grid
+    bmethod: Method used for broadening ('Gaussian' or 'Lorentzian')
+    FWHM: Full-width of broadening function at half-maximum [eV].
+        May be a list, yielding one DOS per FWHM.
+    bepsilon: Broadening function is neglected beyond Eb, where Eb is
+        determined such that the integrated weight of the broadening
+        function outside of [-Eb, Eb] is < bepsilon.
+    delta_e: spacing of energy grid [eV], if egrid is not given
+    method: 'fft' bins levels on the grid and convolves via FFT,
+        'exact' sums broadening functions at the grid points.
+    chunksize: for method 'exact', maximum number of (level, grid point)
+        pairs evaluated at once (exceeded only if the window of a single
+        level is larger)
+
+    The DOS has shape [nFWHM,] [nsets,] nE, where the dimensions in brackets
+    are present only for list-like FWHM and 2d weights, respectively.
+    """
+    energies = np.asarray(energies, dtype=float)
+    FWHMs = np.atleast_1d(FWHM)
+    if egrid is None:
+        egrid = energy_grid(energies, FWHMs, bmethod, bepsilon, delta_e)
+    egrid = np.asarray(egrid, dtype=float)
+    delta_e = egrid[1] - egrid[0]
+
+    w = np.ones(len(energies)) if weights is None \
+        else np.asarray(weights, dtype=float)
+    w2d = np.atleast_2d(w)
+
+    if method == 'fft':
+        if FWHMs.min() / delta_e < 5:
+            print("Warning: FWHM / delta_e < 5. Broadening function might not be sampled well.")
+        h = histogram(energies, egrid, w2d)
+        k = kernels(FWHMs, delta_e, bmethod, bepsilon)
+        # all FWHMs and sets in a single batched FFT
+        h = np.broadcast_to(h, (len(k),) + h.shape)
+        DOS = signal.fftconvolve(h, k[:, None, :], mode='same', axes=2)
+    elif method == 'exact':
+        # Levels are processed in chunks of neighbouring energies, each
+        # affecting only the grid points within Eb of the chunk.
+        order = np.argsort(energies)
+        es = energies[order]
+        DOS = np.zeros((len(FWHMs), len(w2d), len(egrid)))
+        for i, f in enumerate(FWHMs):
+            broadening, quantile = fu.get_broadening(bmethod, f)
+            eb = -quantile(bepsilon * 0.5)
+            los = np.searchsorted(egrid, es - eb)
+            his = np.searchsorted(egrid, es + eb, side='right')
+            start = 0
+            while start < len(es):
+                # largest chunk with nlevels * (hi - lo) <= chunksize
+                # (at least one level); the window only grows with the chunk
+                m = max(1, int(chunksize // max(1, his[start] - los[start])))
+                width = his[start:start + m] - los[start]
+                cost = np.arange(1, len(width) + 1) * width
+                stop = start + max(1, np.count_nonzero(cost <= chunksize))
+                lo, hi = los[start], his[stop - 1]
+                b = broadening(egrid[None, lo:hi] - es[start:stop, None])
+                DOS[i, :, lo:hi] += np.dot(w2d[:, order[start:stop]], b)
+                start = stop
+    else:
+        raise ValueError("Unknown method '{}'. Use 'fft' or 'exact'."\
+                         .format(method))
+
+    if w.ndim == 1:
+        DOS = DOS[:, 0]
+    if np.ndim(FWHM) == 0:
+        DOS = DOS[0]
+    return egrid, DOS
+
+def levels_dos(energylevels, spins=None, weights=None, egrid=None,
+               bmethod='Gaussian', FWHM=0.1, bepsilon=1e-3, delta_e=0.005,
+               method='fft'):
+    """Returns (energy grid, density of states) of several sets of levels.
+
+    All levels share one energy grid and are broadened in a single call of
+    dos, see there for the remaining parameters.
+
+    Parameters
+    ----------
+    energylevels: list of EnergyLevels, e.g. one per spin and k-point
+    spins: spin index (starting from 0) of each EnergyLevels,
+        defaults to a separate spin for each
+    weights: weight of each EnergyLevels (e.g. k-point weight),
+        defaults to 1. Weights of the individual levels are applied on top.
+
+    Returns DOS of shape [nFWHM,] nspin, nE.
+    """
+    n = len(energylevels)
+    if n == 0:
+        raise ValueError("No energy levels given.")
+    spins = np.arange(n) if spins is None else np.asarray(spins, dtype=int)
+    weights = np.ones(n) if weights is None else np.asarray(weights, dtype=float)
+
+    energies = np.concatenate([l.energies for l in energylevels])
+    counts = [len(l.energies) for l in energylevels]
+    lweights = np.concatenate([np.where(np.isnan(l.weights), 1.0, l.weights)
+                               for l in energylevels])
+
+    # weight matrix (nspin, nlevels), one row per spin
+    w = np.zeros((np.max(spins) + 1, len(energies)))
+    w[np.repeat(spins, counts), np.arange(len(energies))] = \
+        lweights * np.repeat(weights, counts)
+
+    return dos(energies, w, egrid=egrid, bmethod=bmethod, FWHM=FWHM,
+               bepsilon=bepsilon, delta_e=delta_e, method=method)
@@ -9,6 +9,34 @@ import numpy as np
 import copy  as cp
 from ase.atoms import Atom, Atoms
 
+def get_broadening(bmethod='Gaussian', FWHM=0.1):
+    """Returns (broadening, quantile) functions of a broadening method.
+
+    broadening(x) is the normalized broadening function and the quantile
+    function quantile(y) = x is defined such that the integral of the
+    probability density from -infinity to x equals y.
+
+    Parameters
+    ----------
+    bmethod: Method used for broadening ('Gaussian' or 'Lorentzian')
+    FWHM: Full-width of broadening function at half-maximum [eV]
+    """
+    import scipy.special as scsp
+    if bmethod == 'Gaussian':
+        sigma = FWHM / np.log(8 * np.sqrt(2))
+        quantile = lambda y: np.sqrt(2) * scsp.erfinv(2.0*y -1.0) * sigma
+        broadening = lambda x: 1/(sigma * np.sqrt(2*np.pi)) \
+                             * np.exp( - x**2 / (2 * sigma**2) )
+    elif bmethod == 'Lorentzian':
+        gamma = FWHM * 0.5
+        quantile = lambda y: np.tan(np.pi * (y - 0.5)) * gamma
+        broadening = lambda x: 1/np.pi * gamma / (x**2 + gamma**2)
+    else:
+        raise ValueError("Broadening method \"{}\" not recognized."\
+                         .format(bmethod))
+
+    return broadening, quantile
+
 class EnergyLevel(object):
 
     """An energy level"""
@@ -20,10 +48,66 @@ class EnergyLevel(object):
         self.weight = weight
         self.wfn = wfn
 
+class EnergyLevelView(object):
+
+    """An energy level stored in EnergyLevels
+
+    Behaves like EnergyLevel, but reads and writes the arrays of the
+    EnergyLevels it belongs to.
+    """
+
+    __slots__ = ('_levels', '_index')
+
+    def __init__(self, levels, index):
+        self._levels = levels
+        self._index = index
+
+    @property
+    def energy(self):
+        return self._levels._energies[self._index]
+
+    @energy.setter
+    def energy(self, e):
+        self._levels._energies[self._index] = e
+
+    @property
+    def occupation(self):
+        o = self._levels._occupations[self._index]
+        return None if np.isnan(o) else o
+
+    @occupation.setter
+    def occupation(self, o):
+        self._levels._occupations[self._index] = np.nan if o is None else o
+
+    @property
+    def weight(self):
+        w = self._levels._weights[self._index]
+        return None if np.isnan(w) else w
+
+    @weight.setter
+    def weight(self, w):
+        self._levels._weights[self._index] = np.nan if w is None else w
+
+    @property
+    def wfn(self):
+        wfn = self._levels._wfns[self._index]
+        return None if wfn < 0 else wfn
+
+    @wfn.setter
+    def wfn(self, wfn):
+        self._levels._wfns[self._index] = -1 if wfn is None else wfn
+
 class EnergyLevels(object):
 
     """A list of levels with fermi energy
 
+    Energies, occupations, weights and wave function indices of the levels
+    are stored in arrays. Unknown occupations and weights are NaN, unknown
+    wave function indices are -1.
+    Individual levels are accessed through views, see EnergyLevelView.
+    The properties energies, occupations, weights and wfns return copies
+    of the arrays.
+
     Compared to the C++ class, 
     - the copy constructor has been renamed to the 'copy' method
     - the get/set methods have been stripped off
@@ -33,107 +117,141 @@ class EnergyLevels(object):
 
     def __init__(self, energies=None, occupations=None, weights=None, wfns=None, fermi=None):
         """Fill object with levels and Fermi energy."""
-        self.levels = []
         self.fermi = fermi
 
         if energies is None:
             raise ValueError("No energies specified")
 
-        n = len(energies)
+        self._energies = np.array(energies, dtype=float).reshape(-1)
+        n = len(self._energies)
 
         # If occupations are specified, take them
         if occupations is not None:
-            for i in range(n):
-                tmp = EnergyLevel(energies[i], occupations[i])
-                self.levels.append(tmp)
+            self._occupations = np.array(occupations, dtype=float).reshape(-1)
         # If we just have a fermi energy, create occupations
         elif fermi is not None:
-            for i in range(n):
-                if energies[i] < fermi:
-                    tmp = EnergyLevel(energies[i], 1.0)
-                else:
-                    tmp = EnergyLevel(energies[i], 0.0)
-
-                self.levels.append(tmp)
+            self._occupations = np.where(self._energies < fermi, 1.0, 0.0)
         # If neither fermi nor occupations are set...
-        elif energies is not None:
-            for i in range(n):
-                tmp = EnergyLevel(energies[i], None)
-                self.levels.append(tmp)
+        else:
+            self._occupations = np.full(n, np.nan)
 
+        self._wfns = np.full(n, -1, dtype=int)
         if wfns is not None:
             if len(wfns) == n:
-                for i in range(n):
-                    self.levels[i].wfn = wfns[i]
+                self._wfns[:] = wfns
             else:
                 print("Error: Number of wave functions != number or levels")
              
+        self._weights = np.full(n, np.nan)
         if weights is not None:
             if len(weights) == n:
-                for i in range(n):
-                    self.levels[i].weight = weights[i]
+                self._weights[:] = weights
             else:
                 print("Error: Number of weights != number or levels")
 
+    @classmethod
+    def concatenate(cls, energylevels):
+        """Returns EnergyLevels containing the levels of a list of EnergyLevels.
 
+        The Fermi energy is kept only if it is the same for all.
+        """
+        tmp = cls(energies=[])
+        if len(energylevels) == 0:
+            return tmp
+        tmp._set_arrays([np.concatenate([getattr(l, key) for l in energylevels])
+                         for key in cls._arrays])
+        fermis = [l.fermi for l in energylevels]
+        if len(fermis) > 0 and all(f == fermis[0] for f in fermis):
+            tmp.fermi = fermis[0]
+        return tmp
+
+    _arrays = ['_energies', '_occupations', '_weights', '_wfns']
+
+    def _set_arrays(self, arrays):
+        for key, a in zip(self._arrays, arrays):
+            setattr(self, key, a)
+
+    @property
+    def levels(self):
+        """Tuple of views of the levels
+
+        The tuple is built on every access and cannot be modified; use
+        join, sort etc. to change the set of levels.
+        """
+        return tuple(EnergyLevelView(self, i) for i in range(len(self)))
 
     @property
     def energies(self):
-        return np.array([l.energy for l in self.levels])
+        return self._energies.copy()
 
     @property
     def occupations(self):
-        return np.array([l.occupation for l in self.levels])
+        return self._occupations.copy()
+
+    @property
+    def weights(self):
+        return self._weights.copy()
+
+    @property
+    def wfns(self):
+        return self._wfns.copy()
 
     @energies.setter
     def energies(self, es):
         """Sets levels, not touching occupations."""
-        if len(self.levels) != len(es):
-            print('Error: Trying to set {le} energies for {le} levels.' \
-                  .format(lo=len(es), le=len(self.levels)))
+        if len(self) != len(es):
+            print('Error: Trying to set {lo} energies for {le} levels.' \
+                  .format(lo=len(es), le=len(self)))
             return
 
-        for i in range(len(self.levels)):
-            self.levels[i].energy = es[i]
+        self._energies[:] = es
 
     @occupations.setter
     def occupations(self, os):
         """Sets occupations for existing levels."""
 
-        if len(os) != len(self.levels):
+        if len(os) != len(self):
             print('Error: Trying to set {lo} occupations for {le} levels.' \
-                  .format(lo=len(os), le=len(self.levels)))
+                  .format(lo=len(os), le=len(self)))
         else:
-            for i in range(len(self.levels)):
-                self.levels[i].occupation = os[i]
+            # None (unknown occupation) is converted to NaN
+            self._occupations[:] = np.array(os, dtype=float)
 
     def copy(self, energylevels):
         """Return a copy of energylevels."""
-        self.levels = cp.copy(energylevels.levels)
+        self._set_arrays([getattr(energylevels, key).copy()
+                          for key in self._arrays])
         self.fermi = energylevels.fermi
 
     def join(self, energylevels):
-        self.levels = self.levels + energylevels.levels
+        self._set_arrays([np.concatenate([getattr(self, key),
+                                          getattr(energylevels, key)])
+                          for key in self._arrays])
         if self.fermi != energylevels.fermi:
             print('Warning: Merging energy levels'
                   'with different Fermi energies.')
         self.fermi = energylevels.fermi
 
     def sort(self):
-        self.levels.sort(key = lambda x: x.energy)
+        order = np.argsort(self._energies, kind='stable')
+        self._set_arrays([getattr(self, key)[order] for key in self._arrays])
 
     def shift(self, de):
-        self.energies += de
-        self.fermi  += de
+        self._energies += de
+        if self.fermi is not None:
+            self.fermi += de
+
+    def __len__(self):
+        return len(self._energies)
 
     def __iadd__(self, b):
-        if isinstance(b, float):
-            self.energies += de
-            self.fermi  += de
+        if isinstance(b, (int, float)):
+            self.shift(b)
         elif isinstance(b, self.__class__):
-            self.levels += b.levels
+            fermi = self.fermi
+            self.join(b)
             self.sort()
-            if not self.fermi == b.fermi:
+            if not fermi == b.fermi:
                 self.fermi = None
         else:
             raise TypeError("Unsupported operand type(s) for +: '{}' and '{}'"\
@@ -142,8 +260,7 @@ class EnergyLevels(object):
         return self
 
     def __isub__(self, de):
-        self.energies -= de
-        self.fermi  -= de
+        self.shift(-de)
         return self
 
     def n_occupied(self, epsilon=1e-12):
@@ -154,30 +271,38 @@ class EnergyLevels(object):
         is identical to the highest occupied level.
         """
 
-        if self.fermi:
-            return sum([1 if e < self.fermi + epsilon else 0 for e in self.energies])
-        elif all(o is not None for o in self.occupations):
+        if self.fermi is not None:
+            return np.count_nonzero(self._energies < self.fermi + epsilon)
+        elif not np.any(np.isnan(self._occupations)):
             print("Note: Counting occupied levels based on occupation number.")
-            return sum([1 if o > 0 else 0 for o in self.occupations])
+            return np.count_nonzero(self._occupations > 0)
         else:
             print("Error: Cannot determine occupations.")
 
     def n_empty(self):
         """Return number of empty levels"""
-        return len(levels) - self.n_occupied()
+        return len(self) - self.n_occupied()
 
     def __str__(self):
-        text  = "{} energy levels".format(len(self.levels))
+        text  = "{} energy levels".format(len(self))
         if self.fermi:
             text += ", Fermi energy {:.3f} eV".format(self.fermi)
-        if all(o is not None for o in self.occupations):
+        if not np.any(np.isnan(self._occupations)):
             text += ", occupations specified"
         return text
 
     def __getitem__(self, index):
-        return self.levels[index]
-
-    def dos(self, bmethod = 'Gaussian', bepsilon = 1e-3, FWHM = 0.1, delta_e = 0.005):
+        if isinstance(index, slice):
+            return [EnergyLevelView(self, i)
+                    for i in range(len(self))[index]]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("Level index {} out of range".format(index))
+        return EnergyLevelView(self, index)
+
+    def dos(self, bmethod = 'Gaussian', bepsilon = 1e-3, FWHM = 0.1, delta_e = 0.005,
+            method = 'fft'):
         """
         Returns [energy, density of states].
         
@@ -187,58 +312,21 @@ class EnergyLevels(object):
         bepsilon: Convolution is performed with broadening function in range
             [E-Eb, E+Eb] where Eb is determined such that the integrated weight
             of the broadening function outside of [-Eb, Eb] is < bepsilon.
-        FWHM: Full-width of broadening function at half-maximum [eV]
+        FWHM: Full-width of broadening function at half-maximum [eV].
+            For a list of FWHMs, returns [energy, dos_1, dos_2, ...].
         delta_e: spacing of energy grid [eV]
+        method: 'fft' or 'exact', see asetk.atomistic.dos.dos
+
+        Levels without weight count with weight 1.
+        Note: DOS is calculated for unoccupied levels as well.
         """
+        import asetk.atomistic.dos as dos
 
-        import scipy.special as scsp
-        # Prepare broadening functions for later convolution
-        # quantile function quantile(y) = x is defined such that
-        # the integral of the probability density from -\infty to x equals y.
-        if bmethod == 'Gaussian':
-            sigma = FWHM / np.log(8 * np.sqrt(2))
-            quantile = lambda y: np.sqrt(2) * scsp.erfinv(2.0*y -1.0) * sigma
-            broadening = lambda x: 1/(sigma * np.sqrt(2*np.pi)) \
-                                 * np.exp( - x**2 / (2 * sigma**2) )
-        elif bmethod == 'Lorentzian':
-            gamma = FWHM * 0.5
-            quantile = lambda y: np.tan(np.pi * (y - 0.5)) * gamma
-            broadening = lambda x: 1/np.pi * gamma / (x**2 + gamma**2)
-        else:
-            print("Error: Broadening method \"{}\" not recognized."\
-                  .format(bmethod))
-
-        eb = -quantile(bepsilon * 0.5)
-        if FWHM / delta_e < 5:
-            print("Warning: FWHM / delta_e < 5. Broadening function might not be sampled well.")
-
-        # Tabulate the Gaussian in range sigma * nsigma
-        benergies = np.r_[-eb : eb : delta_e]
-        bprofile = broadening(benergies)
-
-        self.sort()
-        energies = self.energies
-        loE=energies[0] - eb
-        hiE=energies[-1] + eb
-        E=np.r_[loE : hiE : delta_e]
-
-        # Encoding the discretized energy in the array index i makes the code much faster.
-        # Create dos of delta-peaks to be folded with Gaussian
-        DOSdelta = np.zeros(len(E))
-        for level in self.levels:
-            e = level.energy
-            w = level.weight if level.weight else 1.0
-            # In order to be able to fold with tabulated Gaussian, we have to place
-            # levels *on* the grid. I.e. level spacing cannot be smaller than deltaE.
-            n = int((e-loE)/delta_e)
-         
-            # Note: DOS should be calculated for unoccupied levels as well!
-            DOSdelta[n] += w
-        # Convolve with gaussian, keeping same dimension
-        # Can be made even faster by using fftconvolve
-        DOS = np.convolve(DOSdelta,bprofile, mode='same')
-
-        return np.array([E, DOS])
+        weights = np.where(np.isnan(self.weights), 1.0, self.weights)
+        E, DOS = dos.dos(self.energies, weights, bmethod=bmethod, FWHM=FWHM,
+                         bepsilon=bepsilon, delta_e=delta_e, method=method)
+
+        return np.vstack([E, DOS])
 
 
 class KPoint(object):
@@ -303,9 +391,8 @@ class Dispersion(object):
 
     @property
     def energylevels(self):
-        s = EnergyLevels()
-        for kpt in self.kpoints:
-            s += kpt.energylevels
+        s = EnergyLevels.concatenate([k.energylevels for k in self.kpoints])
+        s.sort()
         return s
 
     @property
@@ -323,7 +410,7 @@ class Dispersion(object):
     def weights(self):
         s = [] 
         for kpt in self.kpoints:
-            s.append(kpt.weights)
+            s.append(kpt.weight)
         return s
 
     @property
@@ -341,9 +428,30 @@ class Dispersion(object):
             return np.mean(fermis)
 
 
+    def dos(self, bmethod = 'Gaussian', bepsilon = 1e-3, FWHM = 0.1, delta_e = 0.005,
+            method = 'fft'):
+        """
+        Returns [energy, density of states], weighted by k-point weights.
+
+        If k-point weights are missing, all k-points have weight 1/nkpt.
+        For documentation of parameters, see EnergyLevels.dos
+        """
+        import asetk.atomistic.dos as dos
+
+        weights = self.weights
+        if any(w is None for w in weights):
+            weights = np.ones(self.nkpt) / self.nkpt
+
+        E, DOS = dos.levels_dos([k.energylevels for k in self.kpoints],
+                                spins=np.zeros(self.nkpt), weights=weights,
+                                bmethod=bmethod, FWHM=FWHM, bepsilon=bepsilon,
+                                delta_e=delta_e, method=method)
+
+        return np.vstack([E, DOS[..., 0, :]])
+
     def merge_kpoints(self):
         kv = [0,0,0]
-        levels = EnergyLevels([k.energylevels for k in self.kpoints])
+        levels = self.energylevels
         weight = 1.0
         self.kpoints = [KPoint(kv,levels,weight)]
 
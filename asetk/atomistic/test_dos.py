@@ -0,0 +1,128 @@
+""" Tests for the density of states
+
+"""
+from . import dos
+from . import fundamental as fu
+import unittest
+import numpy as np
+import scipy.ndimage as ndimage
+import numpy.testing as nt
+
+
+class DOS(unittest.TestCase):
+    """ Tests for the broadening of energy levels
+
+    """
+
+    def setUp(self):
+        rs = np.random.RandomState(0)
+        self.energies = rs.rand(300) * 4.0 - 2.0
+        self.weights = rs.rand(2, 300)
+
+    def test_histogram(self):
+        """ Check that weight and mean energy are preserved
+
+        """
+        egrid = np.linspace(-3, 3, 601)
+        h = dos.histogram(self.energies, egrid, self.weights)
+        nt.assert_allclose(h.sum(axis=1), self.weights.sum(axis=1))
+        nt.assert_allclose(np.dot(h, egrid), np.dot(self.weights, self.energies))
+
+    def binning_error(self, egrid, bmethod, FWHM, bepsilon=1e-3):
+        """Returns upper bound for the error of the FFT DOS on egrid
+
+        Binning a level linearly onto its neighbouring grid points
+        interpolates its broadening function, with error below
+        h**2/8 * |f''| near the level.
+        Within h of the window edge Eb and beyond, the error is bounded by
+        the broadening function itself (the exact sums may include tails).
+        """
+        h = egrid[1] - egrid[0]
+        broadening, quantile = fu.get_broadening(bmethod, FWHM)
+        eb = -quantile(bepsilon * 0.5)
+        xmax = np.max(np.abs(egrid[[0, -1], None] - self.energies))
+
+        # max |f''| within h, tabulated on a fine grid
+        t = np.arange(-h, xmax + 2 * h, h / 8)
+        d = 1e-4
+        f2 = np.abs(broadening(t + d) - 2 * broadening(t)
+                    + broadening(t - d)) / d**2
+        f2 = ndimage.maximum_filter1d(f2, 17)
+
+        bound = np.zeros((len(self.weights), len(egrid)))
+        for e, w in zip(self.energies, self.weights.T):
+            x = np.abs(egrid - e)
+            error = np.where(x <= eb + h, h**2 / 8 * np.interp(x, t, f2), 0.0) \
+                  + np.where(x >= eb - h, broadening(x - h), 0.0)
+            bound += w[:, None] * error
+        return bound
+
+    def test_fft(self):
+        """ Compare FFT convolution with exact sums
+
+        """
+        for bmethod in ['Gaussian', 'Lorentzian']:
+            E, D = dos.dos(self.energies, self.weights, FWHM=[0.1, 0.3],
+                           bmethod=bmethod, delta_e=0.002)
+            self.assertEqual(D.shape, (2, 2, len(E)))
+            E2, D2 = dos.dos(self.energies, self.weights, egrid=E,
+                             FWHM=[0.1, 0.3], bmethod=bmethod,
+                             method='exact', chunksize=1000)
+            for i, FWHM in enumerate([0.1, 0.3]):
+                bound = self.binning_error(E, bmethod, FWHM)
+                # allow for round-off of the FFT
+                self.assertTrue(np.all(np.abs(D[i] - D2[i])
+                                       <= bound + 1e-12 * np.max(D)))
+
+    def test_levels(self):
+        """ Check DOS of EnergyLevels
+
+        """
+        levels = fu.EnergyLevels(energies=self.energies, fermi=0.0)
+        E, D = levels.dos(FWHM=0.1, delta_e=0.005)
+        self.assertAlmostEqual(np.sum(D) * 0.005, len(self.energies), 0)
+        data = levels.dos(FWHM=[0.1, 0.2], delta_e=0.005)
+        self.assertEqual(data.shape[0], 3)
+
+    def test_spins_kpoints(self):
+        """ Check common grid for spins and weighted k-points
+
+        """
+        up = fu.EnergyLevels(energies=[-1.0, 0.5], fermi=0.0)
+        down = fu.EnergyLevels(energies=[-0.5, 2.0, 3.0], fermi=0.0)
+        E, D = dos.levels_dos([up, down, up], spins=[0, 1, 0],
+                              weights=[0.25, 1.0, 0.75], delta_e=0.01)
+        self.assertEqual(D.shape, (2, len(E)))
+        nt.assert_allclose(np.sum(D, axis=1) * 0.01, [2.0, 3.0], rtol=2e-3)
+
+        kpts = [fu.KPoint([0, 0, 0], up, 0.25), fu.KPoint([0.5, 0, 0], down, 0.75)]
+        data = fu.Dispersion(kpts).dos(delta_e=0.01)
+        self.assertAlmostEqual(np.sum(data[1]) * 0.01, 0.25 * 2 + 0.75 * 3, 2)
+
+    def test_exact_chunks(self):
+        """ Check that chunks of widely spread levels respect chunksize
+
+        """
+        rs = np.random.RandomState(1)
+        energies = np.sort(rs.rand(2000)) ** 3 * 100.0
+        egrid = np.arange(-1.0, 101.0, 0.01)
+        # tails are negligible, such that windows do not matter
+        E, ref = dos.dos(energies, egrid=egrid, FWHM=0.1, method='exact',
+                         bepsilon=1e-14, chunksize=10**9)
+
+        calls = []
+        broadening = fu.get_broadening
+        def counting(bmethod, FWHM):
+            b, q = broadening(bmethod, FWHM)
+            def counted(x):
+                calls.append(x.size)
+                return b(x)
+            return counted, q
+        fu.get_broadening = counting
+        try:
+            E, D = dos.dos(energies, egrid=egrid, FWHM=0.1, method='exact',
+                           bepsilon=1e-14, chunksize=5000)
+        finally:
+            fu.get_broadening = broadening
+        self.assertLessEqual(max(calls), 5000)
+        nt.assert_allclose(D, ref, atol=1e-10 * np.max(ref))
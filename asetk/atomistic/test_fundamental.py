@@ -0,0 +1,92 @@
+""" Tests for fundamental atomistic concepts
+
+"""
+from . import fundamental as fu
+import unittest
+import numpy as np
+import numpy.testing as nt
+
+
+class EnergyLevels(unittest.TestCase):
+    """ Tests for the array-backed EnergyLevels
+
+    """
+
+    def setUp(self):
+        self.levels = fu.EnergyLevels(energies=[0.3, -1.0, 0.1, -0.5],
+                                      weights=[1.0, 2.0, 3.0, 4.0],
+                                      wfns=[1, 2, 3, 4], fermi=0.0)
+
+    def test_views(self):
+        """ Check that views read and write the arrays
+
+        """
+        l = self.levels[1]
+        self.assertEqual(l.energy, -1.0)
+        self.assertEqual(l.occupation, 1.0)
+        self.assertEqual(l.wfn, 2)
+        l.energy = -2.0
+        l.weight = None
+        self.assertEqual(self.levels.energies[1], -2.0)
+        self.assertTrue(np.isnan(self.levels.weights[1]))
+        self.assertIsNone(self.levels.levels[1].weight)
+        self.assertEqual(self.levels[-1].energy, -0.5)
+        self.assertRaises(IndexError, self.levels.__getitem__, 4)
+
+        levels = fu.EnergyLevels(energies=[0.1, 0.2])
+        self.assertIsNone(levels[0].occupation)
+        self.assertIsNone(levels[0].wfn)
+
+    def test_sort_shift(self):
+        """ Check that all arrays are sorted together
+
+        """
+        self.levels.sort()
+        nt.assert_array_equal(self.levels.energies, [-1.0, -0.5, 0.1, 0.3])
+        nt.assert_array_equal(self.levels.occupations, [1, 1, 0, 0])
+        nt.assert_array_equal(self.levels.weights, [2, 4, 3, 1])
+        nt.assert_array_equal(self.levels.wfns, [2, 4, 3, 1])
+
+        self.levels.shift(0.2)
+        nt.assert_allclose(self.levels.energies, [-0.8, -0.3, 0.3, 0.5])
+        self.assertAlmostEqual(self.levels.fermi, 0.2)
+        self.levels -= 0.2
+        self.assertEqual(self.levels.n_occupied(), 2)
+        self.assertEqual(self.levels.n_empty(), 2)
+
+    def test_join(self):
+        """ Check joining of levels
+
+        """
+        other = fu.EnergyLevels(energies=[0.05, -0.2], fermi=0.0)
+        joined = fu.EnergyLevels.concatenate([self.levels, other])
+        self.assertEqual(len(joined), 6)
+        self.assertEqual(joined.fermi, 0.0)
+        nt.assert_array_equal(joined.wfns, [1, 2, 3, 4, -1, -1])
+
+        self.levels += other
+        nt.assert_array_equal(self.levels.energies,
+                              [-1.0, -0.5, -0.2, 0.05, 0.1, 0.3])
+        self.assertEqual(self.levels.n_occupied(), 3)
+
+    def test_copies(self):
+        """ Check that returned arrays do not alias the levels
+
+        """
+        e = self.levels.energies
+        e -= 1.0
+        self.levels.occupations.fill(0.0)
+        nt.assert_array_equal(self.levels.energies, [0.3, -1.0, 0.1, -0.5])
+        nt.assert_array_equal(self.levels.occupations, [0, 1, 0, 1])
+        self.levels[0].energy = 5.0
+        self.assertEqual(self.levels.energies[0], 5.0)
+        self.levels.energies = [1.0, 2.0, 3.0, 4.0]
+        nt.assert_array_equal(self.levels.energies, [1.0, 2.0, 3.0, 4.0])
+        self.assertIsInstance(self.levels.levels, tuple)
+
+    def test_empty_dispersion(self):
+        """ Check dispersion without k-points
+
+        """
+        self.assertEqual(len(fu.Dispersion().energylevels), 0)
+        self.assertEqual(len(fu.EnergyLevels.concatenate([])), 0)
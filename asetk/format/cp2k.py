@@ -4,12 +4,14 @@ Representation of a spectrum
 """
 
 import re
+import os
+import json
 import copy  as cp
 import numpy as np
-import io
 import asetk.atomistic.fundamental as fu
 import asetk.atomistic.constants as atc
 from . import cube
+from . import npzcube
 
 class Spectrum(object):
 
@@ -105,36 +107,38 @@ class Spectrum(object):
             levels.shift(-de)
         return self
 
-    def dos(self, bmethod = 'Gaussian', bepsilon = 1e-3, FWHM = 0.1, delta_e = 0.005):
+    def dos(self, bmethod = 'Gaussian', bepsilon = 1e-3, FWHM = 0.1, delta_e = 0.005,
+            method = 'fft', sum_spins = True):
         """
         Returns [energy, density of states].
         
-        For documentation of parameters, see 
-          atk.atomistic.fundamental.EnergyLevels.dos
+        All spins share the same energy grid. If sum_spins is False, the
+        density of states has shape (nspin, nE).
+
+        For documentation of the other parameters, see 
+          asetk.atomistic.fundamental.EnergyLevels.dos
         """
+        import asetk.atomistic.dos as dos
 
         nspin = len(self.energylevels)
-        if nspin > 1:
-            print("Summing contributions from {} spins"\
-                     .format(len(self.energylevels)))
+        if nspin == 0:
+            print("Error: DOS requested, but no states found.")
+            return 
 
+        if nspin > 1:
             fermis = [el.fermi for el in self.energylevels]
             if len( np.unique(fermis) ) != 1:
                 print("Warning: Fermi energies {} differ".format(fermis))
 
-            DOSes = []
-            for el in self.energylevels:
-                E, DOS = el.dos(bmethod, bepsilon, FWHM, delta_e)
-                DOSes.append(DOS)
-
-            return [E, np.sum(DOSes, axis=0)]
+        E, DOS = dos.levels_dos(self.energylevels, bmethod=bmethod,
+                                FWHM=FWHM, bepsilon=bepsilon,
+                                delta_e=delta_e, method=method)
+        if sum_spins:
+            if nspin > 1:
+                print("Summing contributions from {} spins".format(nspin))
+            DOS = np.sum(DOS, axis=-2)
 
-        elif nspin == 1:
-            return self.energylevels[0].dos(bmethod, bepsilon, FWHM, delta_e)
-
-        else:
-            print("Error: DOS requested, but no states found.")
-            return 
+        return [E, DOS]
 
     def __str__(self):
         text  = "Spectrum containing {} spins\n".format(len(self.energylevels))
@@ -148,136 +152,564 @@ class Spectrum(object):
         return self.levels[index]
 
     def read_from_mo(self, fname):
-        """Reads Spectrum from list of molecular occupations"""
-        s = open(fname, 'r').read()
-
-        lineregex='[^\r\n]*\r?\n'
-        fermiregex='Fermi energy:(\s*[\-\d\.]+)'
-        mainregex = 'MO EIGENVALUES AND MO OCCUPATION NUMBERS(?!, AND)({l}){l}{l}([\-\.\s\d]*).*?{f}' \
-                .format(l=lineregex, f=fermiregex)
-        spinregex='(?:ALPHA|BETA)\s*'
-
-        if re.search(spinregex, s):
-            matches=re.findall(spinregex+mainregex, s, re.DOTALL)
-            last_matches = [ matches[-2], matches[-1] ]
-        else:
-            matches=re.findall(mainregex, s, re.DOTALL)
-            last_matches = [matches[-1]]
-
-        ## first, we sort out all but the last one
-        #last_matches = []
-        #print(matches[0])
-        #for match in reversed(matches):
-        #    #print(match)
-        #    # we take only the ones, which do not contain 'SCF'
-        #    if re.search('SCF', match[0]):
-        #        continue
-        #    elif re.search('ALPHA', match[0]) \
-        #      or re.search('BETA', match[0]):
-        #          if len(last_matches) == 0:
-        #              last_matches.append(match)
-        #              continue
-        #          else:
-        #              last_matches.append(match)
-        #              break
-        #    else:
-        #        last_matches.append(match)
-        #        break
-
-        self.spins=[]
-        self.energylevels=[]
-        spin=0
-        for match in last_matches:
-            ## we take only the last ones, which do not contain 'SCF'
-            #if not re.search('SCF', match[0]):
-
-            # python2
-            #data = np.genfromtxt(StringIO.StringIO(match[2]),
-            #             dtype=[int,float,float])
-            data = np.genfromtxt(io.BytesIO(match[1].encode()),
-                         dtype=[int,float,float])
-            i,E,occ = list(zip(*data))
-            fermi = float(match[2]) * atc.Ha / atc.eV
-            E     = np.array(E)     * atc.Ha / atc.eV
-
-            levels = fu.EnergyLevels(energies=E,occupations=occ, fermi=fermi)
-            self.energylevels.append(levels)
-            self.spins.append(spin)
-
-            spin = spin + 1
+        """Reads last Spectrum from list of molecular occupations
+
+        The file is parsed line by line in a single pass, see MOParser.
+        """
+        self._read_last(iter_spectra(fname, MOParser()), fname)
 
     def read_from_output(self, fname):
-        """Reads Spectrum from CP2K output"""
-        s = open(fname, 'r').read()
-
-        # Format in CP2K output
-        if not re.search('Eigenvalues of the occupied subspace', s):
-            raise ValueError("Unable to parse CP2K output file")
-
-        # We are interested only in the last run (result of calculation)
-        rundatas = re.findall(
-                'Eigenvalues of the occupied subspace .*?FORCE_EVAL', s, re.DOTALL)
-        #rundatas = re.findall(
-        #        'Eigenvalues of the occupied subspace .*?HOMO', s, re.DOTALL)
-        rundata = rundatas[-1]
-
-        # each spin may have occupied & unoccupied levels + fermi energy
-        occupieddatas = re.findall(
-                'Eigenvalues of the occupied subspace spin([\.\-\d\s]*)', 
-                rundata, re.DOTALL)
-        #unoccupieddatas = re.findall('Lowest eigenvalues of the unoccupied subspace spin.*?iterations([\.\-\d\s]*)', rundata, re.DOTALL)
-        unoccupieddatas = re.findall(
-                'Lowest (?:e|E)igenvalues of the unoccupied subspace spin(.*?\d{8}[\.\-\d\s]*)',
-                rundata, re.DOTALL)
-        levelregex = '\-?\d\.\d{8}'
-
-        fermidatas = re.findall('Fermi Energy.*', rundata)
-        fermiregex = '\-?\d\.\d{6}'
-
-        self.energylevels = []
-        self.spins = []
-        for i in range(0, len(occupieddatas)):
-            # If we have unoccupied levels...
-            if len(unoccupieddatas) == len(occupieddatas):
-                E = np.array(
-                        re.findall(levelregex, occupieddatas[i] + unoccupieddatas[i]), 
-                        dtype = float)
-            else:
-                E = np.array(re.findall(levelregex, occupieddatas[i]), dtype = float)
-            E = E * atc.Ha / atc.eV
-            fermi = float(re.search(fermiregex, fermidatas[i]).group(0))
-
-            spin = str(re.search('\s*(\d)',occupieddatas[i]).group(1))
-            spin = int(spin) - 1
-
-            levels = fu.EnergyLevels(energies=E,fermi=fermi)
-            self.energylevels.append(levels)
-            self.spins.append(spin)
+        """Reads last Spectrum from CP2K output
+
+        The file is parsed line by line in a single pass, see OutputParser.
+        """
+        self._read_last(iter_spectra(fname, OutputParser()), fname)
+
+    def _read_last(self, spectra, fname):
+        last = None
+        for last in spectra:
+            pass
+        if last is None:
+            raise ValueError("Unable to find energy levels in {}".format(fname))
+        self.energylevels = last.energylevels
+        self.spins = last.spins
+
+    @classmethod
+    def iter_from_mo(cls, fname):
+        """Yields Spectrum of every block of .MOLog file (e.g. every SCF step)"""
+        return iter_spectra(fname, MOParser())
+
+    @classmethod
+    def iter_from_output(cls, fname):
+        """Yields Spectrum of every block of energy levels in CP2K output"""
+        return iter_spectra(fname, OutputParser())
 
     def read_from_pdos(self, fname):
-        """Reads Spectrum from projected density of states"""
-	# format: id energy occupation s py pz px d-2 d-1 d0 d+1 d+2 f-3 f-2 f-1 f0 f+1 f+2 f+3
-	A = np.genfromtxt(fname, skip_header=2)
-
-	energies = A[:,1] * atc.Ha / atc.eV
-	occupations = np.array(A[:,2], dtype=int)
-        weights = np.sum(A[:,3:], axis=1)
-
-	# needed only for fermi energy
-        s = open(fname, 'r').readline()
-	print(s)
-	fermiregex = 'E\(Fermi\) =\s+([-\d\.]+) a.u.'
-	match = re.search(fermiregex, s)
-	if not match:
-            raise ValueError("Unable to parse Fermi energy from pdos file. Setting to zero.")
-	    fermi = 0
-        else:
-            fermi = float(match.group(1)) * atc.Ha / atc.eV
+        """Reads Spectrum from projected density of states
+
+        The weight of each level is the sum of its projections, see PDOS.
+        """
+        pdos = PDOS.from_file(fname)
 
-        self.energylevels = [fu.EnergyLevels(energies=energies, 
-            occupations=occupations, weights=weights, fermi=fermi)]
+        self.energylevels = [fu.EnergyLevels(energies=pdos.energies, 
+            occupations=pdos.occupations,
+            weights=np.sum(pdos.projections, axis=1), fermi=pdos.fermi)]
         self.spins = [0]
 
+def _floats(line):
+    """Returns list of numbers in line or None, if line contains other text"""
+    try:
+        return [float(v) for v in line.split()]
+    except ValueError:
+        return None
+
+class OutputParser(object):
+
+    """Line-oriented parser for energy levels in CP2K output
+
+    Lines are passed one by one to feed, which returns a list of Spectrum
+    objects completed by the line. Only the block currently being parsed
+    is kept in memory.
+
+    A spectrum consists of the eigenvalues of the occupied subspace (and
+    of the unoccupied subspace, if present) of all spins, and is completed
+    by the following FORCE_EVAL line or by a new block of the same spin.
+    """
+
+    def __init__(self):
+        self.blocks = []
+        self.current = None
+        self.values = None
+
+    markers = ['Eigenvalues of the occupied subspace spin',
+               'igenvalues of the unoccupied subspace spin',
+               'Fermi Energy', 'FORCE_EVAL']
+
+    @property
+    def idle(self):
+        """True, if only lines containing one of the markers matter"""
+        return self.values is None
+
+    def _block(self, spin):
+        for b in self.blocks:
+            if b['spin'] == spin:
+                return b
+        return None
+
+    def feed(self, line):
+        """Parses line, returns list of completed spectra."""
+        completed = []
+
+        if 'Eigenvalues of the occupied subspace spin' in line:
+            spin = int(line.split()[-1]) - 1
+            if self._block(spin) is not None:
+                completed += self.finish()
+            self.current = {'spin': spin, 'occupied': [], 'unoccupied': [],
+                            'fermi': None}
+            self.blocks.append(self.current)
+            self.values = self.current['occupied']
+        elif 'igenvalues of the unoccupied subspace spin' in line:
+            self.current = self._block(int(line.split()[-1]) - 1)
+            self.values = self.current['unoccupied'] if self.current else None
+        elif 'Fermi Energy' in line:
+            if self.current is not None and self.current['fermi'] is None:
+                self.current['fermi'] = float(line.split()[-1])
+            self.values = None
+        elif 'FORCE_EVAL' in line:
+            completed += self.finish()
+        elif self.values is not None:
+            values = _floats(line)
+            if values is not None:
+                self.values += values
+            elif self.values and re.search('[a-zA-Z]', line):
+                # end of block
+                self.values = None
+
+        return completed
+
+    def finish(self):
+        """Completes current spectrum, returns list of completed spectra."""
+        blocks = self.blocks
+        self.blocks = []
+        self.current = None
+        self.values = None
+        if not blocks:
+            return []
+
+        spectrum = Spectrum(energylevels=[], spins=[])
+        for b in blocks:
+            E = np.array(b['occupied'] + b['unoccupied']) * atc.Ha / atc.eV
+            spectrum.energylevels.append(fu.EnergyLevels(energies=E,
+                                                         fermi=b['fermi']))
+            spectrum.spins.append(b['spin'])
+        return [spectrum]
+
+class MOParser(object):
+
+    """Line-oriented parser for energy levels in CP2K .MOLog files
+
+    Lines are passed one by one to feed, which returns a list of Spectrum
+    objects completed by the line. For spin-polarized calculations, a
+    spectrum is completed by the BETA block following an ALPHA block.
+    """
+
+    header = 'MO EIGENVALUES AND MO OCCUPATION NUMBERS'
+
+    def __init__(self):
+        self.block = None
+        self.alpha = None
+
+    @property
+    def markers(self):
+        return [self.header, 'Fermi energy:']
+
+    @property
+    def idle(self):
+        """True, if only lines containing one of the markers matter"""
+        return self.block is None or self.block['done']
+
+    def feed(self, line):
+        """Parses line, returns list of completed spectra."""
+        if self.header in line and self.header + ', AND' not in line:
+            spin = 1 if 'BETA' in line else 0
+            self.block = {'spin': spin, 'alpha': 'ALPHA' in line, 'rows': [],
+                          'skip': 2, 'done': False}
+            return []
+
+        b = self.block
+        if b is None:
+            return []
+        if 'Fermi energy:' in line:
+            fermi = float(line.split(':')[1].split()[0]) * atc.Ha / atc.eV
+            self.block = None
+            return self._complete(b, fermi)
+
+        if b['skip'] > 0:
+            b['skip'] -= 1
+        elif not b['done']:
+            values = _floats(line)
+            if values is None:
+                b['done'] = True
+            elif len(values) == 3:
+                b['rows'].append(values)
+        return []
+
+    def _complete(self, b, fermi):
+        """Returns list of spectra completed by block b"""
+        data = np.array(b['rows']).reshape(-1, 3)
+        levels = fu.EnergyLevels(energies=data[:, 1] * atc.Ha / atc.eV,
+                                 occupations=data[:, 2], fermi=fermi)
+
+        if b['alpha']:
+            self.alpha = levels
+            return []
+        if b['spin'] == 1 and self.alpha is not None:
+            spectrum = Spectrum(energylevels=[self.alpha, levels], spins=[0, 1])
+            self.alpha = None
+            return [spectrum]
+        return [Spectrum(energylevels=[levels], spins=[0])]
+
+    def finish(self):
+        """Returns list of spectra completed at end of file."""
+        self.block = None
+        return []
+
+def _parse_lines(text, parser):
+    """Yields spectra found by line parser in bytes of complete lines.
+
+    While the parser is idle, text up to the next line containing one of
+    its markers is skipped without splitting it into lines.
+    """
+    markers = [m.encode() for m in parser.markers]
+    pos = 0
+    found = {}
+    while pos < len(text):
+        if parser.idle:
+            # next occurrence of each marker, updated lazily
+            for m in markers:
+                if found.get(m, -1) < pos and found.get(m) != len(text):
+                    i = text.find(m, pos)
+                    found[m] = len(text) if i < 0 else i
+            nxt = min([found[m] for m in markers])
+            if nxt == len(text):
+                break
+            pos = text.rfind(b'\n', 0, nxt) + 1
+        nl = text.find(b'\n', pos) + 1
+        for spectrum in parser.feed(text[pos:nl].decode('utf-8', 'replace')):
+            yield spectrum
+        pos = nl
+
+def iter_spectra(fname, parser, chunksize=16*1024**2):
+    """Yields spectra found by line parser in file, in a single pass.
+
+    The file is read in chunks, see _parse_lines.
+
+    parser: OutputParser or MOParser
+    """
+    with open(fname, 'rb') as f:
+        tail = b''
+        while True:
+            chunk = f.read(chunksize)
+            if not chunk:
+                break
+            text = tail + chunk
+            end = text.rfind(b'\n') + 1
+            tail = text[end:]
+            for spectrum in _parse_lines(text[:end], parser):
+                yield spectrum
+        if tail:
+            for spectrum in parser.feed(tail.decode('utf-8', 'replace')):
+                yield spectrum
+    for spectrum in parser.finish():
+        yield spectrum
+
+class SpectrumTrajectory(object):
+
+    """Energy levels of all SCF/MD steps of a CP2K run
+
+    Energies, occupations [nframes, nspin, nlevels] and Fermi energies
+    [nframes, nspin] are stored in compact arrays, padded with NaN where a
+    frame has fewer spins or levels.
+
+    The file is parsed incrementally: update() continues from the byte offset
+    reached by the previous call, such that a growing output file of a
+    running job needs to be parsed only once.
+    """
+
+    def __init__(self, fname=None, kind='mo', chunksize=16*1024**2):
+        """Set up trajectory for file
+
+        Parameters
+        ----------
+        fname: CP2K output or .MOLog file
+        kind: 'mo' for .MOLog files, 'output' for CP2K output
+        """
+        if kind not in ['mo', 'output']:
+            raise ValueError("Unknown kind '{}'. Use 'mo' or 'output'."\
+                             .format(kind))
+        self.fname = fname
+        self.kind = kind
+        self.chunksize = chunksize
+        self.reset()
+
+        if fname is not None:
+            self.update()
+
+    def reset(self):
+        """Discards all frames, next update parses file from the beginning"""
+        self.parser = MOParser() if self.kind == 'mo' else OutputParser()
+        self.offset = 0
+        self.nframes = 0
+        self._energies = np.empty((0, 0, 0))
+        self._occupations = np.empty((0, 0, 0))
+        self._fermi = np.empty((0, 0))
+
+    @classmethod
+    def from_mo(cls, fname):
+        tmp = SpectrumTrajectory(fname, kind='mo')
+        return tmp
+
+    @classmethod
+    def from_output(cls, fname):
+        tmp = SpectrumTrajectory(fname, kind='output')
+        return tmp
+
+    @property
+    def energies(self):
+        return self._energies[:self.nframes]
+
+    @property
+    def occupations(self):
+        return self._occupations[:self.nframes]
+
+    @property
+    def fermi(self):
+        return self._fermi[:self.nframes]
+
+    def __len__(self):
+        return self.nframes
+
+    def __getitem__(self, index):
+        """Returns Spectrum of frame"""
+        if not -self.nframes <= index < self.nframes:
+            raise IndexError("Frame {} out of range.".format(index))
+        spectrum = Spectrum(energylevels=[], spins=[])
+        for spin in range(self._energies.shape[1]):
+            E = self.energies[index, spin]
+            present = ~np.isnan(E)
+            if not np.any(present):
+                continue
+            fermi = self.fermi[index, spin]
+            spectrum.energylevels.append(fu.EnergyLevels(
+                energies=E[present],
+                occupations=self.occupations[index, spin][present],
+                fermi=None if np.isnan(fermi) else fermi))
+            spectrum.spins.append(spin)
+        return spectrum
+
+    def update(self):
+        """Parses new complete lines of file, returns number of new frames.
+
+        If the file is shorter than the stored offset, it is assumed to have
+        been overwritten and is parsed from the beginning.
+        """
+        if os.path.getsize(self.fname) < self.offset:
+            self.reset()
+
+        nframes = self.nframes
+        with open(self.fname, 'rb') as f:
+            f.seek(self.offset)
+            tail = b''
+            while True:
+                chunk = f.read(self.chunksize)
+                if not chunk:
+                    break
+                text = tail + chunk
+                end = text.rfind(b'\n') + 1
+                tail = text[end:]
+                for spectrum in _parse_lines(text[:end], self.parser):
+                    self.append(spectrum)
+                # incomplete last line is parsed again in next update
+                self.offset += end
+
+        return self.nframes - nframes
+
+    def append(self, spectrum):
+        """Appends Spectrum as new frame"""
+        nspin = max(spectrum.spins) + 1
+        nlevels = max([len(l) for l in spectrum.energylevels])
+
+        shape = self._energies.shape
+        if self.nframes == shape[0] or nspin > shape[1] or nlevels > shape[2]:
+            # grow geometrically along frames
+            nf = max(self.nframes + 1, 2 * shape[0]) if self.nframes == shape[0] \
+                 else shape[0]
+            self._resize((nf, max(nspin, shape[1]), max(nlevels, shape[2])))
+
+        i = self.nframes
+        for levels, spin in zip(spectrum.energylevels, spectrum.spins):
+            n = len(levels)
+            self._energies[i, spin, :n] = levels.energies
+            self._occupations[i, spin, :n] = levels.occupations
+            if levels.fermi is not None:
+                self._fermi[i, spin] = levels.fermi
+        self.nframes += 1
+
+    def _resize(self, shape):
+        energies = np.full(shape, np.nan)
+        occupations = np.full(shape, np.nan)
+        fermi = np.full(shape[:2], np.nan)
+        nf, ns, nl = self._energies.shape
+        energies[:nf, :ns, :nl] = self._energies
+        occupations[:nf, :ns, :nl] = self._occupations
+        fermi[:nf, :ns] = self._fermi
+        self._energies, self._occupations, self._fermi = \
+            energies, occupations, fermi
+
+    def __str__(self):
+        text  = "SpectrumTrajectory of {} frames, {} spins, {} levels\n"\
+                .format(self.nframes, *self._energies.shape[1:])
+        text += "File {}, parsed up to byte {}\n".format(self.fname, self.offset)
+        return text
+
+class PDOS(object):
+
+    """Projected density of states from CP2K .pdos files
+
+    Keeps the projections of all levels onto all channels (e.g. the s, p, d
+    orbitals of each atomic kind) as a (nlevels x nchannels) matrix.
+    Channels are labelled 'kind:orbital', e.g. 'C:px'.
+    """
+
+    def __init__(self, energies=None, occupations=None, projections=None,
+                 channels=None, fermi=None, spin=0):
+        """Set up PDOS.
+
+        energies: energies of the levels [eV]
+        occupations: occupations of the levels
+        projections: array of shape (nlevels, nchannels)
+        channels: labels of the channels
+        fermi: Fermi energy [eV]
+        spin: spin index (starting from 0)
+        """
+        self.energies = energies
+        self.occupations = occupations
+        self.projections = projections
+        self.channels = channels
+        self.fermi = fermi
+        self.spin = spin
+
+    @classmethod
+    def from_file(cls, fname):
+        """Creates PDOS from .pdos file"""
+        tmp = PDOS()
+        tmp.read_from_file(fname)
+        return tmp
+
+    @classmethod
+    def from_files(cls, fnames):
+        """Creates PDOS from .pdos files of different kinds of one run.
+
+        All files must contain the same levels (i.e. belong to the same spin).
+        """
+        if len(fnames) == 0:
+            raise ValueError("No .pdos files given.")
+        tmp = cls.from_file(fnames[0])
+        for fname in fnames[1:]:
+            tmp.merge(cls.from_file(fname))
+        return tmp
+
+    def read_from_file(self, fname):
+        """Reads PDOS from .pdos file
+
+        File format:
+        # Projected DOS for atomic kind C at iteration step i = 0, E(Fermi) = -0.1 a.u.
+        #     MO Eigenvalue [a.u.]      Occupation      s      py      pz ...
+               1     -0.8765    2.000   0.123 ...
+        """
+        with open(fname, 'r') as f:
+            title = f.readline()
+            header = f.readline()
+
+        match = re.search(r'E\(Fermi\) =\s+([-\d\.]+) a.u.', title)
+        if not match:
+            raise ValueError("Unable to parse Fermi energy from {}".format(fname))
+        self.fermi = float(match.group(1)) * atc.Ha / atc.eV
+
+        match = re.search(r'(?:kind|list)\s+(\S+)', title)
+        kind = match.group(1) if match else os.path.basename(fname)
+        orbitals = header.split('Occupation')[-1].split()
+
+        A = np.loadtxt(fname, ndmin=2)
+        if A.shape[1] != 3 + len(orbitals):
+            raise ValueError("Expected {} columns in {}, found {}"\
+                             .format(3 + len(orbitals), fname, A.shape[1]))
+
+        self.energies = A[:,1] * atc.Ha / atc.eV
+        self.occupations = A[:,2]
+        self.projections = A[:,3:]
+        self.channels = ['{}:{}'.format(kind, o) for o in orbitals]
+        self.spin = 1 if re.search('BETA', os.path.basename(fname)) else 0
+
+    @property
+    def nchannels(self):
+        return len(self.channels)
+
+    def merge(self, pdos):
+        """Adds channels of PDOS with the same levels (e.g. other kind)"""
+        if len(pdos.energies) != len(self.energies) or \
+           not np.allclose(pdos.energies, self.energies, atol=1e-6):
+            raise ValueError("Cannot merge PDOS with different levels.")
+        if pdos.spin != self.spin:
+            raise ValueError("Cannot merge PDOS of different spins.")
+        self.projections = np.hstack([self.projections, pdos.projections])
+        self.channels = self.channels + pdos.channels
+
+    def grouping(self, groups):
+        """Returns (names, matrix) for summing channels into groups.
+
+        groups: dictionary {name: [pattern, ...]} or list of patterns,
+            where pattern matches channel 'kind:orbital' if it equals
+            'kind:orbital', 'kind', 'orbital' or the angular momentum of
+            the orbital (e.g. 'p' for 'px', 'py', 'pz').
+            Channels without kind prefix (e.g. 's') match by orbital only.
+
+        The matrix has shape (nchannels, ngroups).
+        """
+        if not isinstance(groups, dict):
+            groups = dict([(g, [g]) for g in groups])
+        names = list(groups.keys())
+
+        labels = []
+        for c in self.channels:
+            # channels without kind prefix, e.g. 's' or 'total'
+            kind, orbital = c.split(':', 1) if ':' in c else (None, c)
+            labels.append((c, kind, orbital))
+        matrix = np.zeros((self.nchannels, len(names)))
+        for j, name in enumerate(names):
+            for i, (label, kind, orbital) in enumerate(labels):
+                for p in groups[name]:
+                    if p in (label, kind, orbital, orbital[:1]):
+                        matrix[i, j] = 1.0
+                        break
+        return names, matrix
+
+    def dos(self, groups=None, bmethod = 'Gaussian', bepsilon = 1e-3,
+            FWHM = 0.1, delta_e = 0.005, method = 'fft', egrid = None):
+        """
+        Returns (energy, names, projected density of states).
+
+        All PDOS curves are computed in one call to asetk.atomistic.dos.dos,
+        with weights given by a single matrix product of the projections
+        and the grouping matrix.
+
+        groups: see grouping. By default, one PDOS per channel.
+        egrid: equidistant energy grid [eV], see asetk.atomistic.dos.dos
+        For documentation of the other parameters, see
+          asetk.atomistic.fundamental.EnergyLevels.dos
+
+        The PDOS has shape [nFWHM,] ngroups, nE.
+        """
+        import asetk.atomistic.dos as dos
+
+        if groups is None:
+            names, matrix = self.channels, np.eye(self.nchannels)
+        else:
+            names, matrix = self.grouping(groups)
+
+        weights = np.dot(self.projections, matrix).T
+        E, PDOS = dos.dos(self.energies, weights, egrid=egrid, bmethod=bmethod,
+                          FWHM=FWHM, bepsilon=bepsilon, delta_e=delta_e,
+                          method=method)
+        return E, names, PDOS
+
+    def __str__(self):
+        text  = "PDOS of {} levels, spin {}, {} channels"\
+                .format(len(self.energies), self.spin + 1, self.nchannels)
+        if self.fermi is not None:
+            text += ", Fermi energy {:.3f} eV".format(self.fermi)
+        return text
+
 class WfnCube(cube.Cube):
     """Gaussian cube file written by CP2K
 
@@ -285,6 +717,8 @@ class WfnCube(cube.Cube):
     comment line of the cube file
     """
 
+    commentregex = r'WAVEFUNCTION\s+(\d+)\s+spin\s+(\d+)'
+
     def __init__(self, title=None, comment=None, origin=None, atoms=None, 
                  data=None, spin=None, wfn=None, energy=None, occupation=None):
         """Standard constructor, all parameters default to None.
@@ -293,28 +727,204 @@ class WfnCube(cube.Cube):
         but can be assigned by linking the cube file with the 
         output from the calculation.
         """
-        super(WfnCube, self).__init__(title,comment,origin,atoms,data)
+        super(WfnCube, self).__init__(title=title, comment=comment,
+                                      origin=origin, atoms=atoms, data=data)
         self.spin = spin
         self.wfn  = wfn
         self.energy = energy
         self.occupation = occupation
 
     @classmethod
-    def from_file(cls, fname, read_data=False):
+    def from_file(cls, fname, read_data=False, engine=None, cache=None):
         """Creates Cube from cube file"""
         tmp = WfnCube()
-        tmp.read_cube_file(fname, read_data=read_data)
+        tmp.read_cube_file(fname, read_data=read_data, engine=engine,
+                           cache=cache)
         return tmp
 
-    def read_cube_file(self, fname, read_data=False, v=1):
+    def read_cube_file(self, fname, read_data=False, v=1, engine=None,
+                       cache=None):
             """Reads header and/or data of cube file"""
-            super(WfnCube, self).read_cube_file(fname, read_data, v)
+            super(WfnCube, self).read_cube_file(fname, read_data, v, engine,
+                                                cache)
 
             # CP2K stores information on the level/spin index
             # in the comment line
-            commentregex = 'WAVEFUNCTION\s+(\d+)\s+spin\s+(\d+)'
-            match = re.search(commentregex, self.comment)
+            match = re.search(self.commentregex, self.comment)
             self.wfn = int(match.group(1))
             self.spin = int(match.group(2))
 
 
+
+
+def _read_wfn_label(fname):
+    """Returns (spin, wfn) from comment line of CP2K cube file.
+
+    Only the first two lines of the file are read.
+    """
+    if npzcube.is_npz(fname):
+        c = WfnCube.from_file(fname)
+        return c.spin, c.wfn
+
+    with open(fname, 'rb') as f:
+        f.readline()
+        comment = f.readline().decode('utf-8', 'replace')
+    match = re.search(WfnCube.commentregex, comment)
+    if match is None:
+        raise ValueError("No wave function index in comment of {}"\
+                         .format(fname))
+    return int(match.group(2)), int(match.group(1))
+
+class WfnCubeSet(object):
+    """Wave function cube files of CP2K indexed by (spin, wfn)
+
+    Only the comment line of each cube file is read to determine spin and
+    index of the level (starting from 1, as in CP2K).
+    The cubes of the set carry filename, spin, wfn and, after join with a
+    Spectrum, energy and occupation. Use header() to read the full header
+    of a cube file.
+
+    The labels of all cube files in a directory are stored in an index file
+    within the directory, which is used as long as size and modification
+    time of the cube files match.
+    """
+
+    indexname = '.wfncubes.json'
+
+    def __init__(self, fnames=None, workers=8, use_index=True):
+        """Set up set of cube files
+
+        Parameters
+        ----------
+        fnames: names of cube files
+        workers: number of threads reading the comment lines
+        use_index: read and update index files in the directories
+        """
+        self.cubes = {}
+        if fnames is not None:
+            self.add(fnames, workers, use_index)
+
+    @classmethod
+    def from_files(cls, fnames, workers=8, use_index=True):
+        tmp = WfnCubeSet(fnames, workers, use_index)
+        return tmp
+
+    def __len__(self):
+        return len(self.cubes)
+
+    def __contains__(self, key):
+        return key in self.cubes
+
+    def __getitem__(self, key):
+        """Returns cube of (spin, wfn)"""
+        return self.cubes[key]
+
+    def __iter__(self):
+        """Iterates over cubes, sorted by spin and wfn"""
+        for key in sorted(self.cubes):
+            yield self.cubes[key]
+
+    def get(self, key, default=None):
+        return self.cubes.get(key, default)
+
+    def keys(self):
+        return sorted(self.cubes)
+
+    @staticmethod
+    def _stamp(fname):
+        st = os.stat(fname)
+        return [st.st_size, st.st_mtime_ns]
+
+    def _read_index(self, directory):
+        """Returns dictionary {basename: [size, mtime, spin, wfn]}"""
+        fname = os.path.join(directory, self.indexname)
+        try:
+            with open(fname, 'r') as f:
+                return json.load(f)
+        except (IOError, OSError, ValueError):
+            return {}
+
+    def _write_index(self, directory, index):
+        fname = os.path.join(directory, self.indexname)
+        tmp = '{}.{}.tmp'.format(fname, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp, fname)
+        except (IOError, OSError):
+            # e.g. directory not writable
+            pass
+
+    def add(self, fnames, workers=8, use_index=True):
+        """Adds cube files to the set
+
+        If several files have the same (spin, wfn), the first one is kept.
+        """
+        fnames = list(fnames)
+        labels = [None] * len(fnames)
+        stamps = [self._stamp(f) for f in fnames]
+
+        # look up labels in index files of the directories
+        indices = {}
+        for i, fname in enumerate(fnames):
+            directory, base = os.path.split(os.path.abspath(fname))
+            if not use_index:
+                continue
+            if directory not in indices:
+                indices[directory] = self._read_index(directory)
+            entry = indices[directory].get(base)
+            if entry is not None and entry[:2] == stamps[i]:
+                labels[i] = tuple(entry[2:])
+
+        missing = [i for i in range(len(fnames)) if labels[i] is None]
+        if len(missing) > 1 and workers > 1:
+            from multiprocessing.pool import ThreadPool
+            pool = ThreadPool(min(workers, len(missing)))
+            try:
+                read = pool.map(_read_wfn_label, [fnames[i] for i in missing])
+            finally:
+                pool.close()
+        else:
+            read = [_read_wfn_label(fnames[i]) for i in missing]
+
+        updated = set()
+        for i, label in zip(missing, read):
+            labels[i] = label
+            directory, base = os.path.split(os.path.abspath(fnames[i]))
+            if use_index:
+                indices[directory][base] = stamps[i] + list(label)
+                updated.add(directory)
+        for directory in updated:
+            self._write_index(directory, indices[directory])
+
+        for fname, (spin, wfn) in zip(fnames, labels):
+            if (spin, wfn) not in self.cubes:
+                c = WfnCube(spin=spin, wfn=wfn)
+                c.filename = fname
+                self.cubes[(spin, wfn)] = c
+
+    def join(self, spectrum):
+        """Attaches energies and occupations of Spectrum to the cubes
+
+        Cubes without corresponding level keep energy None.
+        """
+        levels = dict(zip(spectrum.spins, spectrum.energylevels))
+        for (spin, wfn), c in self.cubes.items():
+            el = levels.get(spin - 1)
+            if el is None or wfn > len(el):
+                continue
+            c.energy = el.energies[wfn - 1]
+            c.occupation = el.occupations[wfn - 1]
+
+    def header(self, key=None):
+        """Returns WfnCube with full header of (spin, wfn)
+
+        key: (spin, wfn), defaults to first cube of the set
+        """
+        if key is None:
+            key = self.keys()[0]
+        c = self.cubes[key]
+        h = WfnCube.from_file(c.filename)
+        h.energy = c.energy
+        h.occupation = c.occupation
+        return h
@@ -8,7 +8,317 @@ import numpy as np
 import copy  as cp
 import asetk.atomistic.fundamental as fu
 import asetk.atomistic.constants as constants
-import matplotlib.mlab as mlab
+import asetk.format.cubecache as cubecache
+import asetk.format.npzcube as npzcube
+import io
+import os
+import mmap
+
+
+# Engines for parsing the grid data of cube files.
+# Each engine converts a bytes buffer of whitespace-separated numbers
+# into a flat array of floats.
+
+def _parse_split(buf):
+    """Tokenizes with split(), then converts the list of tokens.
+
+    Keeps a Python string object for every value (slow, memory hungry).
+    """
+    return np.array(buf.split(), dtype=float)
+
+def _parse_numpy(buf):
+    """Tokenizes and converts in numpy's C parser without intermediate tokens"""
+    return np.fromstring(buf, dtype=float, sep=' ')
+
+def _parse_pandas(buf):
+    """Uses the C parser of pandas.read_csv.
+
+    Lines may hold different numbers of values (the last line of each
+    z-column can be shorter). The padding added by pandas is removed.
+    """
+    import pandas as pd
+
+    # At most one of two consecutive lines is a short one
+    ncol = max([len(l.split()) for l in buf[:4096].splitlines()[:8]] + [1])
+    try:
+        frame = pd.read_csv(io.BytesIO(buf), sep=r'\s+', header=None,
+                            names=list(range(ncol)), dtype=np.float64)
+    except (ValueError, pd.errors.ParserError):
+        # irregular layout, fall back to numpy
+        return _parse_numpy(buf)
+
+    data = frame.values.ravel()
+    if ncol > 1:
+        data = data[~np.isnan(data)]
+    return data
+
+# exact powers of ten up to 1e22, correctly rounded beyond
+_pow10 = np.array([10.0**k for k in range(309)])
+
+def _parse_fixedwidth(buf):
+    """Vectorized parser for numbers in fixed-width E format.
+
+    Cube files are written with a Fortran/C format such as E13.5,
+    i.e. every number occupies the same number of characters with the
+    decimal point and the exponent at fixed positions.
+    After removing the line breaks, the buffer is viewed as a
+    (width x nvalues) array of characters and the digits are combined
+    column by column.
+    Values are correctly rounded, if the decimal exponent of the last
+    digit lies within [-22, 22], and accurate to one unit in the last
+    place otherwise.
+    Falls back to the numpy parser, if the layout is not fixed-width.
+    """
+    line = buf[:buf.find(b'\n')].rstrip(b'\r')
+    ntokens = len(line.split())
+    if ntokens == 0 or len(line) % ntokens != 0:
+        return _parse_numpy(buf)
+    width = len(line) // ntokens
+    field = line[:width].upper()
+    pdot, pexp = field.find(b'.'), field.find(b'E')
+    if not 0 < pdot < pexp < width - 2:
+        return _parse_numpy(buf)
+
+    raw = np.frombuffer(buf, dtype=np.uint8)
+    raw = raw[(raw != ord('\n')) & (raw != ord('\r'))]
+    if raw.size % width != 0:
+        return _parse_numpy(buf)
+
+    # one row per character position within the field.
+    # Subtracting '0' maps digits to 0..9 and everything else to >= 10.
+    digits = np.ascontiguousarray(raw.reshape(-1, width).T)
+    digits -= np.uint8(ord('0'))
+    ten = np.uint8(10)
+    char = lambda c: np.uint8((ord(c) - ord('0')) % 256)
+
+    esign = digits[pexp+1]
+    if (digits[pdot] != char('.')).any() or \
+       ((digits[pexp] | np.uint8(32)) != char('e')).any() or \
+       ((esign != char('+')) & (esign != char('-'))).any() or \
+       digits[pdot+1:pexp].max() >= ten or digits[pexp+2:].max() >= ten:
+        return _parse_numpy(buf)
+
+    n = digits.shape[1]
+    itype = np.int32 if pexp <= 10 else np.int64
+    mantissa = np.zeros(n, dtype=itype)
+    negative = np.zeros(n, dtype=bool)
+    # integer part may be padded with blanks and contain the sign
+    for row in digits[:pdot]:
+        isdigit = row < ten
+        if isdigit.all():
+            mantissa *= 10
+            mantissa += row
+        elif not isdigit.any():
+            negative |= row == char('-')
+        else:
+            negative |= row == char('-')
+            mantissa = np.where(isdigit, mantissa * 10 + row, mantissa)
+    for row in digits[pdot+1:pexp]:
+        mantissa *= 10
+        mantissa += row
+
+    exponent = np.zeros(n, dtype=np.int32)
+    for row in digits[pexp+2:]:
+        exponent *= 10
+        exponent += row
+    exponent[esign == char('-')] *= -1
+    exponent -= pexp - pdot - 1
+    if np.abs(exponent).max() >= len(_pow10):
+        return _parse_numpy(buf)
+
+    data = mantissa.astype(np.float64)
+    scale = _pow10[np.abs(exponent)]
+    up = exponent >= 0
+    np.multiply(data, scale, out=data, where=up)
+    np.divide(data, scale, out=data, where=~up)
+    np.negative(data, out=data, where=negative)
+    return data
+
+parse_engines = {
+    'split': _parse_split,
+    'numpy': _parse_numpy,
+    'pandas': _parse_pandas,
+    'fixedwidth': _parse_fixedwidth,
+}
+default_engine = 'fixedwidth'
+
+def parse_data(buf, engine=None):
+    """Parses buffer of whitespace-separated numbers into flat float array.
+
+    Parameters
+    ----------
+    buf: bytes containing the numbers
+    engine: 'fixedwidth' (default), 'numpy', 'pandas' (requires pandas)
+        or 'split'. See scripts/cube-benchmark.py for a comparison.
+    """
+    if engine is None:
+        engine = default_engine
+    if engine not in parse_engines:
+        raise ValueError("Unknown parsing engine '{}'. Choose from {}."\
+                         .format(engine, sorted(parse_engines.keys())))
+    return parse_engines[engine](buf)
+
+def read_grid(f, shape, engine=None, chunksize=64*1024**2, out=None):
+    """Reads grid data from file object into array of given shape.
+
+    The text is read and parsed in chunks of chunksize bytes, which are
+    copied into a preallocated array. Peak memory is thus one copy of
+    the float grid plus a few chunks, independent of the file size.
+
+    Parameters
+    ----------
+    f: file object opened in binary mode, positioned at start of data
+    shape: shape of grid
+    engine: parsing engine, see parse_data
+    chunksize: number of bytes to read at once
+    out: array of given shape to fill (e.g. np.memmap)
+    """
+    n = int(np.prod(shape))
+    if out is None:
+        out = np.empty(shape)
+    data = out.reshape(n)
+    filled = 0
+    rest = b''
+
+    while True:
+        chunk = f.read(chunksize)
+        buf = rest + chunk
+        if chunk:
+            # only parse complete lines
+            cut = buf.rfind(b'\n') + 1
+            buf, rest = buf[:cut], buf[cut:]
+
+        if buf.strip():
+            values = parse_data(buf, engine=engine)
+            if filled + values.size > n:
+                raise ValueError("Found more than {} values in grid data."\
+                                 .format(n))
+            data[filled:filled+values.size] = values
+            filled += values.size
+
+        if not chunk:
+            break
+
+    if filled != n:
+        raise ValueError("Expected {} values in grid data, found {}."\
+                         .format(n, filled))
+
+    return out
+
+
+# int64 mantissas and the tie detection of _format_fixed are exact up to here
+_FIXED_MAX_PRECISION = 12
+
+def _format_fixed(values, precision):
+    """Formats values in E format of given precision without Python loops.
+
+    Produces the same characters as ' %{w}.{p}E' % value with w=p+7.
+    Exponent and digits are computed with numpy and written column by
+    column into a character array. Values close to a rounding tie, where
+    the floating point error of the scaled mantissa might change the last
+    digit, are formatted with printf.
+
+    Returns (nvalues, precision+8) array of characters or None, if the
+    values contain non-finite numbers or exponents with three digits, or
+    if precision > _FIXED_MAX_PRECISION.
+    """
+    p = precision
+    if p > _FIXED_MAX_PRECISION:
+        return None
+    a = np.abs(values)
+    if not np.isfinite(a).all():
+        return None
+
+    nonzero = a > 0
+    exponent = np.zeros(a.shape, dtype=np.int64)
+    exponent[nonzero] = np.floor(np.log10(a[nonzero]))
+    if np.abs(exponent).max() >= 99:
+        return None
+    scaled = lambda e: a * 10.0**(p - e)
+    mantissa = np.rint(scaled(exponent)).astype(np.int64)
+
+    # correct for rounding of log10 and mantissa (e.g. 9.999996 -> 1.00000E+01)
+    wrong = nonzero & ((mantissa >= 10**(p+1)) | (mantissa < 10**p))
+    if wrong.any():
+        exponent[wrong] += np.where(mantissa[wrong] >= 10**(p+1), 1, -1)
+        mantissa[wrong] = np.rint(scaled(exponent)[wrong]).astype(np.int64)
+    if np.abs(exponent).max() >= 100:
+        return None
+
+    # The scaled mantissa (< 10**(p+1)) carries a relative error of a few
+    # ulp, i.e. values this close to a tie may round either way.
+    x = scaled(exponent)
+    tol = 10.0**(p+1) * 8 * np.finfo(float).eps
+    ties = np.flatnonzero(np.abs(x - np.floor(x) - 0.5) <= tol)
+    ties = np.union1d(ties, np.flatnonzero(wrong))
+
+    w = p + 8
+    chars = np.empty((a.size, w), dtype=np.uint8)
+    chars[:, 0] = ord(' ')
+    chars[:, 1] = np.where(np.signbit(values), ord('-'), ord(' '))
+    for c in range(w - 5, 3, -1):
+        chars[:, c] = ord('0') + mantissa % 10
+        mantissa //= 10
+    chars[:, 2] = ord('0') + mantissa
+    chars[:, 3] = ord('.')
+    chars[:, w-4] = ord('E')
+    chars[:, w-3] = np.where(exponent < 0, ord('-'), ord('+'))
+    exponent = np.abs(exponent)
+    chars[:, w-2] = ord('0') + exponent // 10
+    chars[:, w-1] = ord('0') + exponent % 10
+
+    if len(ties):
+        fmt = ' %{}.{}E'.format(p + 7, p) * len(ties)
+        text = fmt % tuple(np.asarray(values)[ties].tolist())
+        chars[ties] = np.frombuffer(text.encode(), dtype=np.uint8).reshape(len(ties), w)
+    return chars
+
+def write_grid(f, data, precision=5, chunksize=2**20):
+    """Writes grid data in the layout of the specification.
+
+    Every z-column starts on a new line with 6 values per line in
+    format E13.5 (for precision=5).
+    Values are formatted by _format_fixed in chunks of about chunksize
+    values. Chunks with special values fall back to printf formatting
+    of the whole chunk with a single format string.
+
+    Parameters
+    ----------
+    f: file object opened in text mode
+    data: grid data of shape (nx, ny, nz)
+    precision: number of decimals
+    chunksize: number of values to format at once
+    """
+    nx, ny, nz = data.shape
+    fmt = ' %{}.{}E'.format(precision + 7, precision)
+    nfull, nrest = divmod(nz, 6)
+    colfmt = (fmt * 6 + '\n') * nfull
+    if nrest:
+        colfmt += fmt * nrest + '\n'
+    newline = lambda n: np.full((n, 1), ord('\n'), dtype=np.uint8)
+
+    ncols = max(1, chunksize // nz)
+    for ix in range(nx):
+        columns = data[ix]
+        for iy in range(0, ny, ncols):
+            block = columns[iy:iy+ncols]
+            n = len(block)
+            chars = _format_fixed(block.ravel(), precision)
+            if chars is None:
+                f.write(colfmt * n % tuple(block.ravel().tolist()))
+                continue
+
+            # arrange fields in lines of 6, each column starts a new line
+            chars = chars.reshape(n, nz, -1)
+            lines = []
+            if nfull:
+                full = chars[:, :6*nfull].reshape(n * nfull, -1)
+                lines.append(np.hstack([full, newline(n * nfull)]).reshape(n, -1))
+            if nrest:
+                rest = chars[:, 6*nfull:].reshape(n, -1)
+                lines.append(np.hstack([rest, newline(n)]))
+            f.write(np.hstack(lines).tobytes().decode())
+
 
 class Cube(object):
     """Stores data of a cube file.
@@ -40,6 +350,9 @@ class Cube(object):
         'z': 2,
     }
 
+    # bytes of memory-mapped grid data processed at once
+    blocksize = 64 * 1024**2
+
     def __init__(self, filename=None, title=None, comment=None, origin=None, 
                  atoms=None, data=None):
         """Standard constructur, all parameters default to None."""
@@ -50,6 +363,8 @@ class Cube(object):
         self.atoms = atoms
         self.data = data
         self._shape = None   # stores shape, if grid data isn't read
+        self._data_offset = None  # byte offset of grid data in file
+        self._index = None   # line offsets of grid data, see read_slab
 
     @classmethod
     def from_cube(cls, cube):
@@ -58,10 +373,15 @@ class Cube(object):
         return tmp
 
     @classmethod
-    def from_file(cls, fname, read_data=False):
-        """Creates Cube from cube file"""
+    def from_file(cls, fname, read_data=False, engine=None, cache=None):
+        """Creates Cube from cube file
+
+        cache: CubeCache for parsed grid data. Defaults to a cache in
+            $ASETK_CACHE_DIR, if set. Use cache=False to disable.
+        """
         tmp = Cube()
-        tmp.read_cube_file(fname, read_data=read_data)
+        tmp.read_cube_file(fname, read_data=read_data, engine=engine,
+                           cache=cache)
         return tmp
 
     @property
@@ -81,8 +401,8 @@ class Cube(object):
     def shape(self):
         if self.data is not None:
             return self.data.shape
-        elif self.shape_ is not None:
-            return self.shape_
+        elif self._shape is not None:
+            return self._shape
         else:
             return None
  
@@ -123,14 +443,33 @@ class Cube(object):
             text += 'spin {} : {}\n'.format(s, e.__str__())
         return text
 
-    def read_cube_file(self, fname, read_data=False, v=1):
+    def read_cube_file(self, fname, read_data=False, v=1, engine=None,
+                       cache=None):
         """Reads header and/or data of cube file
         
+        Files with extension .npz are read as compressed cube files,
+        see asetk.format.npzcube.
+
+        engine: engine for parsing the grid data, see parse_data
+        cache: CubeCache for parsed grid data, see from_file
         """
         self.filename = fname
 
-        f = open(fname, 'r')
-        readline = f.readline
+        if self._is_npz:
+            self._read_npz_file(fname, read_data)
+            return
+
+        if cache is None:
+            cache = cubecache.default_cache()
+        if read_data and cache:
+            entry = cache.load(fname)
+            if entry is not None:
+                header, self.data = entry
+                self._set_header(header)
+                return
+
+        f = open(fname, 'rb')
+        readline = lambda: f.readline().decode()
 
         self.title = readline()
         self.comment = readline()
@@ -149,7 +488,7 @@ class Cube(object):
             #if n % 2 == 1:
             #    n += 1
             cell[i] = n * np.array([x, y, z])
-        self.shape_ = shape
+        self._shape = shape
         cell = cell * b2A
 
         numbers = np.empty(natoms, int)
@@ -162,23 +501,268 @@ class Cube(object):
         positions *= b2A 
         self.atoms = fu.Atoms(numbers=numbers, positions=positions, cell=cell)
 
+        self._data_offset = f.tell()
+        self._index = None
+
         if read_data:
             # Note:
-            # This is already ~1.7x faster than ASE's version.
-            # However, parsing still dominates for reasonable disk speeds
-            # (parsing time = 8x reading time on 480 MB/s SSD)
-            # In order to parse quickly, use read_csv from the pandas module.
-
-            # read() pretty much maxes out the disk read speed.
-            # split() takes a considerable amount of time.
-            # The conversion to float is even more expensive.
-            self.data = np.array(f.read().split(), dtype=float)
-            self.data = self.data.reshape(shape)
+            # Tokenizing with split() and converting the list of tokens
+            # took 8x the reading time on a 480 MB/s SSD.
+            # The engines of parse_data avoid the list of tokens
+            # (see scripts/cube-benchmark.py), read_grid avoids holding
+            # the whole text in memory.
+            try:
+                self.data = read_grid(f, shape, engine=engine)
+            except ValueError as e:
+                raise ValueError("{}: {}".format(fname, e))
             #self.data.shape = shape
             #if axes != [0, 1, 2]:
 
+            if cache:
+                cache.store(fname, self._get_header(), self.data)
+
+        f.close()
+
+    def _read_npz_file(self, fname, read_data=False):
+        """Reads header and/or data of compressed cube file"""
+        header = npzcube.read_header(fname)
+        b2A = constants.a0 / constants.Angstrom
+
+        self.title = header['title']
+        self.comment = header['comment']
+        self.origin = header['origin'] * b2A
+        self._shape = header['shape']
+        cell = header['shape'][:, None] * header['voxel'] * b2A
+        self.atoms = fu.Atoms(numbers=header['numbers'],
+                              positions=header['positions'] * b2A, cell=cell)
+        self._data_offset = None
+        self._index = None
+
+        if read_data:
+            self.data = npzcube.read_data(fname)
+
+    @property
+    def _is_npz(self):
+        """True, if cube was read from compressed cube file"""
+        return npzcube.is_npz(self.filename)
+
+    def _get_header(self):
+        """Returns header information as dictionary of basic types"""
+        return {
+            'title': self.title,
+            'comment': self.comment,
+            'origin': self.origin.tolist(),
+            'cell': np.array(self.cell).tolist(),
+            'numbers': self.atoms.get_atomic_numbers().tolist(),
+            'positions': self.atoms.get_positions().tolist(),
+            'data_offset': self._data_offset,
+        }
+
+    def _set_header(self, header):
+        """Sets header information from dictionary, see _get_header"""
+        self.title = header['title']
+        self.comment = header['comment']
+        self.origin = np.array(header['origin'])
+        self.atoms = fu.Atoms(numbers=header['numbers'],
+                              positions=header['positions'],
+                              cell=header['cell'])
+        self._data_offset = header['data_offset']
+        self._index = None
+        if 'shape' in header:
+            self._shape = np.array(header['shape'])
+
+    def _build_index(self, chunksize=64*1024**2):
+        """Builds index of the lines of the grid data in the cube file.
+
+        Scans the file for line breaks and determines the layout of the
+        grid data, which may either start a new line for every z-column
+        (as required by the specification) or fill every line.
+        """
+        f = open(self.filename, 'rb')
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        size = len(mm)
+
+        offsets = [np.array([self._data_offset])]
+        for start in range(self._data_offset, size, chunksize):
+            chunk = np.frombuffer(mm, dtype=np.uint8, offset=start,
+                                  count=min(chunksize, size - start))
+            offsets.append(np.flatnonzero(chunk == ord('\n')) + start + 1)
+            del chunk
+        offsets = np.concatenate(offsets)
+        if offsets[-1] != size:
+            offsets = np.append(offsets, size)
+        # drop blank lines at end of file
+        while len(offsets) > 1 and not mm[offsets[-2]:offsets[-1]].strip():
+            offsets = offsets[:-1]
+
+        first = mm[offsets[0]:offsets[1]] if len(offsets) > 1 else b''
+        mm.close()
         f.close()
 
+        nx, ny, nz = self.shape
+        nlines = len(offsets) - 1
+        ncol = len(first.split())
+        if ncol == 0:
+            raise ValueError("No grid data found in {}".format(self.filename))
+
+        if nlines == nx * ny * (-(-nz // ncol)):
+            aligned = True
+        elif nlines == -(-nx * ny * nz // ncol):
+            aligned = False
+        else:
+            raise ValueError("Unable to determine layout of grid data in {}"\
+                             .format(self.filename))
+
+        self._index = (offsets, ncol, aligned)
+
+    def read_slab(self, x_range=None, y_range=None, z_range=None, engine=None):
+        """Reads rectangular part of the grid data from the cube file.
+
+        Only the lines of the cube file containing the requested values
+        are parsed. The line offsets are determined once and then stored
+        with the Cube.
+
+        Parameters
+        ----------
+        x_range, y_range, z_range: (start, stop) of indices to read.
+            Defaults to full range.
+        engine: parsing engine, see parse_data
+
+        Returns array of shape (len(x_range), len(y_range), len(z_range)).
+        """
+        ranges = []
+        for r, n in zip([x_range, y_range, z_range], self.shape):
+            start, stop = (0, n) if r is None else r
+            if not 0 <= start < stop <= n:
+                raise ValueError("Range {} out of bounds [0, {}]".format(r, n))
+            ranges.append(np.arange(start, stop))
+
+        return self._read_values(*ranges, engine=engine)
+
+    def _read_values(self, ix, iy, iz, engine=None):
+        """Reads grid values at all combinations of indices ix, iy, iz.
+
+        Returns array of shape (len(ix), len(iy), len(iz)).
+        """
+        nx, ny, nz = self.shape
+
+        if self._is_npz:
+            # decompresses only slabs along x that overlap with ix
+            slab = npzcube.read_data(self.filename, (np.min(ix), np.max(ix) + 1))
+            return slab[np.asarray(ix) - np.min(ix)][:, iy][:, :, iz]
+
+        ix, iy, iz = [np.asarray(i) for i in (ix, iy, iz)]
+        if self._index is None:
+            self._build_index()
+        offsets, ncol, aligned = self._index
+
+        # flat index of every requested value -> line and position in line
+        k = ((ix[:, None, None] * ny + iy[None, :, None]) * nz
+             + iz[None, None, :]).ravel()
+        if aligned:
+            lpc = -(-nz // ncol)   # lines per z-column
+            lines = k // nz * lpc + k % nz // ncol
+            pos = k % nz % ncol
+            counts = lambda l: np.where(l % lpc == lpc - 1,
+                                        nz - (lpc - 1) * ncol, ncol)
+        else:
+            nlines = len(offsets) - 1
+            lines = k // ncol
+            pos = k % ncol
+            counts = lambda l: np.where(l == nlines - 1,
+                                        nx * ny * nz - (nlines - 1) * ncol, ncol)
+
+        needed, inverse = np.unique(lines, return_inverse=True)
+        ncounts = counts(needed)
+        first = np.cumsum(ncounts) - ncounts
+
+        # read consecutive lines in one go
+        breaks = np.flatnonzero(np.diff(needed) != 1) + 1
+        starts = offsets[needed[np.r_[0, breaks]]]
+        ends = offsets[needed[np.r_[breaks - 1, len(needed) - 1]] + 1]
+
+        f = open(self.filename, 'rb')
+        mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        buf = b''.join([mm[a:b] for a, b in zip(starts, ends)])
+        mm.close()
+        f.close()
+
+        values = parse_data(buf, engine=engine)
+        if values.size != np.sum(ncounts):
+            raise ValueError("Unexpected number of values in grid data of {}"\
+                             .format(self.filename))
+
+        return values[first[inverse] + pos].reshape(len(ix), len(iy), len(iz))
+
+    def read_plane(self, dir, i, engine=None):
+        """Reads plane normal to direction 'dir' at index 'i' from cube file.
+
+        Unlike get_plane, reads only the required values from the file,
+        see read_slab.
+        """
+        return self.read_planes(dir, [i], engine=engine)[0]
+
+    def read_planes(self, dir, indices, engine=None):
+        """Reads planes normal to direction 'dir' at several indices.
+
+        All planes are read in a single pass over the cube file.
+        Returns array of shape (len(indices), ...).
+        """
+        if dir not in self.dir_indices:
+            raise ValueError("Direction must be 'x', 'y' or 'z'.")
+        d = self.dir_indices[dir]
+        indices = np.asarray(indices, dtype=int)
+        if np.any(indices < 0) or np.any(indices >= self.shape[d]):
+            raise ValueError("Indices {} out of bounds [0, {}]"\
+                             .format(indices, self.shape[d]))
+        ranges = [np.arange(n) for n in self.shape]
+        ranges[d] = indices
+
+        values = self._read_values(*ranges, engine=engine)
+        return np.moveaxis(values, d, 0)
+
+    def memmap(self, fname, engine=None):
+        """Moves grid data into .npy file and memory-maps it.
+
+        Afterwards, self.data is a np.memmap and only the parts of the grid
+        that are accessed are paged into memory.
+        If the grid data has not been read, it is parsed from the cube
+        file directly into the .npy file.
+        get_plane, get_avg, roll and += operate blockwise on memory-mapped
+        grid data.
+
+        fname: name of .npy file
+        engine: parsing engine, see parse_data
+        """
+        out = np.lib.format.open_memmap(fname, mode='w+', dtype=float,
+                                        shape=tuple([int(n) for n in self.shape]))
+        if self.data is None and self._is_npz:
+            npzcube.read_data(self.filename, out=out)
+        elif self.data is None:
+            f = open(self.filename, 'rb')
+            f.seek(self._data_offset)
+            read_grid(f, self.shape, engine=engine, out=out)
+            f.close()
+        else:
+            for block in self._xblocks():
+                out[block] = self.data[block]
+        out.flush()
+        del out
+
+        self.data = np.load(fname, mmap_mode='r+')
+
+    @property
+    def _is_store(self):
+        """True, if grid data is memory-mapped from writable .npy file"""
+        return isinstance(self.data, np.memmap) and self.data.mode in ['r+', 'w+']
+
+    def _xblocks(self):
+        """Yields slices along x covering about blocksize bytes of grid data"""
+        nx, ny, nz = self.shape
+        step = max(1, int(self.blocksize // (ny * nz * 8)))
+        for i in range(0, nx, step):
+            yield slice(i, min(i + step, nx))
+
     def resize(self, shape):
         """Resize dimensions of grid
 
@@ -198,19 +782,56 @@ class Cube(object):
         #       at the *end* of the array.
         #self.data = np.resize(self.data, shape)
 
-    def write_cube_file(self, fname=None):
+    def resample(self, shape, interpolation='fourier'):
+        """Resamples grid data on grid of given shape
+
+        The grid data is assumed to be periodic, the cell is not changed.
+
+        interpolation: 'fourier' (zero-padding or truncation in Fourier
+            space) or 'nearest', 'linear', 'cubic' (splines)
+        """
+        if interpolation == 'fourier':
+            self.data = fourier_resample(self.data, shape)
+        elif interpolation in Plane.interpolation_orders:
+            from scipy import ndimage
+            zoom = np.array(shape) / np.array(self.shape)
+            self.data = ndimage.zoom(self.data, zoom, mode='grid-wrap',
+                            grid_mode=True,
+                            order=Plane.interpolation_orders[interpolation])
+        else:
+            raise ValueError("Unknown interpolation '{}'.".format(interpolation))
+
+    def write_cube_file(self, fname=None, precision=5, mode='lossless'):
         """Writes Cube object to file
+
+        Files with extension .npz are written as compressed cube files,
+        see asetk.format.npzcube.
         
+        precision: number of decimals of grid data (specification: 5)
+        mode: 'lossless', 'float32' or 'quantized' for .npz files
         """
         if fname is None:
             fname = self.filename
 
+        A2b = constants.Angstrom / constants.a0
+        if npzcube.is_npz(fname):
+            header = {
+                'title': self.title,
+                'comment': self.comment,
+                'origin': self.origin * A2b,
+                'voxel': np.array(self.cell) * A2b \
+                         / np.array(self.shape)[:, None],
+                'numbers': self.atoms.get_atomic_numbers(),
+                'positions': self.atoms.get_positions() * A2b,
+            }
+            npzcube.write(fname, header, self.data, mode=mode)
+            return
+
         f = open(fname, 'w')
 
         f.write(self.title)
         f.write(self.comment)
 
-        A2b = constants.Angstrom / constants.a0 
         o = self.origin * A2b
         f.write('{:5d}{:12.6f}{:12.6f}{:12.6f}\n' \
             .format(len(self.atoms), o[0], o[1], o[2]))
@@ -227,15 +848,7 @@ class Cube(object):
         for Z, (x, y, z) in zip(numbers, positions): 
             f.write('{:5d}{:12.6f}{:12.6f}{:12.6f}{:12.6f}\n'.format(Z, 0.0, x, y, z) ) 
 
-        # TODO: Make 8-column format according to specs
-        self.data.tofile(f, sep='\n', format='%12.6e') 
-        #fmt=' %12.6e'
-        #for ix in range(self.shape[0]):
-        #    for iy in range(self.shape[1]):
-        #        for line in range(self.shape[2] // 8 ):
-        #            f.write(fmt*8.format(self.data[ix, iy, line*8 : (line+1)*8]))
-        #        left = self.shape[2] % 8
-        #        f.write(fmt*left.format(self.data[ix)
+        write_grid(f, self.data, precision=precision)
 
         f.close()
 
@@ -274,18 +887,21 @@ class Cube(object):
         """Returns z-index of plane at z=d above topmost atom
         
         d must be given in Angstroms.
+        The origin of the grid is taken into account, i.e. the index may
+        refer to a grid covering only a slab of the cell.
         """
 
         if from_below:
             zmin = np.min(self.atoms.positions[:,2])
-            zplane = zmmin - d
+            zplane = zmin - d
         else:
             zmax = np.max(self.atoms.positions[:,2])
             zplane = zmax + d
 
         dz = np.linalg.norm(self.dz)
-        iplane = int(round(zplane / dz))
-        zplanereal = iplane * dz
+        z0 = self.origin[2] if self.origin is not None else 0.0
+        iplane = int(round((zplane - z0) / dz))
+        zplanereal = z0 + iplane * dz
 
         if verbose:
             if from_below:
@@ -297,18 +913,39 @@ class Cube(object):
         return iplane 
 
     def get_plane_above_atoms(self, d, verbose=False, return_object=None,
-            replica=None, resample=None, from_below=False):
+            replica=None, resample=None, from_below=False,
+            interpolation='linear'):
         """Returns plane given by z=d above topmost atom
         
         d should be given in Angstroms.
+        If the grid data has not been read, only the plane is read from
+        the cube file.
         """
 
         iplane =  self.get_index_above_atoms(d, from_below, verbose=verbose)
         return self.get_plane('z', iplane, return_object=return_object,
-                              replica=replica, resample=resample)
+                              replica=replica, resample=resample,
+                              interpolation=interpolation)
+
+    def get_planes_above_atoms(self, heights, from_below=False):
+        """Returns array of planes at z=d above topmost atom for all heights
+
+        heights should be given in Angstroms.
+        If the grid data has not been read, all planes are read from the
+        cube file in a single pass (see read_planes).
+        """
+        indices = [self.get_index_above_atoms(d, from_below)
+                   for d in heights]
+        if self.data is None:
+            return self.read_planes('z', indices)
+        if min(indices) < 0 or max(indices) >= self.nz:
+            raise ValueError("Indices {} out of bounds [0, {}]"\
+                             .format(indices, self.nz))
+        return np.moveaxis(np.asarray(self.data[:, :, indices]), 2, 0)
 
     def get_isosurface_above_atoms(self, v, from_below=False, zcut=None, 
-            on_grid=False, return_object=None, replica=None, resample=None):
+            on_grid=False, return_object=None, replica=None, resample=None,
+            interpolation='linear'):
         """Returns z-values of isosurface
 
         Assumptions:
@@ -316,110 +953,115 @@ class Cube(object):
         - the tip cannot go below zcut
         
         Parameters:
+        - v:          isovalue or list of isovalues. For a list, a list of
+                      isosurfaces is returned, computed in a single pass
+                      over the grid data.
         - from_below: tip approaches from below instead of from above.
         - zcut:       minimum z-value [Angstroms] that can be reached by the tip
-                      (maximum z-value for approach from below)
+                      (maximum z-value for approach from below).
+                      z-values include the origin of the grid.
         - on_grid:    if true, no interpolation between grid points is performed
+        - replica, resample, interpolation: see get_plane. The isosurfaces
+                      of all isovalues are resampled together.
         """
-
-        plane = np.empty(self.shape[0:2])
-        missed = 0
+        isovalues = np.atleast_1d(v)
+        planes = np.empty((len(isovalues), self.nx, self.ny))
+        missed = np.zeros(len(isovalues), dtype=int)
 
         dz = np.linalg.norm(self.dz)
         nz = self.nz
+        # z-values refer to the cell, also for grids covering only a slab
+        z0 = self.origin[2] if self.origin is not None else 0.0
 
         if zcut is None:
-            zcut = dz*nz if from_below else 0.0
+            zcut = z0 + dz*nz if from_below else z0
 
+        # Only the slab between zcut and the end of the cell, from which
+        # the tip approaches, is scanned.
+        # The grid point of the crossing closest to the tip must lie
+        # within the slab.
+        kcut = (zcut - z0) / dz
         if from_below:
-            zmax = zcut
+            window = (0, max(0, min(nz, int(np.floor(kcut + 1e-9)) + 1)))
         else:
-            # the following is written for an "approach from below"
-            self.data = self.data[:,:,::-1]
-            zmax = nz*dz - zcut
-
-        # this is written for an "approach from below"
-        for i in range(self.nx):
-            for j in range(self.ny):
+            window = (min(nz, max(0, int(np.ceil(kcut - 1e-9)))), nz)
+        k0, nw = window[0], window[1] - window[0]
+
+        planes.fill(zcut)
+        # Note: Looping over the (i,j) columns in python took 160k
+        # iterations per isovalue for a 400x400 grid.
+        for block in self._xblocks() if nw > 0 else []:
+            data = self.data[block, :, window[0]:window[1]]
+            i, j = np.ogrid[:data.shape[0], :data.shape[1]]
+            for n, iso in enumerate(isovalues):
+                above = data > iso
                 # argmax returns index of first occurence of maximum value
-                itmp = np.argmax(self.data[i,j,:] > v)
-
-                if itmp == 0 or itmp * dz > zmax:
-                    plane[i,j] = zmax
-                    missed = missed + 1
-                elif on_grid:
-                    plane[i,j] = itmp * dz
+                if from_below:
+                    # first point above isovalue, seen from below
+                    k = np.argmax(above, axis=2)
+                    miss = ~above[i, j, k] | (k == 0)
+                    kn = np.maximum(k - 1, 0)
+                    sign = -1
+                else:
+                    # first point above isovalue, seen from above
+                    k = nw - 1 - np.argmax(above[:, :, ::-1], axis=2)
+                    miss = ~above[i, j, k] | (k0 + k == nz - 1)
+                    kn = np.minimum(k + 1, nw - 1)
+                    sign = 1
+
+                if on_grid:
+                    z = z0 + (k0 + k) * dz
                 else:
-                    greater = self.data[i,j,itmp]
-                    smaller = self.data[i,j,itmp-1]
-                    plane[i,j] = dz * (itmp - (greater - v)/(greater-smaller))
-
-        # revert back to original data set
-        if not from_below:
-            self.data = self.data[:,:,::-1]
-            plane = dz*nz - plane
-
-            ##v2
-            ## argmax returns index of first occurence of maximum value
-            #plane[i,j] = np.argmax(self.data[i,j,::-1] > v)
-            ## correcting for reversing the direction
-            #plane[i,j] = nz - plane[i,j] - 1 
-
-            #if plane[i,j] == nz -1 or plane[i,j] * dz < zmin:
-            #    plane[i,j] = zmin
-            #    missed = missed + 1
-            #elif on_grid:
-            #    plane[i,j] *= dz
-            #else:
-            #    greater = self.data[i,j,plane[i,j]]
-            #    smaller = self.data[i,j,plane[i,j]+1]
-            #    plane[i,j] = dz * (plane[i,j] \
-            #                 + (greater - v)/(greater-smaller))
-
-        ## 1st try, just iterating through the numpy array.
-        ## Turns out this is more than 40x slower than the version above.
-        #for i in range(self.shape[0]):
-        #    for j in range(self.shape[1]):
-
-        #        miss = True
-        #        last = self.data[i,j, self.shape[2]-1]
-        #        for k in range(self.shape[2] -2, -1, -1):
-        #            current = self.data[i,j,k]
-        #            if current >= v and last <= v \
-        #            or current <= v and last >= v:
-
-        #                if on_grid:
-        #                    plane[i,j] = k
-        #                else:
-        #                    # linear interpolation
-        #                    plane[i,j] = dZ * (k + (last - v)/(last - current))
-        #        if miss:
-        #            plane[i,j] = zmin
-        #            missed = missed + 1
-
-        print("{} z-values replaced by zcut = {}".format(missed,zcut))
+                    greater = data[i, j, k]
+                    smaller = data[i, j, kn]
+                    # columns with greater == smaller are misses
+                    with np.errstate(divide='ignore', invalid='ignore'):
+                        z = z0 + dz * (k0 + k + sign*(greater - iso)/(greater-smaller))
+
+                planes[n, block] = np.where(miss, zcut, z)
+                missed[n] += np.count_nonzero(miss)
+        if nw == 0:
+            missed[:] = self.nx * self.ny
 
         pextent, pdx, pdy = self.get_plane_extent('z', return_vectors=True)
 
-        plane = Plane(data=plane, origin=self.origin, dx=pdx, dy=pdy)
+        objects = []
+        for iso, plane, m in zip(isovalues, planes, missed):
+            if len(isovalues) > 1:
+                print("Isovalue {}: {} z-values replaced by zcut = {}"\
+                      .format(iso, m, zcut))
+            else:
+                print("{} z-values replaced by zcut = {}".format(m, zcut))
 
-        if replica:
-            plane.replicate(replica)
+            plane = Plane(data=plane, origin=self.origin, dx=pdx, dy=pdy)
+
+            if replica:
+                plane.replicate(replica)
+
+            objects.append(plane)
 
         if resample:
-            plane.resample(resample)
+            resample_planes(objects, resample, interpolation=interpolation)
 
         if return_object:
             # matplotlib will plot the 1st index along y
             # and the 2nd index along x
             #plane = plane.swapaxes(0,1)
 
-            return plane
+            results = objects
         else:
-            return plane.data
+            results = [plane.data for plane in objects]
 
-    def get_plane(self, dir, i, return_object=False, replica=None, resample=None):
+        if np.ndim(v) == 0:
+            return results[0]
+        return results
+
+    def get_plane(self, dir, i, return_object=False, replica=None, resample=None,
+                  interpolation='linear'):
         """Returns plane normal to direction 'dir' at index 'i'
+
+        If the grid data has not been read, only the plane is read from
+        the cube file (see read_plane).
          
         * return_object
             If True, returns Plane object (which knows about its extent).
@@ -428,19 +1070,25 @@ class Cube(object):
         * resample
             resample=[300, 400] will resample on rectangular grid with
             300x400 points.
+        * interpolation
+            used for resampling, see Plane.resample
 
         """
 
-        shape = self.data.shape
+        shape = self.shape
         dvs = self.atoms.cell / shape
         ls = [ np.linalg.norm(v) for v in self.atoms.cell ]
         o = self.origin
 
-        if dir is 'x' and i < shape[0]:
+        if self.data is None and dir in self.dir_indices \
+           and 0 <= i < shape[self.dir_indices[dir]]:
+            # grid data not in memory, read only the plane
+            plane = self.read_plane(dir, i)
+        elif dir is 'x' and 0 <= i < shape[0]:
             plane = self.data[i, :, :]
-        elif dir is 'y' and i < shape[1]:
+        elif dir is 'y' and 0 <= i < shape[1]:
             plane = self.data[:, i, :]
-        elif dir is 'z' and i < shape[2]:
+        elif dir is 'z' and 0 <= i < shape[2]:
             plane = self.data[:, :, i]
         else:
             msg  = "Direction {} not recognized or index {} out of bounds"\
@@ -448,6 +1096,10 @@ class Cube(object):
             msg += "\nDirection must be 'x', 'y' or 'z'."
             raise ValueError(msg)
 
+        if isinstance(plane, np.memmap):
+            # page in plane, detach from file
+            plane = np.array(plane)
+
         pextent, pdx, pdy = self.get_plane_extent(dir, return_vectors=True)
 
         plane = Plane(data=plane, origin=o, dx=pdx, dy=pdy)
@@ -457,7 +1109,7 @@ class Cube(object):
             plane.replicate(replica)
 
         if resample:
-            plane.resample(resample)
+            plane.resample(resample, interpolation=interpolation)
 
         if return_object:
             return plane
@@ -474,7 +1126,7 @@ class Cube(object):
              where pdx, pdy are the vectors of the plane grid.
         """
 
-        dvs = self.atoms.cell / self.data.shape
+        dvs = np.array(self.atoms.cell) / np.array(self.shape)[:, None]
         ls = [ np.linalg.norm(v) for v in self.atoms.cell ]
         o = self.origin
 
@@ -521,6 +1173,15 @@ class Cube(object):
     def get_avg(self, dir):
         """Returns average value of cube file along direction 'dir'."""
 
+        if isinstance(self.data, np.memmap) and dir in self.dir_indices:
+            # average block by block
+            blocks = [self.data[b] for b in self._xblocks()]
+            if dir == 'x':
+                return np.sum([np.sum(b, axis=0) for b in blocks], axis=0) \
+                       / self.nx
+            axis = self.dir_indices[dir]
+            return np.concatenate([np.mean(b, axis=axis) for b in blocks])
+
         if dir is 'x':
             return np.mean(self.data, axis=0)
         elif dir is 'y':
@@ -535,7 +1196,14 @@ class Cube(object):
         """Adds grid values of two cube files together"""
         if self.data.shape != c.data.shape:
             raise ValueError("Shape of cube files do not agree")
-        self.data += c.data
+
+        if isinstance(self.data, np.memmap) or isinstance(c.data, np.memmap):
+            if not self.data.flags.writeable:
+                self.data = np.array(self.data)
+            for block in self._xblocks():
+                self.data[block] += c.data[block]
+        else:
+            self.data += c.data
 
         return self
 
@@ -568,12 +1236,34 @@ class Cube(object):
 
         print("Rolling cube file by {:.3f} Angstroms along {}."\
                 .format(dist_exact,dir))
-        self.data = np.roll(self.data, shift=shift, axis=dir_index)
+        if self._is_store:
+            self._roll_store(shift, dir_index)
+        else:
+            self.data = np.roll(self.data, shift=shift, axis=dir_index)
 
         v = np.zeros(3)
         v[dir_index] = dist_exact
         self.atoms.translate(v)
 
+    def _roll_store(self, shift, axis):
+        """Rolls memory-mapped grid data block by block"""
+        fname = self.data.filename
+        tmp = fname + '.roll.tmp'
+        out = np.lib.format.open_memmap(tmp, mode='w+', dtype=self.data.dtype,
+                                        shape=self.data.shape)
+        for block in self._xblocks():
+            if axis == 0:
+                source = (np.arange(block.start, block.stop) - shift) % self.nx
+                out[block] = self.data[source]
+            else:
+                out[block] = np.roll(self.data[block], shift=shift, axis=axis)
+        out.flush()
+        del out
+
+        self.data = None
+        os.rename(tmp, fname)
+        self.data = np.load(fname, mmap_mode='r+')
+
 class Plane(object):
     """Stores a plane of a cube file.
     
@@ -643,36 +1333,109 @@ class Plane(object):
         self.extent[3] = (e[3] - e[2]) * replica[1]
 
 
-    def resample(self, npoints):
+    # spline order of interpolation methods, see resample
+    interpolation_orders = {
+        'nearest': 0,
+        'linear': 1,
+        'cubic': 3,
+    }
+
+    def resample(self, npoints, interpolation='linear', periodic=True):
+        """Resamples plane on rectangular grid
+
+        The rectangular grid covers the bounding box of the parallelogram
+        spanned by nx*dx and ny*dy. Values on the (possibly skewed) grid of
+        the plane are interpolated by splines using
+        scipy.ndimage.map_coordinates or by Fourier interpolation.
+
+        Parameters
+        ----------
+        npoints: [nx, ny] number of points of the rectangular grid
+        interpolation: 'nearest', 'linear', 'cubic' or 'fourier'.
+            'fourier' zero-pads the Fourier transform of the plane, which
+            is exact for band-limited periodic data. For skewed grids, the
+            grid refined this way is interpolated by cubic splines.
+        periodic: if True, the plane is continued periodically.
+            Else, values at the border are continued.
+        """
+        resample_planes([self], npoints, interpolation, periodic)
+
+
+def fourier_resample(data, shape):
+    """Resamples periodic data by Fourier interpolation
+
+    The Fourier transform is zero-padded (or truncated) along the last
+    len(shape) axes of data, i.e. a stack of planes of shape
+    (nplanes, nx, ny) is resampled at once.
+    """
+    from scipy import signal
+
+    for axis, n in zip(range(-len(shape), 0), shape):
+        if data.shape[axis] != n:
+            data = signal.resample(data, n, axis=axis)
+    return data
 
-        pdx = self.dx
-        pdy = self.dy
-        pnx = self.nx
-        pny = self.ny
-        o = self.origin
 
-        line = self.data.flatten()
-        pos   = [ o + i*pdx + j*pdy for i in range(pnx) for j in range(pny) ]
-        x,y,z = zip(*pos)
-     
-        extent = [np.min(x),np.max(x),np.min(y),np.max(y)]
-        xnew = np.linspace(extent[0], extent[1], npoints[0])
-        ynew = np.linspace(extent[2], extent[3], npoints[1])
-        dx = (extent[1]-extent[0]) / npoints[0]
-        dy = (extent[2]-extent[3]) / npoints[1]
-        self.dx = [dx, 0]
-        self.dy = [0, dy]
-     
-        # default interp='nn' needs mpl_toolkits.natgrid,
-        # which doesn't work on some machines
-        resampled = mlab.griddata(x, y, line,
-                                  xnew, ynew, interp='linear')
-        # translating the output from mlab to floats
-        resampled = np.array(resampled, dtype=float)
-
-        # in order to go back to the original data layout
-        # (1st index x, 2nd index y), we need to swap
-        self.data = resampled.swapaxes(0,1)
+def resample_planes(planes, npoints, interpolation='linear', periodic=True):
+    """Resamples Planes sharing the same grid on rectangular grid
+
+    The interpolation is batched over all planes, see Plane.resample.
+    """
+    from scipy import ndimage
+
+    if interpolation != 'fourier' \
+       and interpolation not in Plane.interpolation_orders:
+        raise ValueError("Unknown interpolation '{}'. Use one of {}"\
+                .format(interpolation,
+                        sorted(Plane.interpolation_orders) + ['fourier']))
+    if interpolation == 'fourier' and not periodic:
+        raise ValueError("Fourier interpolation requires periodic planes.")
+
+    p = planes[0]
+    # orthonormal frame of the plane, e1 along dx
+    pdx = np.array(p.dx, dtype=float)
+    pdy = np.array(p.dy, dtype=float)
+    e1 = pdx / np.linalg.norm(pdx)
+    e2 = pdy - np.dot(pdy, e1) * e1
+    e2 /= np.linalg.norm(e2)
+    # grid vectors in this frame (columns)
+    m = np.array([[np.dot(pdx, e1), np.dot(pdy, e1)],
+                  [0.0, np.dot(pdy, e2)]])
+
+    corners = np.dot(m, [[0, p.nx, 0, p.nx], [0, 0, p.ny, p.ny]])
+    lo = corners.min(axis=1)
+    step = (corners.max(axis=1) - lo) / np.array(npoints)
+    u = lo[0] + step[0] * np.arange(npoints[0])
+    v = lo[1] + step[1] * np.arange(npoints[1])
+
+    # grid indices of the new points
+    coords = np.tensordot(np.linalg.inv(m),
+                          np.array(np.meshgrid(u, v, indexing='ij')), axes=1)
+    data = np.array([q.data for q in planes])
+
+    if interpolation == 'fourier':
+        data = fourier_resample(data, npoints)
+        if abs(m[0, 1]) < 1e-10 * m[0, 0]:
+            # new grid is the refined grid of the plane
+            coords = None
+        else:
+            coords = coords * (np.array(npoints) / np.array([p.nx, p.ny]))\
+                         [:, None, None]
+        order = 3
+    else:
+        order = Plane.interpolation_orders[interpolation]
+
+    if coords is not None:
+        mode = 'grid-wrap' if periodic else 'nearest'
+        data = [ndimage.map_coordinates(d, coords, mode=mode, order=order)
+                for d in data]
+
+    for q, d in zip(planes, data):
+        q.data = d
+        if q.origin is not None and len(q.origin) == len(e1):
+            q.origin = q.origin + lo[0] * e1 + lo[1] * e2
+        q.dx = step[0] * e1
+        q.dy = step[1] * e2
 
 
 class STSCube(Cube):
@@ -682,11 +1445,12 @@ class STSCube(Cube):
     one of energy.
     """
 
-    def read_cube_file(self, fname, read_data=False, v=1):
+    def read_cube_file(self, fname, read_data=False, v=1, engine=None,
+                       cache=None):
         """Reads header and/or data of cube file
         
         """
-        super(STSCube, self).read_cube_file(fname, read_data, v)
+        super(STSCube, self).read_cube_file(fname, read_data, v, engine, cache)
 
         # undo scaling of z-axis (units are eV)
         b2A = constants.a0 / constants.Angstrom
@@ -694,9 +1458,134 @@ class STSCube(Cube):
         self.cell[2] /= b2A
 
     @classmethod
-    def from_file(cls, fname, read_data=False):
+    def from_file(cls, fname, read_data=False, engine=None, cache=None):
         """Creates Cube from cube file"""
         tmp = STSCube()
-        tmp.read_cube_file(fname, read_data=read_data)
+        tmp.read_cube_file(fname, read_data=read_data, engine=engine,
+                           cache=cache)
         return tmp
     
+
+
+# Parallel reading of many cube files.
+# Grids are passed from the worker processes through shared memory,
+# since pickling multi-hundred-MB grids through pipes is slow.
+
+def _to_shared(data):
+    """Copies array into new shared memory block, returns its description"""
+    from multiprocessing import shared_memory
+
+    data = np.ascontiguousarray(data)
+    shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+    np.ndarray(data.shape, data.dtype, buffer=shm.buf)[...] = data
+    shm.close()
+    return shm.name, data.shape, data.dtype.str
+
+def _from_shared(name, shape, dtype):
+    """Copies array out of shared memory block and frees the block
+
+    While copying, the grid is held twice in memory. The block is freed
+    right away, since an array viewing the block would keep the block
+    exported and prevent it from being closed cleanly.
+    """
+    from multiprocessing import shared_memory
+
+    shm = shared_memory.SharedMemory(name=name)
+    data = np.ndarray(shape, dtype, buffer=shm.buf).copy()
+    shm.close()
+    shm.unlink()
+    return data
+
+def _load(path, func=None, engine=None):
+    """Returns grid data of cube file or func(Cube) of header-only Cube"""
+    if func is None:
+        return Cube.from_file(path, read_data=True, engine=engine).data
+    return np.asarray(func(Cube.from_file(path)))
+
+def _load_worker(args):
+    try:
+        return _to_shared(_load(*args))
+    except ImportError:
+        # no shared memory (Python < 3.8), data is pickled
+        return _load(*args)
+
+def iter_grids(paths, func=None, workers=None, engine=None):
+    """Yields grid data of cube files, read in worker processes.
+
+    Parameters
+    ----------
+    paths: names of cube files
+    func: if specified, func(c) is yielded instead of the grid data, where
+        c is the header-only Cube of the file (e.g. to read single planes).
+        Must be picklable, i.e. a module-level function or a
+        functools.partial thereof.
+    workers: number of worker processes, defaults to number of CPUs.
+        For workers=1, files are read in the calling process.
+    engine: parsing engine, see parse_data
+
+    The arrays are yielded in the order of paths.
+    At most 2*workers files are read ahead of the consumer, i.e. a slow
+    consumer bounds the number of grids held in (shared) memory.
+    """
+    import multiprocessing as mp
+    import collections
+
+    paths = list(paths)
+    if workers is None:
+        workers = mp.cpu_count()
+    workers = min(workers, len(paths))
+
+    if workers <= 1:
+        for path in paths:
+            yield _load(path, func, engine)
+        return
+
+    try:
+        # workers register shared memory with the tracker of this process,
+        # which frees blocks that are not consumed (e.g. on interrupt)
+        from multiprocessing import resource_tracker
+        resource_tracker.ensure_running()
+    except ImportError:
+        pass
+
+    pool = mp.Pool(workers)
+    try:
+        pending = collections.deque()
+        tasks = iter(paths)
+        for path in tasks:
+            pending.append(pool.apply_async(_load_worker, ((path, func, engine),)))
+            if len(pending) == 2 * workers:
+                break
+        while pending:
+            result = pending.popleft().get()
+            # submit next file only once a result has been consumed
+            for path in tasks:
+                pending.append(pool.apply_async(_load_worker,
+                                                ((path, func, engine),)))
+                break
+            if isinstance(result, tuple):
+                yield _from_shared(*result)
+            else:
+                yield result
+    finally:
+        pool.terminate()
+        pool.join()
+
+def load_many(paths, workers=None, reduce=None, func=None, engine=None):
+    """Reads grid data of many cube files in parallel.
+
+    Parameters
+    ----------
+    paths, workers, func, engine: see iter_grids
+    reduce: if specified, binary function combining the arrays of all
+        files (e.g. np.add), applied as the arrays arrive.
+        Else, the list of arrays is returned.
+    """
+    grids = iter_grids(paths, func=func, workers=workers, engine=engine)
+    if reduce is None:
+        return list(grids)
+
+    result = None
+    for data in grids:
+        result = data if result is None else reduce(result, data)
+    return result
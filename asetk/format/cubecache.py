@@ -0,0 +1,277 @@
+"""Binary cache for parsed cube files
+
+Parsing the ASCII grid of a cube file is slow. The CubeCache stores the
+parsed grid as .npy file next to a .json file with the header, such that
+repeated reads of the same cube file merely memory-map the grid.
+
+The cache is used by asetk.format.cube.Cube.from_file, if the
+environment variable ASETK_CACHE_DIR is set (or a CubeCache is passed
+explicitly). ASETK_CACHE_SIZE sets the maximum size of the cache in GB.
+
+The PlaneCache stores planes extracted from many cube files (e.g. at a
+given height above the atoms) in a single .npz file.
+"""
+
+import os
+import json
+import hashlib
+import zipfile
+import warnings
+import numpy as np
+
+class CubeCache(object):
+    """Stores grid data of cube files in binary form.
+
+    Entries are keyed by absolute path, size and modification time of the
+    cube file, i.e. modified cube files are parsed again.
+    When the cache exceeds maxsize, the least recently used entries are
+    removed.
+    """
+
+    def __init__(self, directory=None, maxsize=None):
+        """Set up cache.
+
+        directory: cache directory, defaults to $ASETK_CACHE_DIR or
+            ~/.cache/asetk
+        maxsize: maximum size of cache in bytes, defaults to
+            $ASETK_CACHE_SIZE GB or 10 GB
+        """
+        if directory is None:
+            directory = os.environ.get('ASETK_CACHE_DIR',
+                            os.path.join(os.path.expanduser('~'), '.cache', 'asetk'))
+        if maxsize is None:
+            maxsize = float(os.environ.get('ASETK_CACHE_SIZE', 10)) * 1024**3
+
+        self.directory = directory
+        self.maxsize = maxsize
+
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+    def key(self, fname):
+        """Returns cache key of cube file"""
+        st = os.stat(fname)
+        s = "{}:{}:{}".format(os.path.abspath(fname), st.st_size, st.st_mtime_ns)
+        return hashlib.sha1(s.encode()).hexdigest()
+
+    def _paths(self, key):
+        base = os.path.join(self.directory, key)
+        return base + '.npy', base + '.json'
+
+    def load(self, fname):
+        """Returns (header, data) of cube file or None, if not cached.
+
+        The data is memory-mapped copy-on-write, i.e. it may be modified
+        without affecting the cache.
+        """
+        npyfile, jsonfile = self._paths(self.key(fname))
+        if not (os.path.isfile(npyfile) and os.path.isfile(jsonfile)):
+            return None
+
+        try:
+            with open(jsonfile, 'r') as f:
+                header = json.load(f)
+            data = np.load(npyfile, mmap_mode='c')
+        except (IOError, ValueError):
+            # incomplete entry
+            return None
+        if list(data.shape) != header['shape']:
+            return None
+
+        # mark as recently used
+        os.utime(npyfile, None)
+        os.utime(jsonfile, None)
+
+        return header, data
+
+    def store(self, fname, header, data):
+        """Stores header (dict) and data of cube file"""
+        if data.nbytes > self.maxsize:
+            return
+
+        npyfile, jsonfile = self._paths(self.key(fname))
+        header = dict(header, shape=list(data.shape), source=os.path.abspath(fname))
+
+        # write to temporary files first, so that other processes
+        # never see incomplete entries
+        tmp = '{}.{}.tmp'.format(npyfile, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.save(f, data)
+        os.replace(tmp, npyfile)
+        tmp = '{}.{}.tmp'.format(jsonfile, os.getpid())
+        with open(tmp, 'w') as f:
+            json.dump(header, f)
+        os.replace(tmp, jsonfile)
+
+        self.evict()
+
+    def entries(self):
+        """Returns list of (last use, size, key) of cached entries"""
+        entries = []
+        for name in os.listdir(self.directory):
+            if not name.endswith('.npy'):
+                continue
+            key = name[:-len('.npy')]
+            try:
+                size = 0
+                for path in self._paths(key):
+                    if os.path.isfile(path):
+                        size += os.path.getsize(path)
+                used = os.path.getmtime(self._paths(key)[0])
+            except OSError:
+                # removed by other process
+                continue
+            entries.append((used, size, key))
+        return entries
+
+    @property
+    def size(self):
+        """Returns total size of cached entries in bytes"""
+        return sum([e[1] for e in self.entries()])
+
+    def evict(self):
+        """Removes least recently used entries until cache fits maxsize"""
+        entries = sorted(self.entries())
+        total = sum([e[1] for e in entries])
+
+        for used, size, key in entries:
+            if total <= self.maxsize:
+                break
+            for path in self._paths(key):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total -= size
+
+    def clear(self):
+        """Removes all entries"""
+        maxsize = self.maxsize
+        self.maxsize = 0
+        self.evict()
+        self.maxsize = maxsize
+
+
+class PlaneCache(object):
+    """Stores planes extracted from cube files in a single .npz file.
+
+    Entries are keyed by absolute path of the cube file, height of the plane
+    and whether the cube file contains the squared wave function.
+    Entries are valid only as long as size and modification time of the
+    cube file match, stale entries are removed on lookup and when saving.
+    """
+
+    def __init__(self, fname):
+        """Set up cache and read entries from fname, if it exists."""
+        self.fname = fname
+        self.planes = {}
+        self.modified = False
+        self.planes.update(self._read())
+
+    def _read(self):
+        """Returns dictionary of entries stored in file"""
+        planes = {}
+        if not os.path.isfile(self.fname):
+            return planes
+
+        try:
+            npz = np.load(self.fname)
+            sources = npz['sources']
+            heights = npz['heights']
+            psisquared = npz['psisquared']
+            stamps = npz['stamps']
+            for i in range(len(sources)):
+                key = (str(sources[i]), float(heights[i]), bool(psisquared[i]))
+                planes[key] = (tuple(stamps[i]), npz['plane_{}'.format(i)])
+            npz.close()
+        except (IOError, ValueError, KeyError, zipfile.BadZipfile):
+            warnings.warn("Ignoring corrupt plane cache {}".format(self.fname))
+            return {}
+
+        return planes
+
+    @staticmethod
+    def key(fname, height, psisquared=False):
+        """Returns key of plane at given height from cube file"""
+        return (os.path.abspath(fname), float(height), bool(psisquared))
+
+    @staticmethod
+    def stamp(fname):
+        """Returns (size, modification time) of cube file"""
+        st = os.stat(fname)
+        return (st.st_size, st.st_mtime_ns)
+
+    def _valid(self, key):
+        """Whether entry is up to date with its cube file"""
+        try:
+            return self.planes[key][0] == self.stamp(key[0])
+        except OSError:
+            return False
+
+    def get(self, fname, height, psisquared=False):
+        """Returns cached plane or None, if not cached."""
+        key = self.key(fname, height, psisquared)
+        if key not in self.planes:
+            return None
+        if not self._valid(key):
+            del self.planes[key]
+            self.modified = True
+            return None
+        return self.planes[key][1]
+
+    def set(self, fname, height, plane, psisquared=False):
+        """Stores plane at given height from cube file"""
+        key = self.key(fname, height, psisquared)
+        self.planes[key] = (self.stamp(fname), np.array(plane, dtype=float))
+        self.modified = True
+
+    def __len__(self):
+        return len(self.planes)
+
+    def prune(self):
+        """Removes entries of modified or deleted cube files"""
+        for key in list(self.planes.keys()):
+            if not self._valid(key):
+                del self.planes[key]
+                self.modified = True
+
+    def save(self):
+        """Writes entries to file, if modified.
+
+        Entries added to the file by other processes in the meantime are
+        kept. Note that the whole file is read and rewritten, i.e. the cost
+        grows with the number of cached planes. Call save once after
+        adding many planes rather than after each one.
+        """
+        if not self.modified:
+            return
+        for key, entry in self._read().items():
+            if key not in self.planes:
+                self.planes[key] = entry
+        self.prune()
+
+        keys = sorted(self.planes.keys())
+        arrays = {
+            'sources': np.array([k[0] for k in keys], dtype=str),
+            'heights': np.array([k[1] for k in keys], dtype=float),
+            'psisquared': np.array([k[2] for k in keys], dtype=bool),
+            'stamps': np.array([self.planes[k][0] for k in keys],
+                               dtype=np.int64).reshape(-1, 2),
+        }
+        for i, k in enumerate(keys):
+            arrays['plane_{}'.format(i)] = self.planes[k][1]
+
+        # write to temporary file first, so that other processes
+        # never see incomplete files
+        tmp = '{}.{}.tmp'.format(self.fname, os.getpid())
+        with open(tmp, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp, self.fname)
+        self.modified = False
+
+
+def default_cache():
+    """Returns CubeCache, if ASETK_CACHE_DIR is set, else None"""
+    if os.environ.get('ASETK_CACHE_DIR'):
+        return CubeCache()
+    return None
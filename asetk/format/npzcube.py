@@ -0,0 +1,163 @@
+"""Compressed binary container for cube data
+
+Stores header and grid of a Gaussian cube file in a numpy .npz archive.
+The grid is split into slabs along x, each of which is compressed
+separately. Slabs can thus be decompressed independently and writing
+never holds more than one compressed slab in memory.
+
+Before compression, the bytes of the values are shuffled (all first bytes,
+then all second bytes, ...), which makes smooth grids compress much
+better with deflate.
+
+Modes of storing the grid:
+ - 'lossless':  float64
+ - 'float32':   float32, relative error below 6e-8
+ - 'quantized': 16-bit linear quantization per slab, absolute error below
+                (max - min) / 131070 of the slab
+
+Lengths are stored in atomic units, as in the cube file.
+"""
+
+from __future__ import division
+import numpy as np
+import zipfile
+
+extension = '.npz'
+format_version = 1
+
+def is_npz(fname):
+    """True, if fname is the name of a compressed cube file"""
+    return fname is not None and fname.endswith(extension)
+
+modes = {
+    'lossless': np.float64,
+    'float32': np.float32,
+    'quantized': np.uint16,
+}
+
+
+def _shuffle(a):
+    """Returns bytes of array, grouped by significance"""
+    return np.ascontiguousarray(a.reshape(-1).view(np.uint8)\
+               .reshape(-1, a.itemsize).T)
+
+def _unshuffle(s, dtype):
+    """Inverts _shuffle"""
+    return np.ascontiguousarray(s.T).view(dtype).reshape(-1)
+
+def _write_member(zf, name, array):
+    """Writes array to zip file as name.npy"""
+    with zf.open(name + '.npy', 'w', force_zip64=True) as f:
+        np.lib.format.write_array(f, np.asanyarray(array), allow_pickle=False)
+
+
+def write(fname, header, data, mode='lossless', chunksize=16*1024**2,
+          compresslevel=6):
+    """Writes cube to compressed .npz archive.
+
+    Parameters
+    ----------
+    fname: name of .npz file
+    header: dictionary with 'title', 'comment', 'origin' (3), 'voxel' (3x3),
+        'numbers' (natoms) and 'positions' (natoms x 3)
+    data: grid data, may be np.memmap
+    mode: 'lossless', 'float32' or 'quantized'
+    chunksize: uncompressed bytes per slab along x
+    compresslevel: zlib compression level 0-9
+    """
+    if mode not in modes:
+        raise ValueError("Unknown mode '{}'. Use one of {}"\
+                         .format(mode, sorted(modes.keys())))
+    dtype = modes[mode]
+    nx, ny, nz = data.shape
+    step = max(1, int(chunksize // (ny * nz * 8)))
+    chunks = np.append(np.arange(0, nx, step), nx)
+
+    zf = zipfile.ZipFile(fname, 'w', compression=zipfile.ZIP_DEFLATED,
+                         compresslevel=compresslevel)
+    _write_member(zf, 'format_version', format_version)
+    _write_member(zf, 'mode', mode)
+    _write_member(zf, 'shape', np.array(data.shape))
+    _write_member(zf, 'chunks', chunks)
+    for key in ['title', 'comment']:
+        _write_member(zf, key, np.array(header[key]))
+    for key in ['origin', 'voxel', 'positions']:
+        _write_member(zf, key, np.array(header[key], dtype=float))
+    _write_member(zf, 'numbers', np.array(header['numbers'], dtype=int))
+
+    quantization = np.zeros((len(chunks) - 1, 2))
+    for i in range(len(chunks) - 1):
+        slab = np.asarray(data[chunks[i]:chunks[i+1]], dtype=float)
+        if mode == 'quantized':
+            if not np.all(np.isfinite(slab)):
+                raise ValueError("Cannot quantize non-finite values.")
+            lo, hi = np.min(slab), np.max(slab)
+            scale = (hi - lo) / 65535 if hi > lo else 1.0
+            quantization[i] = lo, scale
+            slab = np.rint((slab - lo) / scale)
+        _write_member(zf, 'data_{}'.format(i), _shuffle(slab.astype(dtype)))
+    if mode == 'quantized':
+        _write_member(zf, 'quantization', quantization)
+
+    zf.close()
+
+
+def read_header(fname):
+    """Returns dictionary with header of .npz cube file, see write.
+
+    In addition to the header passed to write, contains 'shape' and 'mode'.
+    """
+    npz = np.load(fname)
+    header = {}
+    for key in ['title', 'comment', 'mode']:
+        header[key] = str(npz[key])
+    for key in ['origin', 'voxel', 'positions', 'numbers', 'shape']:
+        header[key] = npz[key]
+    npz.close()
+    return header
+
+
+def read_data(fname, x_range=None, out=None):
+    """Reads grid data of .npz cube file.
+
+    Only slabs overlapping with x_range are decompressed.
+
+    Parameters
+    ----------
+    fname: name of .npz file
+    x_range: (start, stop) of x indices to read, defaults to full range
+    out: array (e.g. np.memmap) to store the data in
+
+    Returns array of shape (len(x_range), ny, nz).
+    """
+    npz = np.load(fname)
+    if int(npz['format_version']) > format_version:
+        raise ValueError("{} requires newer version of asetk.".format(fname))
+    mode = str(npz['mode'])
+    nx, ny, nz = npz['shape']
+    chunks = npz['chunks']
+    if mode == 'quantized':
+        quantization = npz['quantization']
+
+    start, stop = (0, nx) if x_range is None else x_range
+    if not 0 <= start < stop <= nx:
+        raise ValueError("Range {} out of bounds [0, {}]".format(x_range, nx))
+    if out is None:
+        out = np.empty((stop - start, ny, nz))
+    elif out.shape != (stop - start, ny, nz):
+        raise ValueError("Output array has shape {}, expected {}"\
+                         .format(out.shape, (stop - start, ny, nz)))
+
+    first = np.searchsorted(chunks, start, side='right') - 1
+    last = np.searchsorted(chunks, stop, side='left')
+    for i in range(first, last):
+        slab = _unshuffle(npz['data_{}'.format(i)], modes[mode])
+        slab = slab.reshape(-1, ny, nz)
+        if mode == 'quantized':
+            lo, scale = quantization[i]
+            slab = slab * scale + lo
+        a, b = max(start, chunks[i]), min(stop, chunks[i+1])
+        out[a - start:b - start] = slab[a - chunks[i]:b - chunks[i]]
+
+    npz.close()
+    return out
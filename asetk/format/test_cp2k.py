@@ -0,0 +1,293 @@
+""" Tests for the CP2K formats
+
+"""
+from . import cp2k
+from . import cube
+import asetk.atomistic.fundamental as fu
+import unittest
+import tempfile
+import shutil
+import os
+import json
+import numpy as np
+import numpy.testing as nt
+import asetk.atomistic.constants as atc
+
+
+def write_pdos(fname, kind, orbitals, data):
+    """Writes .pdos file in CP2K format"""
+    with open(fname, 'w') as f:
+        f.write("# Projected DOS for atomic kind {} at iteration step i = 0, "
+                "E(Fermi) =    -0.100000 a.u.\n".format(kind))
+        f.write("#     MO Eigenvalue [a.u.]      Occupation"
+                + ''.join(['{:>20}'.format(o) for o in orbitals]) + "\n")
+        for i, row in enumerate(data):
+            f.write("{:8d}".format(i + 1)
+                    + ''.join(['{:20.8f}'.format(v) for v in row]) + "\n")
+
+
+class PDOS(unittest.TestCase):
+    """ Tests for the projected density of states
+
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        n = 20
+        rs = np.random.RandomState(0)
+        self.energies = np.sort(rs.rand(n)) - 0.5
+        occupations = np.where(self.energies < -0.1, 2.0, 0.0)
+        self.C = rs.rand(n, 4)
+        self.H = rs.rand(n, 1)
+        self.fnames = [os.path.join(self.tmpdir, 'run-ALPHA_k1-1.pdos'),
+                       os.path.join(self.tmpdir, 'run-ALPHA_k2-1.pdos')]
+        write_pdos(self.fnames[0], 'C', ['s', 'py', 'pz', 'px'],
+                   np.column_stack([self.energies, occupations, self.C]))
+        write_pdos(self.fnames[1], 'H', ['s'],
+                   np.column_stack([self.energies, occupations, self.H]))
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_merge(self):
+        """ Check merging of kinds and grouping of channels
+
+        """
+        pdos = cp2k.PDOS.from_files(self.fnames)
+        self.assertEqual(pdos.channels, ['C:s', 'C:py', 'C:pz', 'C:px', 'H:s'])
+        nt.assert_allclose(pdos.projections, np.hstack([self.C, self.H]),
+                           atol=1e-8)
+
+        names, m = pdos.grouping({'s': ['s'], 'p': ['p'], 'C': ['C'],
+                                  'Hs': ['H:s']})
+        w = np.dot(pdos.projections, m)
+        nt.assert_allclose(w[:, names.index('s')], self.C[:, 0] + self.H[:, 0],
+                           atol=1e-7)
+        nt.assert_allclose(w[:, names.index('p')], self.C[:, 1:].sum(axis=1),
+                           atol=1e-7)
+        nt.assert_allclose(w[:, names.index('C')], self.C.sum(axis=1),
+                           atol=1e-7)
+
+    def test_unprefixed(self):
+        """ Check grouping of channels without kind prefix
+
+        """
+        pdos = cp2k.PDOS(energies=self.energies, occupations=self.energies < 0,
+                         projections=self.C[:, :3],
+                         channels=['s', 'px', 'total'], fermi=0.0)
+        names, m = pdos.grouping(['s', 'p', 'total', 'C'])
+        nt.assert_array_equal(m, [[1, 0, 0, 0], [0, 1, 0, 0], [0, 0, 1, 0]])
+
+    def test_dos(self):
+        """ Check that channel PDOS add up to total DOS
+
+        """
+        pdos = cp2k.PDOS.from_files(self.fnames)
+        E, names, PDOS = pdos.dos(FWHM=[0.1, 0.2])
+        self.assertEqual(PDOS.shape, (2, 5, len(E)))
+
+        spectrum = cp2k.Spectrum.from_pdos(self.fnames[0])
+        E2, DOS = spectrum.dos(FWHM=0.1)
+        E3, names, CDOS = pdos.dos(['C'], FWHM=0.1, egrid=E2)
+        nt.assert_allclose(CDOS[0], DOS, atol=1e-8)
+
+
+def write_output(f, step, spins=(1, 2)):
+    """Writes energy levels of one step in format of CP2K output"""
+    f.write(" SCF WAVEFUNCTION OPTIMIZATION\n  1.0 some text\n")
+    for spin in spins:
+        f.write(" Eigenvalues of the occupied subspace spin            {}\n"
+                " ---------------------------------------------\n".format(spin))
+        f.write("      -0.{}0000000      -0.50000000      -0.40000000\n"
+                "      -0.30000000\n".format(step + 6))
+        f.write(" Fermi Energy [eV] :   -{}.100000\n\n".format(step + 3))
+        f.write(" Lowest eigenvalues of the unoccupied subspace spin            {}\n"
+                " ---------------------------------------------\n"
+                " Reached convergence in           19 iterations\n"
+                "       0.10000000       0.20000000\n\n".format(spin))
+    f.write(" ENERGY| Total FORCE_EVAL ( QS ) energy (a.u.):   -12.3\n\n")
+
+def write_mo(f, step, labels=('ALPHA ', 'BETA ')):
+    """Writes energy levels of one step in format of CP2K .MOLog file"""
+    for label in labels:
+        f.write(" {}MO EIGENVALUES AND MO OCCUPATION NUMBERS\n\n"
+                " # MO index  eigenvalue [a.u.] occupation\n".format(label))
+        for i in range(4):
+            f.write("{:8d} {:16.8f} {:10.6f}\n".format(i + 1, 0.1 * (i + step),
+                                                        1.0 if i < 2 else 0.0))
+        f.write("\n Sum:  2.0\n\n Fermi energy:  {:.8f}\n\n".format(0.01 * step))
+
+
+class Parsers(unittest.TestCase):
+    """ Tests for the streaming parsers of energy levels
+
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_output(self):
+        """ Check last and all spectra of CP2K output
+
+        """
+        fname = os.path.join(self.tmpdir, 'run.out')
+        with open(fname, 'w') as f:
+            for step in range(3):
+                f.write(" irrelevant line\n" * 1000)
+                write_output(f, step)
+
+        spectra = list(cp2k.Spectrum.iter_from_output(fname))
+        self.assertEqual(len(spectra), 3)
+
+        s = cp2k.Spectrum.from_output(fname)
+        self.assertEqual(s.spins, [0, 1])
+        nt.assert_allclose(s.energylevels[1].energies,
+                           np.array([-0.8, -0.5, -0.4, -0.3, 0.1, 0.2])
+                           * atc.Ha / atc.eV)
+        self.assertEqual(s.energylevels[1].fermi, -5.1)
+
+        # small chunks split the file within blocks
+        spectra = list(cp2k.iter_spectra(fname, cp2k.OutputParser(),
+                                         chunksize=100))
+        nt.assert_allclose(spectra[-1].energylevels[1].energies,
+                           s.energylevels[1].energies)
+
+    def test_mo(self):
+        """ Check last and all spectra of .MOLog files
+
+        """
+        fname = os.path.join(self.tmpdir, 'run.MOLog')
+        with open(fname, 'w') as f:
+            for step in range(3):
+                write_mo(f, step)
+
+        spectra = list(cp2k.Spectrum.iter_from_mo(fname))
+        self.assertEqual(len(spectra), 3)
+        s = cp2k.Spectrum.from_mo(fname)
+        self.assertEqual(s.spins, [0, 1])
+        nt.assert_allclose(s.energylevels[0].energies,
+                           np.array([0.2, 0.3, 0.4, 0.5]) * atc.Ha / atc.eV)
+        nt.assert_array_equal(s.energylevels[0].occupations, [1, 1, 0, 0])
+        self.assertAlmostEqual(s.energylevels[0].fermi,
+                               0.02 * atc.Ha / atc.eV)
+
+        with open(fname, 'w') as f:
+            write_mo(f, 0, labels=('',))
+        s = cp2k.Spectrum.from_mo(fname)
+        self.assertEqual(s.spins, [0])
+
+    def test_trajectory(self):
+        """ Check incremental parsing of growing .MOLog file
+
+        """
+        fname = os.path.join(self.tmpdir, 'run.MOLog')
+        with open(fname, 'w') as f:
+            for step in range(2):
+                write_mo(f, step)
+            f.write(" ALPHA MO EIGENVALUES AND MO OCC")
+
+        t = cp2k.SpectrumTrajectory(fname)
+        self.assertEqual(len(t), 2)
+        self.assertEqual(t.energies.shape, (2, 2, 4))
+
+        with open(fname, 'a') as f:
+            f.write("UPATION NUMBERS\n\n # MO index\n")
+            f.write("       1  0.50000000  1.000000\n")
+            f.write("\n Fermi energy:  0.0\n\n")
+            write_mo(f, 3, labels=('BETA ',))
+            write_mo(f, 4)
+        self.assertEqual(t.update(), 2)
+        self.assertEqual(t.energies.shape, (4, 2, 4))
+        nt.assert_allclose(t.energies[2, 0, :2],
+                           [0.5 * atc.Ha / atc.eV, np.nan])
+        nt.assert_allclose(t.fermi[3], 0.04 * atc.Ha / atc.eV)
+
+        s = cp2k.Spectrum.from_mo(fname)
+        nt.assert_allclose(t[-1].energylevels[1].energies,
+                           s.energylevels[1].energies)
+        self.assertEqual(len(t[2].energylevels[0]), 1)
+
+
+class WfnCubeSet(unittest.TestCase):
+    """ Tests for the index of wave function cube files
+
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        atoms = fu.Atoms(numbers=[6], positions=[[0.5, 0.5, 0.5]],
+                         cell=np.diag([1.0, 1.2, 2.0]))
+        self.fnames = []
+        for spin, wfn in [(1, 2), (2, 1), (1, 1), (1, 2)]:
+            c = cube.Cube(title='Title\n',
+                          comment='WAVEFUNCTION {} spin {}\n'.format(wfn, spin),
+                          origin=np.zeros(3), atoms=atoms,
+                          data=np.zeros((2, 3, 4)))
+            fname = os.path.join(self.tmpdir,
+                                 '{}.cube'.format(len(self.fnames)))
+            c.write_cube_file(fname)
+            self.fnames.append(fname)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_constructor(self):
+        """ Check that WfnCube passes header to Cube
+
+        """
+        c = cube.Cube.from_file(self.fnames[1], read_data=True)
+        w = cp2k.WfnCube(title=c.title, comment=c.comment, origin=c.origin,
+                         atoms=c.atoms, data=c.data, spin=2, wfn=1)
+        self.assertIsNone(w.filename)
+        self.assertEqual(w.title, c.title)
+        fname = os.path.join(self.tmpdir, 'w.cube')
+        w.write_cube_file(fname)
+        r = cp2k.WfnCube.from_file(fname)
+        self.assertEqual((r.spin, r.wfn), (2, 1))
+
+    def test_npz(self):
+        """ Check labels of compressed cube files
+
+        """
+        c = cube.Cube.from_file(self.fnames[1], read_data=True)
+        fname = os.path.join(self.tmpdir, 'w.npz')
+        c.write_cube_file(fname)
+        cubes = cp2k.WfnCubeSet([fname, self.fnames[0]])
+        self.assertEqual(cubes.keys(), [(1, 2), (2, 1)])
+        self.assertEqual(cubes[(2, 1)].filename, fname)
+
+    def test_index(self):
+        """ Check lookup by (spin, wfn) and join with Spectrum
+
+        """
+        cubes = cp2k.WfnCubeSet(self.fnames, workers=2)
+        self.assertEqual(cubes.keys(), [(1, 1), (1, 2), (2, 1)])
+        self.assertEqual(cubes[(1, 2)].filename, self.fnames[0])
+
+        spectrum = cp2k.Spectrum(
+            energylevels=[fu.EnergyLevels(energies=[-1.0, 0.5], fermi=0.0)],
+            spins=[0])
+        cubes.join(spectrum)
+        self.assertEqual(cubes[(1, 2)].energy, 0.5)
+        self.assertEqual(cubes[(1, 1)].occupation, 1.0)
+        self.assertIsNone(cubes[(2, 1)].energy)
+
+        h = cubes.header((1, 2))
+        self.assertEqual(h.energy, 0.5)
+        nt.assert_array_equal(h.shape, [2, 3, 4])
+
+        # labels are taken from the index file, if up to date
+        fname = os.path.join(self.tmpdir, cp2k.WfnCubeSet.indexname)
+        with open(fname, 'r') as f:
+            index = json.load(f)
+        self.assertEqual(index['1.cube'][2:], [2, 1])
+        index['1.cube'][2:] = [2, 7]
+        with open(fname, 'w') as f:
+            json.dump(index, f)
+        cubes = cp2k.WfnCubeSet(self.fnames[1:3])
+        self.assertEqual(cubes.keys(), [(1, 1), (2, 7)])
+        cubes = cp2k.WfnCubeSet(self.fnames[1:3], use_index=False)
+        self.assertEqual(cubes.keys(), [(1, 1), (2, 1)])
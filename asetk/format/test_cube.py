@@ -0,0 +1,646 @@
+""" Tests for the Gaussian cube format
+
+"""
+from . import cube
+from . import cubecache
+from . import npzcube
+import asetk.atomistic.fundamental as fu
+import unittest
+import tempfile
+import shutil
+import os
+import io
+import functools
+import time
+import warnings
+import numpy as np
+import numpy.testing as nt
+
+
+def random_cube(shape=(6, 5, 13)):
+    """Returns Cube with random data of given shape"""
+    atoms = fu.Atoms(numbers=[6, 1], positions=[[1.0, 1.0, 1.0], [1.5, 1.2, 2.0]],
+                     cell=np.diag(shape) * 0.2)
+    data = np.random.randn(*shape) * 10.0**np.random.randint(-20, 3, shape)
+    return cube.Cube(title='Title\n', comment='Comment\n', origin=np.zeros(3),
+                     atoms=atoms, data=data)
+
+def logged_plane(c, log):
+    """Returns first z-plane of header-only Cube, logs name of file"""
+    with open(log, 'a') as f:
+        f.write(c.filename + '\n')
+    return c.read_plane('z', 0)
+
+
+class CubeTestCase(unittest.TestCase):
+    """ Provides temporary directory for cube files
+
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = os.path.join(self.tmpdir, 'test.cube')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+
+class ParseData(unittest.TestCase):
+    """ Tests for the engines parsing the grid data
+
+    """
+
+    def test_engines(self):
+        """ Check that all engines agree on fixed-width data
+
+        """
+        values = np.random.randn(100) * 10.0**np.random.randint(-99, 99, 100)
+        lines = [''.join([' {:12.5E}'.format(v) for v in values[i:i+6]])
+                 for i in range(0, len(values), 6)]
+        buf = '\n'.join(lines).encode() + b'\n'
+
+        ref = cube.parse_data(buf, engine='split')
+        nt.assert_allclose(ref, values, rtol=1e-5)
+        nt.assert_array_equal(cube.parse_data(buf, engine='numpy'), ref)
+        # may differ in last place for large exponents
+        nt.assert_allclose(cube.parse_data(buf, engine='fixedwidth'), ref,
+                           rtol=1e-15)
+
+    def test_fallback(self):
+        """ Check that irregular layouts are parsed as well
+
+        """
+        buf = b'1.0 -2.5e-3\n  3 4.25E+01\n'
+        nt.assert_array_equal(cube.parse_data(buf, engine='fixedwidth'),
+                              [1.0, -2.5e-3, 3.0, 42.5])
+
+    def test_chunks(self):
+        """ Check that chunked reading does not depend on chunk size
+
+        """
+        values = np.random.randn(100)
+        buf = ''.join(['{:13.5E}\n'.format(v) for v in values]).encode()
+        ref = cube.parse_data(buf)
+        for chunksize in [7, 100, 10000]:
+            data = cube.read_grid(io.BytesIO(buf), (10, 10), chunksize=chunksize)
+            nt.assert_array_equal(data.ravel(), ref)
+
+        self.assertRaises(ValueError, cube.read_grid, io.BytesIO(buf), (10, 11))
+        self.assertRaises(ValueError, cube.read_grid, io.BytesIO(buf), (10, 9))
+
+    def test_unknown_engine(self):
+        self.assertRaises(ValueError, cube.parse_data, b'1.0', engine='none')
+
+
+class ReadWrite(CubeTestCase):
+    """ Tests for reading and writing cube files
+
+    """
+
+    def test_roundtrip(self):
+        """ Check that data survives writing and reading
+
+        """
+        c = random_cube()
+        c.write_cube_file(self.fname)
+        r = cube.Cube.from_file(self.fname, read_data=True)
+
+        self.assertEqual(r.data.shape, c.data.shape)
+        nt.assert_allclose(r.data, c.data, rtol=1e-5)
+
+        c.write_cube_file(self.fname, precision=10)
+        r = cube.Cube.from_file(self.fname, read_data=True)
+        nt.assert_allclose(r.data, c.data, rtol=1e-10)
+        nt.assert_allclose(r.atoms.positions, c.atoms.positions, atol=1e-5)
+        self.assertEqual(r.title, c.title)
+
+    def test_layout(self):
+        """ Check that writer follows the 6E13.5 layout of the specification
+
+        """
+        c = random_cube(shape=(2, 3, 8))
+        c.data.flat[:4] = [0.0, -0.0, 9.999996, 1e-150]
+        c.write_cube_file(self.fname)
+        lines = open(self.fname).readlines()[6 + len(c.atoms):]
+
+        ref = []
+        for column in c.data.reshape(-1, 8):
+            ref.append(''.join([' {:12.5E}'.format(v) for v in column[:6]]) + '\n')
+            ref.append(''.join([' {:12.5E}'.format(v) for v in column[6:]]) + '\n')
+        self.assertEqual(lines, ref)
+
+    def test_format_printf(self):
+        """ Check fixed-width formatting against printf, including ties
+
+        """
+        rs = np.random.RandomState(0)
+        # 7 significant digits produce many exact ties at precision 5
+        values = np.array([float('{:.6e}'.format(v)) for v in
+                           rs.randn(20000) * 10.0**rs.randint(-30, 30, 20000)])
+        values = np.r_[values, 1.0000050000000001, 0.5, -2.5e-7, 9.999995,
+                       9.9999949999999, 0.0, -0.0]
+        for p in [1, 5, 10, 12]:
+            chars = cube._format_fixed(values, p)
+            ref = ''.join([' %{}.{}E'.format(p + 7, p) % v for v in values])
+            self.assertEqual(chars.tobytes().decode(), ref)
+
+        # printf fallback beyond the precision of int64 mantissas
+        self.assertIsNone(cube._format_fixed(values, 13))
+        c = random_cube(shape=(2, 3, 8))
+        c.write_cube_file(self.fname, precision=20)
+        lines = open(self.fname).readlines()[6 + len(c.atoms):]
+        self.assertEqual(lines[0], ''.join([' %27.20E' % v
+                                            for v in c.data[0, 0, :6]]) + '\n')
+
+
+class Isosurface(unittest.TestCase):
+    """ Tests for constant-current isosurfaces
+
+    """
+
+    def reference(self, data, v, dz, zcut):
+        """Isosurface for approach from above, column by column"""
+        plane = np.empty(data.shape[:2])
+        nz = data.shape[2]
+        for i in range(data.shape[0]):
+            for j in range(data.shape[1]):
+                plane[i, j] = zcut
+                for k in range(nz - 1, -1, -1):
+                    if data[i, j, k] > v:
+                        if k < nz - 1 and k * dz >= zcut:
+                            plane[i, j] = dz * (k + (data[i, j, k] - v)
+                                           / (data[i, j, k] - data[i, j, k+1]))
+                        break
+        return plane
+
+    def test_isovalues(self):
+        """ Check several isovalues against column-wise computation
+
+        """
+        c = random_cube(shape=(5, 4, 40))
+        z = np.arange(c.nz)
+        c.data = np.exp(-0.3 * z) * (1 + 0.5 * np.random.rand(*c.shape))
+        data = c.data.copy()
+        dz = np.linalg.norm(c.dz)
+        # force several blocks
+        c.blocksize = 2 * c.ny * c.nz * 8
+
+        isovalues = [1e-3, 0.05, 0.5]
+        planes = c.get_isosurface_above_atoms(isovalues, zcut=1.0)
+        self.assertEqual(len(planes), 3)
+        for v, plane in zip(isovalues, planes):
+            nt.assert_allclose(plane, self.reference(data, v, dz, 1.0))
+        nt.assert_array_equal(c.get_isosurface_above_atoms(0.05, zcut=1.0),
+                              planes[1])
+        nt.assert_array_equal(c.data, data)
+
+        # approach from below is the mirror image
+        c.data = data[:, :, ::-1].copy()
+        zcut = (c.nz - 1) * dz - 1.0
+        planes_below = c.get_isosurface_above_atoms(isovalues, zcut=zcut,
+                                                    from_below=True)
+        for plane, plane_below in zip(planes, planes_below):
+            nt.assert_allclose(plane_below, (c.nz - 1) * dz - plane)
+
+    def test_origin(self):
+        """ Check that translating grid and atoms along z changes nothing
+
+        Planes and isosurfaces of cubes with nonzero origin refer to the
+        position of the grid, i.e. indices are counted from origin[2].
+        """
+        c = random_cube(shape=(5, 4, 40))
+        z = np.arange(c.nz)
+        c.data = np.exp(-0.3 * z) * (1 + 0.5 * np.random.rand(*c.shape))
+
+        shifted = cube.Cube.from_cube(c)
+        shifted.origin = c.origin + [0.0, 0.0, 1.3]
+        shifted.atoms.positions += [0.0, 0.0, 1.3]
+
+        for d in [0.5, 2.0]:
+            self.assertEqual(shifted.get_index_above_atoms(d),
+                             c.get_index_above_atoms(d))
+            nt.assert_array_equal(shifted.get_plane_above_atoms(d),
+                                  c.get_plane_above_atoms(d))
+        nt.assert_allclose(shifted.get_isosurface_above_atoms(0.05, zcut=4.3),
+                           c.get_isosurface_above_atoms(0.05, zcut=3.0) + 1.3)
+
+    def test_slab(self):
+        """ Check that grids covering only a slab give the same results
+
+        """
+        c = random_cube(shape=(5, 4, 40))
+        z = np.arange(c.nz)
+        c.data = np.exp(-0.3 * z) * (1 + 0.5 * np.random.rand(*c.shape))
+        dz = c.dz
+
+        slab = cube.Cube.from_cube(c)
+        slab.data = c.data[:, :, 10:30].copy()
+        slab.origin = c.origin + 10 * dz
+        slab.cell[2] = 20 * dz
+
+        for d in [0.5, 2.0]:
+            self.assertEqual(slab.get_index_above_atoms(d),
+                             c.get_index_above_atoms(d) - 10)
+            nt.assert_array_equal(slab.get_plane_above_atoms(d),
+                                  c.get_plane_above_atoms(d))
+        self.assertEqual(slab.get_index_above_atoms(0.2, from_below=True),
+                         c.get_index_above_atoms(0.2, from_below=True) - 10)
+
+        # heights below the slab must not wrap around to its top planes
+        self.assertEqual(slab.get_index_above_atoms(-1.0), -5)
+        self.assertRaises(ValueError, slab.get_plane_above_atoms, -1.0)
+        self.assertRaises(ValueError, slab.get_planes_above_atoms, [0.5, -1.0])
+        self.assertRaises(ValueError, slab.get_plane_above_atoms, 0.2,
+                          from_below=True)
+        nt.assert_allclose(slab.get_isosurface_above_atoms(0.05, zcut=3.0),
+                           c.get_isosurface_above_atoms(0.05, zcut=3.0))
+
+
+class Resample(unittest.TestCase):
+    """ Tests for resampling planes on rectangular grids
+
+    """
+
+    def periodic_plane(self, dx, dy, n=(40, 30)):
+        """Returns Plane with periodic function on grid spanned by dx, dy"""
+        s, t = np.meshgrid(np.arange(n[0]) / n[0], np.arange(n[1]) / n[1],
+                           indexing='ij')
+        data = np.cos(2 * np.pi * s) + np.sin(2 * np.pi * (s + t))
+        return cube.Plane(data=data, origin=np.zeros(3), dx=dx, dy=dy)
+
+    def test_identity(self):
+        p = self.periodic_plane([0.1, 0, 0], [0, 0.2, 0])
+        data = p.data.copy()
+        p.resample([40, 30])
+        nt.assert_allclose(p.data, data, atol=1e-12)
+        nt.assert_allclose(p.dy, [0, 0.2, 0])
+
+    def test_skewed(self):
+        """ Check resampling of skewed periodic plane
+
+        """
+        dx, dy = np.array([0.1, 0, 0]), np.array([0.05, 0.1, 0])
+        p = self.periodic_plane(dx, dy)
+        p.resample([80, 60], interpolation='cubic')
+
+        # fractional coordinates of new grid points
+        u, v = np.meshgrid(np.arange(80), np.arange(60), indexing='ij')
+        r = p.origin[:2, None, None] + u * p.dx[:2, None, None] \
+            + v * p.dy[:2, None, None]
+        m = np.array([dx[:2] * 40, dy[:2] * 30]).T
+        s, t = np.tensordot(np.linalg.inv(m), r, axes=1)
+        ref = np.cos(2 * np.pi * s) + np.sin(2 * np.pi * (s + t))
+        nt.assert_allclose(p.data, ref, atol=1e-3)
+
+        self.assertRaises(ValueError, p.resample, [10, 10], interpolation='none')
+
+    def test_fourier(self):
+        """ Check that Fourier interpolation is exact for band-limited data
+
+        """
+        p = self.periodic_plane([0.1, 0, 0], [0, 0.2, 0])
+        ref = self.periodic_plane([0.05, 0, 0], [0, 0.05, 0], n=(80, 120))
+        p.resample([80, 120], interpolation='fourier')
+        nt.assert_allclose(p.data, ref.data, atol=1e-12)
+        nt.assert_allclose(p.dx, ref.dx)
+
+        # a stack of planes is resampled at once
+        planes = [self.periodic_plane([0.1, 0, 0], [0, 0.2, 0]) for i in range(3)]
+        cube.resample_planes(planes, [80, 120], interpolation='fourier')
+        for q in planes:
+            nt.assert_allclose(q.data, ref.data, atol=1e-12)
+
+        self.assertRaises(ValueError, p.resample, [10, 10],
+                          interpolation='fourier', periodic=False)
+
+    def test_cube(self):
+        c = random_cube(shape=(8, 6, 10))
+        x, y, z = np.meshgrid(*[np.arange(n) / n for n in c.shape], indexing='ij')
+        c.data = np.cos(2 * np.pi * (x + 2 * z)) * np.sin(2 * np.pi * y)
+        c.resample((16, 12, 20))
+        x, y, z = np.meshgrid(*[np.arange(n) / n for n in c.shape], indexing='ij')
+        nt.assert_allclose(c.data, np.cos(2 * np.pi * (x + 2 * z))
+                           * np.sin(2 * np.pi * y), atol=1e-12)
+
+
+class Compressed(CubeTestCase):
+    """ Tests for the compressed .npz container
+
+    """
+
+    def test_modes(self):
+        """ Check roundtrip for all storage modes
+
+        """
+        c = random_cube()
+        c.data = np.exp(-np.random.rand(*c.shape) * 10)
+        fname = os.path.join(self.tmpdir, 'test.npz')
+
+        c.write_cube_file(fname)
+        r = cube.Cube.from_file(fname, read_data=True)
+        nt.assert_array_equal(r.data, c.data)
+        nt.assert_allclose(r.origin, c.origin, atol=1e-12)
+        nt.assert_allclose(r.cell, c.cell, atol=1e-12)
+        nt.assert_allclose(r.atoms.positions, c.atoms.positions, atol=1e-12)
+        nt.assert_array_equal(r.atoms.numbers, c.atoms.numbers)
+        self.assertEqual(r.title, c.title)
+        self.assertEqual(r.comment, c.comment)
+
+        c.write_cube_file(fname, mode='float32')
+        r = cube.Cube.from_file(fname, read_data=True)
+        nt.assert_allclose(r.data, c.data, rtol=6e-8)
+
+        c.write_cube_file(fname, mode='quantized')
+        r = cube.Cube.from_file(fname, read_data=True)
+        span = np.max(c.data) - np.min(c.data)
+        nt.assert_allclose(r.data, c.data, atol=span / 131070 * 1.0001)
+
+        self.assertRaises(ValueError, c.write_cube_file, fname, mode='none')
+
+    def test_slabs(self):
+        """ Check that parts of the grid are read from chunked file
+
+        """
+        c = random_cube()
+        fname = os.path.join(self.tmpdir, 'test.npz')
+        header = {'title': c.title, 'comment': c.comment, 'origin': c.origin,
+                  'voxel': np.eye(3), 'numbers': c.atoms.numbers,
+                  'positions': c.atoms.positions}
+        # two x-planes per chunk
+        npzcube.write(fname, header, c.data, chunksize=2 * c.ny * c.nz * 8)
+
+        nt.assert_array_equal(npzcube.read_data(fname), c.data)
+        nt.assert_array_equal(npzcube.read_data(fname, (1, 4)), c.data[1:4])
+        h = cube.Cube.from_file(fname)
+        self.assertIsNone(h.data)
+        nt.assert_array_equal(h.read_slab((3, 6), (1, 2), (4, 9)),
+                              c.data[3:6, 1:2, 4:9])
+        nt.assert_array_equal(h.read_plane('z', 3), c.data[:, :, 3])
+        nt.assert_array_equal(h.read_planes('x', [5, 1]), c.data[[5, 1]])
+
+
+class ReadSlab(CubeTestCase):
+    """ Tests for reading parts of the grid
+
+    """
+
+    def write_layout(self, c, aligned, perline=6):
+        """Writes cube with perline values per line.
+
+        aligned: whether each z-column starts on a new line
+        perline=1 gives the layout of older asetk versions, which wrote the
+        data with tofile(sep='\\n').
+        """
+        c.write_cube_file(self.fname)
+        ref = cube.Cube.from_file(self.fname, read_data=True)
+        f = open(self.fname, 'r')
+        header = [f.readline() for i in range(6 + len(c.atoms))]
+        f.close()
+
+        rows = ref.data.reshape(-1, c.nz) if aligned else [ref.data.ravel()]
+        f = open(self.fname, 'w')
+        f.write(''.join(header))
+        if perline == 1:
+            ref.data.tofile(f, sep='\n', format='%12.6e')
+        else:
+            for row in rows:
+                for i in range(0, len(row), perline):
+                    f.write(''.join([' {:12.5E}'.format(v)
+                                     for v in row[i:i+perline]]) + '\n')
+        f.close()
+        return cube.Cube.from_file(self.fname, read_data=True)
+
+    def test_layouts(self):
+        """ Check slabs and planes for different layouts of grid data
+
+        """
+        c = random_cube()
+        for aligned, perline in [(True, 6), (False, 6), (True, 1)]:
+            ref = self.write_layout(c, aligned, perline)
+            h = cube.Cube.from_file(self.fname)
+            lines = open(self.fname).readlines()[6 + len(c.atoms):]
+            self.assertEqual(max([len(l.split()) for l in lines]), perline)
+
+            nt.assert_array_equal(h.read_slab(), ref.data)
+            nt.assert_array_equal(h.read_slab((1, 3), None, (5, 12)),
+                                  ref.data[1:3, :, 5:12])
+            for dir in ['x', 'y', 'z']:
+                nt.assert_array_equal(h.read_plane(dir, 4),
+                                      ref.get_plane(dir, 4))
+            # header-only cube reads plane from file
+            nt.assert_array_equal(h.get_plane_above_atoms(0.3),
+                                  ref.get_plane_above_atoms(0.3))
+            nt.assert_array_equal(h.read_planes('z', [7, 2, 7]),
+                                  ref.data[:, :, [7, 2, 7]].transpose(2, 0, 1))
+            nt.assert_array_equal(h.get_planes_above_atoms([0.1, 0.3]),
+                                  ref.get_planes_above_atoms([0.1, 0.3]))
+
+    def test_written_layout(self):
+        """ Check planes of files in the layout of write_cube_file
+
+        z-columns of 13 values are written as lines of 6, 6 and 1 values.
+        """
+        c = random_cube()
+        c.write_cube_file(self.fname)
+        lines = open(self.fname).readlines()[6 + len(c.atoms):]
+        self.assertEqual([len(l.split()) for l in lines],
+                         [6, 6, 1] * c.nx * c.ny)
+
+        ref = cube.Cube.from_file(self.fname, read_data=True)
+        h = cube.Cube.from_file(self.fname)
+        nt.assert_array_equal(h.read_plane('z', 12), ref.data[:, :, 12])
+
+    def test_bounds(self):
+        c = random_cube()
+        c.write_cube_file(self.fname)
+        h = cube.Cube.from_file(self.fname)
+        self.assertRaises(ValueError, h.read_slab, (0, 7))
+        self.assertRaises(ValueError, h.read_plane, 'w', 0)
+
+
+class Cache(CubeTestCase):
+    """ Tests for the binary cache of parsed cube files
+
+    """
+
+    def test_cache(self):
+        """ Check that cached data is used and invalidated
+
+        """
+        c = random_cube()
+        c.write_cube_file(self.fname)
+        cache = cubecache.CubeCache(os.path.join(self.tmpdir, 'cache'))
+
+        ref = cube.Cube.from_file(self.fname, read_data=True, cache=False)
+        self.assertIsNone(cache.load(self.fname))
+        r1 = cube.Cube.from_file(self.fname, read_data=True, cache=cache)
+        self.assertIsNotNone(cache.load(self.fname))
+        r2 = cube.Cube.from_file(self.fname, read_data=True, cache=cache)
+
+        self.assertIsInstance(r2.data, np.memmap)
+        nt.assert_array_equal(r2.data, ref.data)
+        nt.assert_array_equal(r2.atoms.positions, ref.atoms.positions)
+        nt.assert_array_equal(r2.origin, ref.origin)
+        self.assertEqual(r2.comment, ref.comment)
+        nt.assert_array_equal(r2.read_plane('z', 3), ref.data[:, :, 3])
+
+        # modifications do not affect the cache
+        r2.data *= 2
+        r3 = cube.Cube.from_file(self.fname, read_data=True, cache=cache)
+        nt.assert_array_equal(r3.data, ref.data)
+
+        # modified cube files are parsed again, at nanosecond resolution
+        st = os.stat(self.fname)
+        os.utime(self.fname, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        if os.stat(self.fname).st_mtime_ns != st.st_mtime_ns:
+            self.assertIsNone(cache.load(self.fname))
+        os.utime(self.fname, (st.st_atime, st.st_mtime + 10))
+        self.assertIsNone(cache.load(self.fname))
+
+        # existing entries are replaced
+        cube.Cube.from_file(self.fname, read_data=True, cache=cache)
+        cache.store(self.fname, {'title': 'T\n'}, ref.data)
+        self.assertEqual(cache.load(self.fname)[0]['title'], 'T\n')
+
+    def test_eviction(self):
+        """ Check that least recently used entries are removed
+
+        """
+        cache = cubecache.CubeCache(os.path.join(self.tmpdir, 'cache'))
+        c = random_cube()
+        fnames = [os.path.join(self.tmpdir, '{}.cube'.format(i)) for i in range(3)]
+        for i, fname in enumerate(fnames):
+            c.write_cube_file(fname)
+            cube.Cube.from_file(fname, read_data=True, cache=cache)
+            for path in cache._paths(cache.key(fname)):
+                os.utime(path, (1000 + i, 1000 + i))
+        entrysize = cache.size // 3
+
+        cache.maxsize = 2 * entrysize
+        cache.evict()
+        self.assertEqual(len(cache.entries()), 2)
+        self.assertIsNone(cache.load(fnames[0]))
+
+    def test_planecache(self):
+        """ Check that planes are stored, merged and invalidated
+
+        """
+        c = random_cube()
+        c.write_cube_file(self.fname)
+        store = os.path.join(self.tmpdir, 'planes.npz')
+        plane = c.data[:, :, 2]
+
+        cache = cubecache.PlaneCache(store)
+        self.assertIsNone(cache.get(self.fname, 2.5))
+        cache.set(self.fname, 2.5, plane)
+        cache.set(self.fname, 2.5, plane**2, psisquared=True)
+        cache.save()
+
+        # entries of other processes are kept
+        other = cubecache.PlaneCache(store)
+        other.set(self.fname, 3.0, plane)
+        other.save()
+        cache.set(self.fname, 4.0, plane)
+        cache.save()
+
+        cache = cubecache.PlaneCache(store)
+        self.assertEqual(len(cache), 4)
+        nt.assert_array_equal(cache.get(self.fname, 2.5), plane)
+        nt.assert_array_equal(cache.get(self.fname, 2.5, True), plane**2)
+        self.assertIsNone(cache.get(self.fname, 2.0))
+
+        # entries of modified cube files are removed
+        st = os.stat(self.fname)
+        os.utime(self.fname, (st.st_atime, st.st_mtime + 10))
+        self.assertIsNone(cache.get(self.fname, 2.5))
+        cache.save()
+        self.assertEqual(len(cubecache.PlaneCache(store)), 0)
+
+        # corrupt files are ignored with a warning
+        with open(store, 'wb') as f:
+            f.write(b'corrupt')
+        with warnings.catch_warnings(record=True) as w:
+            warnings.simplefilter('always')
+            self.assertEqual(len(cubecache.PlaneCache(store)), 0)
+        self.assertEqual(len(w), 1)
+
+
+class MemoryMap(CubeTestCase):
+    """ Tests for memory-mapped grid data
+
+    """
+
+    def setUp(self):
+        super(MemoryMap, self).setUp()
+        c = random_cube()
+        c.write_cube_file(self.fname)
+        self.ref = cube.Cube.from_file(self.fname, read_data=True)
+        self.c = cube.Cube.from_file(self.fname)
+        # force several blocks
+        self.c.blocksize = 2 * c.ny * c.nz * 8
+        self.c.memmap(os.path.join(self.tmpdir, 'grid.npy'))
+
+    def tearDown(self):
+        del self.c
+        super(MemoryMap, self).tearDown()
+
+    def test_operations(self):
+        """ Check that blockwise operations agree with in-memory ones
+
+        """
+        c, ref = self.c, self.ref
+        self.assertIsInstance(c.data, np.memmap)
+        nt.assert_array_equal(c.data, ref.data)
+        for dir in ['x', 'y', 'z']:
+            nt.assert_array_equal(c.get_plane(dir, 2), ref.get_plane(dir, 2))
+            nt.assert_allclose(c.get_avg(dir), ref.get_avg(dir))
+
+        c += ref
+        ref += ref
+        nt.assert_array_equal(c.data, ref.data)
+
+        for dir, shift in [('x', 2), ('y', -1), ('z', 5)]:
+            c.roll(dir, shift=shift)
+            ref.roll(dir, shift=shift)
+            self.assertIsInstance(c.data, np.memmap)
+            nt.assert_array_equal(c.data, ref.data)
+
+
+class LoadMany(CubeTestCase):
+    """ Tests for reading many cube files in worker processes
+
+    """
+
+    def test_load_many(self):
+        fnames = [os.path.join(self.tmpdir, '{}.cube'.format(i)) for i in range(3)]
+        for fname in fnames:
+            random_cube().write_cube_file(fname)
+        refs = [cube.Cube.from_file(f, read_data=True).data for f in fnames]
+
+        for workers in [1, 2]:
+            grids = cube.load_many(fnames, workers=workers)
+            for data, ref in zip(grids, refs):
+                nt.assert_array_equal(data, ref)
+
+        total = cube.load_many(fnames, workers=2, reduce=np.add)
+        nt.assert_array_equal(total, refs[0] + refs[1] + refs[2])
+
+        planes = cube.load_many(fnames, workers=2,
+                    func=functools.partial(cube.Cube.read_plane, dir='z', i=3))
+        for plane, ref in zip(planes, refs):
+            nt.assert_array_equal(plane, ref[:, :, 3])
+
+    def test_read_ahead(self):
+        """ Check that workers read at most 2*workers files ahead
+
+        """
+        fname = os.path.join(self.tmpdir, '0.cube')
+        random_cube(shape=(2, 2, 2)).write_cube_file(fname)
+        log = os.path.join(self.tmpdir, 'log')
+        grids = cube.iter_grids([fname] * 20, workers=2,
+                    func=functools.partial(logged_plane, log=log))
+        next(grids)
+        time.sleep(0.5)
+        with open(log) as f:
+            self.assertLessEqual(len(f.readlines()), 5)
+        self.assertEqual(len(list(grids)), 19)
@@ -0,0 +1,6 @@
+"""Scanning tunneling microscopy and spectroscopy
+
+Simulation of STM images and STS spectra from wave functions.
+"""
+
+from .sumbias import BiasSummer
@@ -0,0 +1,72 @@
+"""Extrapolation of wave functions into the vacuum
+
+Far from the surface, the potential is approximately constant and each
+Fourier component psi_G(z) of a wave function decays as
+exp(-kappa_G z), where kappa_G = sqrt(|G|^2 + 2 (V - E)) in atomic units.
+Starting from a plane of the wave function, all planes further out are
+obtained from a single batched inverse FFT.
+"""
+
+from __future__ import division
+import numpy as np
+import asetk.atomistic.constants as constants
+
+def prefactors(shape, lengths, dz, energies):
+    """Returns factors propagating rfft2 components by one plane along z.
+
+    Parameters
+    ----------
+    shape: (nx, ny) of the plane
+    lengths: lengths of the cell vectors along x and y [Angstroms]
+    dz: distance between planes [Angstroms]
+    energies: energies of the states relative to the potential [eV],
+        must not be positive (bound states)
+
+    Returns array of shape (nstates, nx, ny//2 + 1).
+    """
+    energies = np.atleast_1d(np.asarray(energies, dtype=float))
+    if np.any(energies > 0):
+        raise ValueError("Cannot extrapolate unbound states with energies "
+                         "{} eV above potential.".format(energies[energies > 0]))
+
+    a02A = constants.a0 / constants.Angstrom
+    nx, ny = shape
+    # wave vectors in 1/bohr, in rfft2 storage order
+    kx = 2 * np.pi * np.fft.fftfreq(nx, d=lengths[0] / nx / a02A)
+    ky = 2 * np.pi * np.fft.rfftfreq(ny, d=lengths[1] / ny / a02A)
+    k2 = kx[:, None]**2 + ky[None, :]**2
+
+    E = energies * constants.eV / constants.Ha
+    kappa = np.sqrt(k2[None, :, :] - 2 * E[:, None, None])
+    return np.exp(-kappa * dz / a02A)
+
+def extrapolate(planes, energies, lengths, dz, nz):
+    """Returns wave functions extrapolated by nz planes along z.
+
+    All states and planes are computed in a single batched irfft2.
+
+    Parameters
+    ----------
+    planes: wave functions on starting plane, shape (nstates, nx, ny)
+    energies: energies of the states relative to the potential [eV]
+    lengths: lengths of the cell vectors along x and y [Angstroms]
+    dz: distance between planes [Angstroms]
+    nz: number of planes to compute beyond the starting plane
+
+    Returns array of shape (nstates, nx, ny, nz), where [..., k] is the
+    plane at distance (k+1)*dz from the starting plane.
+    """
+    planes = np.asarray(planes, dtype=float)
+    nstates, nx, ny = planes.shape
+    if nstates != len(np.atleast_1d(energies)):
+        raise ValueError("Got {} planes for {} energies."\
+                         .format(nstates, len(np.atleast_1d(energies))))
+
+    fourier = np.fft.rfft2(planes)
+    p = prefactors((nx, ny), lengths, dz, energies)
+
+    k = np.arange(1, nz + 1)
+    fourier = fourier[:, None] * p[:, None]**k[None, :, None, None]
+    data = np.fft.irfft2(fourier, s=(nx, ny))
+
+    return np.moveaxis(data, 1, -1)
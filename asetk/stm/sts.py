@@ -0,0 +1,67 @@
+"""Scanning tunneling spectroscopy from wave functions
+
+In the Tersoff-Hamann approximation, the differential conductance dI/dU at
+bias U is given by the sum of |psi_i|^2 at the tip position, weighted by the
+broadened density of states of level i at energy U.
+"""
+
+from __future__ import division
+import numpy as np
+import asetk.atomistic.fundamental as fu
+
+def broadening_matrix(energies, biases, bmethod='Gaussian', FWHM=0.1,
+                      bepsilon=1e-5):
+    """Returns matrix of broadening weights of shape (nstates, nbiases).
+
+    Entry [i, j] is the broadening function of level i evaluated at bias j.
+    Weights are set to zero outside of the window [E-Eb, E+Eb], where Eb is
+    determined such that the integrated weight of the broadening function
+    outside of [-Eb, Eb] is below bepsilon.
+
+    Parameters
+    ----------
+    energies: energies of the levels [eV]
+    biases: equidistant bias voltages [V]
+    bmethod: 'Gaussian' or 'Lorentzian'
+    FWHM: Full-width of broadening function at half-maximum [eV]
+    bepsilon: weight of broadening function outside of window
+    """
+    broadening, quantile = fu.get_broadening(bmethod, FWHM)
+    eb = -quantile(bepsilon * 0.5)
+
+    energies = np.asarray(energies, dtype=float)
+    biases = np.asarray(biases, dtype=float)
+
+    # Window is delimited by the biases closest to E-Eb and E+Eb
+    imin = np.abs(biases[None, :] - (energies[:, None] - eb)).argmin(axis=1)
+    imax = np.abs(biases[None, :] - (energies[:, None] + eb)).argmin(axis=1)
+    indices = np.arange(len(biases))
+    window = (indices >= imin[:, None]) & (indices <= imax[:, None])
+
+    return np.where(window, broadening(energies[:, None] - biases[None, :]),
+                    0.0)
+
+def sts(planes, energies, biases, bmethod='Gaussian', FWHM=0.1,
+        bepsilon=1e-5):
+    """Returns STS data of shape (nx, ny, nbiases).
+
+    The squared wave functions are summed with the weights of
+    broadening_matrix in a single matrix product.
+
+    Parameters
+    ----------
+    planes: squared wave functions of shape (nstates, nx, ny)
+    energies: energies of the levels [eV]
+    biases: equidistant bias voltages [V]
+    bmethod, FWHM, bepsilon: see broadening_matrix
+    """
+    planes = np.asarray(planes, dtype=float)
+    nstates, nx, ny = planes.shape
+    if nstates != len(energies):
+        raise ValueError("Got {} planes for {} energies."\
+                         .format(nstates, len(energies)))
+
+    weights = broadening_matrix(energies, biases, bmethod, FWHM, bepsilon)
+    data = np.dot(planes.reshape(nstates, nx * ny).T, weights)
+
+    return data.reshape(nx, ny, len(biases))
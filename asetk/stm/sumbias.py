@@ -0,0 +1,167 @@
+"""Summation of wave functions for STM simulations
+
+In the Tersoff-Hamann approximation, the STM image at bias voltage U is
+given by the sum of |psi|^2 over all levels between the Fermi energy and
+the energy of the bias voltage.
+"""
+
+from __future__ import division
+import numpy as np
+import functools
+import asetk.format.cube as cube
+
+def _read_squared(c, indices=None, psi_squared=False):
+    """Returns squared grid data of header-only Cube c
+
+    indices: if specified, only the z-planes with these indices are read
+    """
+    if indices is None:
+        data = cube.Cube.from_file(c.filename, read_data=True).data
+    else:
+        data = c.read_planes('z', indices)
+
+    if not psi_squared:
+        np.square(data, out=data)
+    return data
+
+class BiasSummer(object):
+    """Sums squared wave functions for a range of bias voltages.
+
+    Levels are sorted by their distance from the Fermi energy, such that
+    the sums for all bias voltages are obtained as cumulative sums,
+    reading each cube file exactly once.
+    """
+
+    def __init__(self, spectrum, cubes, psi_squared=False, heights=None,
+                 from_below=False, workers=1):
+        """Set up summation.
+
+        Parameters
+        ----------
+        spectrum: cp2k.Spectrum with zero bias at zero energy
+        cubes: WfnCubes (or cp2k.WfnCubeSet) of the wave functions,
+            only filename, spin and wfn are used
+        psi_squared: True, if cube files contain the square of the
+            wave function
+        heights: If specified, only the planes at these heights above
+            the topmost atom [Angstroms] are summed instead of full grids
+        from_below: heights are measured below the lowest atom
+        workers: number of processes reading cube files, see
+            asetk.format.cube.iter_grids
+        """
+        self.spectrum = spectrum
+        self.psi_squared = psi_squared
+        self.heights = heights
+        self.workers = workers
+
+        self.cubes = {}
+        first = None
+        for c in cubes:
+            self.cubes.setdefault((c.spin, c.wfn), c)
+            first = first or c
+        if not self.cubes:
+            raise ValueError("No cube files given.")
+
+        self.header = cube.Cube.from_file(first.filename)
+        self.header.title = "STM cube\n"
+
+        self.indices = None
+        if heights is not None:
+            self.indices = [self.header.get_index_above_atoms(h, from_below)
+                            for h in heights]
+
+    def levels(self, positive=True):
+        """Returns list of (energy, spin, wfn) of levels.
+
+        positive: levels at or above zero energy (for positive bias),
+            else below zero energy
+
+        Levels are sorted by distance from zero energy.
+        spin and wfn start from 1, as in the cube files of CP2K.
+        """
+        levels = []
+        for spin, el in zip(self.spectrum.spins, self.spectrum.energylevels):
+            energies = el.energies
+            for lindex in range(len(energies)):
+                e = energies[lindex]
+                if (e >= 0) == positive:
+                    levels.append((e, spin + 1, lindex + 1))
+
+        levels.sort(key=lambda l: abs(l[0]))
+        return levels
+
+    def read(self, spin, wfn):
+        """Returns squared wave function (or planes thereof)"""
+        return _read_squared(self.cubes[(spin, wfn)], self.indices,
+                             self.psi_squared)
+
+    def sums(self, biases):
+        """Yields (bias, sum) for all bias voltages.
+
+        Positive biases are processed in ascending order, followed by
+        negative biases in descending order.
+        For bias U, sum contains the squared wave functions of all levels
+        with energy between 0 and U.
+
+        The sum is a Cube or, if heights were specified, a list of Planes.
+        The grid data of the Cube is updated in subsequent iterations, i.e.
+        write or copy it before continuing.
+        """
+        biases = np.unique(biases)
+
+        for vlist in [biases[biases > 0], biases[biases <= 0][::-1]]:
+            if len(vlist) == 0:
+                continue
+            levels = self.levels(positive=vlist[0] > 0)
+            # cube files are read ahead by worker processes
+            needed = [l for l in levels if abs(l[0]) < abs(vlist[-1])
+                      and (l[1], l[2]) in self.cubes]
+            grids = cube.iter_grids(
+                        [self.cubes[(l[1], l[2])].filename for l in needed],
+                        func=functools.partial(_read_squared,
+                                               indices=self.indices,
+                                               psi_squared=self.psi_squared),
+                        workers=self.workers)
+            if self.heights is None:
+                total = np.zeros(self.header.shape)
+            else:
+                total = np.zeros((len(self.heights), self.header.nx,
+                                  self.header.ny))
+
+            n = 0
+            for v in vlist:
+                print("{:+7.3f} V bias\n-----------------------------------"\
+                      .format(v))
+                nsummed = 0
+                while n < len(levels) and abs(levels[n][0]) < abs(v):
+                    e, spin, wfn = levels[n]
+                    n += 1
+                    if (spin, wfn) not in self.cubes:
+                        print("Missing cube file for spin {s}, energy {e:.6f} eV"\
+                              .format(s=spin, e=e))
+                        continue
+
+                    print("Reading cube file for spin {s}, energy {e:.6f} eV"\
+                          .format(s=spin, e=e))
+                    # For STM at zero temperature, the occupation of the
+                    # level in the calculation is irrelevant
+                    total += next(grids)
+                    nsummed += 1
+
+                if nsummed == 0:
+                    print("No new cubes for bias {:+4.3f}".format(v))
+
+                yield v, self._result(total, v)
+
+    def _result(self, total, v):
+        """Wraps sum for bias v in Cube or Planes"""
+        if self.heights is None:
+            c = self.header
+            c.data = total
+            c.comment = "Sample bias {:+4.2f} V\n".format(v)
+            return c
+
+        pextent, pdx, pdy = self.header.get_plane_extent('z',
+                                                         return_vectors=True)
+        return [cube.Plane(data=plane.copy(), origin=self.header.origin,
+                           dx=pdx, dy=pdy) for plane in total]
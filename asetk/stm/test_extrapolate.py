@@ -0,0 +1,50 @@
+""" Tests for the extrapolation of wave functions
+
+"""
+from . import extrapolate
+import asetk.atomistic.constants as constants
+import unittest
+import numpy as np
+import numpy.testing as nt
+
+
+class Extrapolate(unittest.TestCase):
+    """ Tests for the batched extrapolation
+
+    """
+
+    def test_decay(self):
+        """ Check decay of single Fourier components
+
+        """
+        nx, ny, lx, ly, dz = 12, 9, 6.0, 4.5, 0.2
+        x = np.arange(nx)[:, None] * lx / nx
+        y = np.arange(ny)[None, :] * ly / ny
+        planes = [np.cos(2 * np.pi * x / lx) + 0 * y,
+                  np.ones((nx, ny)) + np.sin(2 * np.pi * 2 * y / ly)]
+        energies = [-2.0, -5.0]
+
+        data = extrapolate.extrapolate(planes, energies, [lx, ly], dz, nz=10)
+        self.assertEqual(data.shape, (2, nx, ny, 10))
+
+        a02A = constants.a0 / constants.Angstrom
+        z = np.arange(1, 11) * dz / a02A
+        kappa = lambda k, e: np.sqrt((2 * np.pi * k / (lx / a02A))**2
+                                     - 2 * e * constants.eV / constants.Ha)
+        nt.assert_allclose(data[0], planes[0][:, :, None]
+                           * np.exp(-kappa(1, -2.0) * z), atol=1e-12)
+
+        kappa0 = np.sqrt(10 * constants.eV / constants.Ha)
+        ky = 2 * np.pi * 2 / (ly / a02A)
+        kappa2 = np.sqrt(ky**2 + 10 * constants.eV / constants.Ha)
+        ref = np.exp(-kappa0 * z) + np.sin(2 * np.pi * 2 * y / ly)[:, :, None] \
+              * np.exp(-kappa2 * z)
+        nt.assert_allclose(data[1], np.broadcast_to(ref, data[1].shape),
+                           atol=1e-12)
+
+    def test_unbound(self):
+        """ Check that unbound states are rejected
+
+        """
+        self.assertRaises(ValueError, extrapolate.prefactors, (4, 4),
+                          [1.0, 1.0], 0.1, [-1.0, 0.5])
@@ -0,0 +1,45 @@
+""" Tests for the STS simulation
+
+"""
+from . import sts
+import asetk.atomistic.fundamental as fu
+import unittest
+import numpy as np
+import numpy.testing as nt
+
+
+class STS(unittest.TestCase):
+    """ Tests for the broadening of levels
+
+    """
+
+    def setUp(self):
+        self.energies = np.array([-1.02, -0.3, 0.0, 0.45, 1.3])
+        self.planes = np.random.rand(len(self.energies), 4, 3)
+        self.biases = np.linspace(-1.0, 1.0, 201)
+
+    def reference(self, bmethod, FWHM, bepsilon):
+        """Level by level summation"""
+        broadening, quantile = fu.get_broadening(bmethod, FWHM)
+        eb = -quantile(bepsilon * 0.5)
+        data = np.zeros((4, 3, len(self.biases)))
+        for e, plane in zip(self.energies, self.planes):
+            imin = (np.abs(self.biases - (e - eb))).argmin()
+            imax = (np.abs(self.biases - (e + eb))).argmin()
+            for i in range(imin, imax + 1):
+                data[:, :, i] += plane * broadening(e - self.biases[i])
+        return data
+
+    def test_sts(self):
+        """ Compare with level by level summation
+
+        """
+        for bmethod in ['Gaussian', 'Lorentzian']:
+            data = sts.sts(self.planes, self.energies, self.biases,
+                           bmethod=bmethod, FWHM=0.1, bepsilon=1e-3)
+            nt.assert_allclose(data, self.reference(bmethod, 0.1, 1e-3),
+                               rtol=1e-12, atol=1e-14)
+
+    def test_unknown_method(self):
+        self.assertRaises(ValueError, sts.broadening_matrix,
+                          self.energies, self.biases, 'Voigt')
@@ -0,0 +1,86 @@
+""" Tests for the summation of wave functions
+
+"""
+from . import sumbias
+import asetk.format.cube as cube
+import asetk.format.cp2k as cp2k
+import asetk.atomistic.fundamental as fu
+import unittest
+import tempfile
+import shutil
+import os
+import numpy as np
+import numpy.testing as nt
+
+
+class BiasSummer(unittest.TestCase):
+    """ Tests for the BiasSummer
+
+    """
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.energies = np.array([-0.3, -0.1, 0.2, 0.25, 0.6])
+        self.spectrum = cp2k.Spectrum(
+            energylevels=[fu.EnergyLevels(energies=self.energies, fermi=0.0)],
+            spins=[0])
+
+        atoms = fu.Atoms(numbers=[6], positions=[[0.5, 0.5, 0.5]],
+                         cell=np.diag([1.0, 1.2, 2.0]))
+        self.psi = []
+        self.cubes = []
+        for i in range(len(self.energies)):
+            # no cube file for last level
+            if i == 4:
+                break
+            c = cube.Cube(title='Title\n',
+                          comment='WAVEFUNCTION {} spin 1\n'.format(i + 1),
+                          origin=np.zeros(3), atoms=atoms,
+                          data=np.random.randn(5, 6, 10))
+            fname = os.path.join(self.tmpdir, '{}.cube'.format(i))
+            c.write_cube_file(fname, precision=10)
+            self.psi.append(c.data)
+            self.cubes.append(cp2k.WfnCube.from_file(fname))
+
+        self.summer = sumbias.BiasSummer(self.spectrum, self.cubes)
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_sums(self):
+        """ Check cumulative sums against direct summation
+
+        """
+        biases = [0.5, -0.2, 0.1, 1.0, -0.5]
+        for workers in [1, 2]:
+            self.summer.workers = workers
+            results = [(v, c.data.copy()) for v, c in self.summer.sums(biases)]
+            self.assertEqual([v for v, d in results],
+                             [0.1, 0.5, 1.0, -0.2, -0.5])
+
+            for v, data in results:
+                ref = np.zeros(data.shape)
+                for e, psi in zip(self.energies, self.psi):
+                    if (e >= 0) == (v > 0) and abs(e) < abs(v):
+                        ref += psi**2
+                nt.assert_allclose(data, ref, rtol=1e-9)
+
+    def test_heights(self):
+        """ Check that only planes at given heights above atoms are summed
+
+        """
+        # atom at z=0.5 Angstroms, planes spaced by dz=0.2 Angstroms
+        for heights, from_below, indices in [([0.5, 1.1], False, [5, 8]),
+                                             ([0.3], True, [1])]:
+            summer = sumbias.BiasSummer(self.spectrum, self.cubes,
+                                        heights=heights, from_below=from_below)
+            self.assertEqual(summer.indices, indices)
+
+            results = list(summer.sums([0.3]))
+            planes = results[0][1]
+            self.assertEqual(len(planes), len(heights))
+            for plane, i in zip(planes, indices):
+                nt.assert_allclose(plane.data,
+                                   self.psi[2][:, :, i]**2 +
+                                   self.psi[3][:, :, i]**2,
+                                   rtol=1e-9)
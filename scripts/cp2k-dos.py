@@ -10,7 +10,7 @@ import os
 # Define command line parser
 parser = argparse.ArgumentParser(
     description='Produce density of states from CP2K output or .MOLog file')
-parser.add_argument('--version', action='version', version='%(prog)s 24.01.2017')
+parser.add_argument('--version', action='version', version='%(prog)s 18.10.2026')
 parser.add_argument(
     'out',
     metavar='WILDCARD', 
@@ -49,8 +49,10 @@ parser.add_argument(
     '--FWHM',
     metavar='ENERGY',
     type=float,
-    default=0.1,
-    help='Full-width half-maximum of broadening function [eV].')
+    nargs='+',
+    default=[0.1],
+    help='Full-width half-maximum of broadening function [eV]. \
+          For several values, one DOS is computed per value.')
 parser.add_argument(
     '--bmethod',
     default='Gaussian',
@@ -62,6 +64,12 @@ parser.add_argument(
     default=1e-3,
     metavar='WEIGHT',
     help='Reduce computational cost by specifying quantiles that may be neglected.')
+parser.add_argument(
+    '--method',
+    default='fft',
+    metavar='STRING',
+    help='"fft": bin levels on energy grid and convolve with broadening \
+          function (fast). "exact": sum broadening functions at grid points.')
 
 args = parser.parse_args()
 
@@ -75,22 +83,32 @@ else:
 print(spectrum)
 
 if args.sigma:
-    args.FWHM = np.sqrt(8.0 * np.log(2.0)) * args.sigma
-
-for e,s in zip(spectrum.energylevels, spectrum.spins):
-    E, DOS = e.dos(bmethod=args.bmethod, FWHM=args.FWHM, bepsilon=args.bepsilon, delta_e = args.delta)
-
-    dosint = np.sum(DOS) * args.delta
-    print("Integrated DOS spin {}: {:.3f} electrons".format(s+1,dosint))
-    dosmax = np.max(DOS)
-    print("Maximum DOS spin {}: {:.3e} electrons / eV".format(s+1,dosmax))
-
-    # Write dos to file
-    if args.to_file:
-        header = "DOS from {}, FWHM={} eV, spin={}\n E [eV]             DOS"\
-                .format(args.out, args.FWHM, s+1)
-        np.savetxt("dos_spin{}.dat".format(s+1), 
-                   np.array(zip(E,DOS)), header=header)
+    args.FWHM = [np.sqrt(8.0 * np.log(2.0)) * args.sigma]
+
+# All spins share the same energy grid
+E, DOSes = spectrum.dos(bmethod=args.bmethod, FWHM=args.FWHM,
+                        bepsilon=args.bepsilon, delta_e=args.delta,
+                        method=args.method, sum_spins=False)
+
+for ispin, (e,s) in enumerate(zip(spectrum.energylevels, spectrum.spins)):
+
+    for FWHM, DOS in zip(args.FWHM, DOSes[:, ispin]):
+        dosint = np.sum(DOS) * args.delta
+        print("Integrated DOS spin {}, FWHM {} eV: {:.3f} electrons"\
+              .format(s+1,FWHM,dosint))
+        dosmax = np.max(DOS)
+        print("Maximum DOS spin {}, FWHM {} eV: {:.3e} electrons / eV"\
+              .format(s+1,FWHM,dosmax))
+
+        # Write dos to file
+        if args.to_file:
+            header = "DOS from {}, FWHM={} eV, spin={}\n E [eV]             DOS"\
+                    .format(args.out, FWHM, s+1)
+            if len(args.FWHM) == 1:
+                fname = "dos_spin{}.dat".format(s+1)
+            else:
+                fname = "dos_spin{}_FWHM{}.dat".format(s+1, FWHM)
+            np.savetxt(fname, np.array([E, DOS]).T, header=header)
 
     # Plot DOS
     if args.plot:
@@ -98,6 +116,8 @@ for e,s in zip(spectrum.energylevels, spectrum.spins):
         matplotlib.use('Agg')
         import matplotlib.pyplot as plt
 
+        DOS = DOSes[0, ispin]
+        dosmax = np.max(DOS)
         plt.plot(DOS, E, label='spin {}'.format(s))
 
         fermi = e.fermi
@@ -5,15 +5,17 @@ import scipy.special as scsp
 import argparse
 import asetk.format.cp2k as cp2k
 import asetk.format.cube as cube
+from asetk.format.cubecache import PlaneCache
 import asetk.atomistic.constants as constants
-import asetk.util.progressbar as progressbar
+import asetk.stm.extrapolate as extrapolate
 import os.path
+import functools
 
 # Define command line parser
 parser = argparse.ArgumentParser(
     description='Performs wave function extrapolation for \
                  Scanning Tunneling Microscopy Simulation.')
-parser.add_argument('--version', action='version', version='%(prog)s 30.12.2014')
+parser.add_argument('--version', action='version', version='%(prog)s 18.10.2026')
 parser.add_argument(
     'cubes',
     nargs='+',
@@ -59,6 +61,32 @@ parser.add_argument(
     help='Whether to weight the average of the Hartree potential on the \
     extrapolation plane by the density of the state that is being \
     extrapolated.')
+parser.add_argument(
+    '--planecache',
+    metavar='FILENAME',
+    default='planecache.npz',
+    help='File for caching the plane extracted from the Hartree potential.')
+parser.add_argument(
+    '--jobs',
+    metavar='INT',
+    type=int,
+    default=1,
+    help='Number of processes reading cube files in parallel.')
+parser.add_argument(
+    '--output',
+    metavar='KEYWORD',
+    default='cube',
+    choices=['cube', 'slab'],
+    help='"cube" writes the full cube, extended to the extrapolated region. \
+          "slab" writes only the extrapolation surface and the extrapolated \
+          region, with origin shifted accordingly. Only the extrapolation \
+          surface is read from the input cube files.')
+parser.add_argument(
+    '--batch',
+    metavar='INT',
+    type=int,
+    default=8,
+    help='Number of states extrapolated together.')
 
 args = parser.parse_args()
 a02A = constants.a0 / constants.Angstrom  # Bohr radius in Angstroms
@@ -80,16 +108,15 @@ print(spectrum)
 # Since we need only one plane from the Hartree potential,
 # we save it to disk for reuse.
 print("Reading Hartree potential from {}".format(args.hartree))
-hartree_planefile = "{}.z{:.2f}".format(args.hartree,args.height)
-
-hartree_plane = None
-if( os.path.isfile(hartree_planefile) ):
-    hartree_plane = np.genfromtxt(hartree_planefile)
-else:
-    hartree_cube = cube.Cube.from_file(args.hartree, read_data=True)
+cache = PlaneCache(args.planecache)
+hartree_plane = cache.get(args.hartree, args.height)
+if hartree_plane is None:
+    # header only, the plane is read directly from the file
+    hartree_cube = cube.Cube.from_file(args.hartree)
     hartree_plane = hartree_cube.get_plane_above_atoms( \
             args.height, verbose=True)
-    np.savetxt(hartree_planefile, hartree_plane)
+    cache.set(args.hartree, args.height, hartree_plane)
+    cache.save()
 
 hartree_avg = np.mean(hartree_plane) / eV2Ha
 hartree_min = np.min(hartree_plane) / eV2Ha
@@ -106,29 +133,67 @@ electron density of the state being extrapolated.""")
 print("")
 
 
-#bar = progressbar.ProgressBar(niter=len(args.cubes))
-#
-#for fname in args.cubes:
-#    cubes.append( cp2k.WfnCube.from_file(fname) )
-#    bar.iterate()
-#print("")
+def write_batch(batch):
+    """Extrapolates and writes cubes of batch of states"""
+    c = batch[0][1]
+    iz_start = c.get_index_above_atoms(args.height)
+    iz_end = c.get_index_above_atoms(args.height+args.extent)
+    print("------------")
+    print("Extrapolation surface at z = {:.3f} Angstroms (plane index {})"\
+            .format(c.origin[2] + iz_start*c.dz[2], iz_start))
+
+    # all states and planes in one batched FFT
+    data = extrapolate.extrapolate(
+        [b[2] for b in batch], [b[3] for b in batch],
+        lengths=[np.linalg.norm(c.cell[0]), np.linalg.norm(c.cell[1])],
+        dz=np.linalg.norm(c.dz), nz=iz_end - iz_start)
+
+    for (fname, c, plane, e), d in zip(batch, data):
+        if args.output == 'slab':
+            # slab from extrapolation surface to end of extrapolation
+            slab = np.empty((c.shape[0], c.shape[1], d.shape[2] + 1))
+            slab[:, :, 0] = plane
+            slab[:, :, 1:] = d
+            dz = c.dz
+            c = cp2k.WfnCube.from_cube(c)
+            c.origin = c.origin + iz_start*dz
+            c.data = slab
+            c.cell[2] = dz * slab.shape[2]
+        else:
+            c.resize([ c.shape[0], c.shape[1], iz_end + 1])
+            c.data[:, :, iz_start+1:] = d
+
+        fname_out = 'x.' + fname
+        print("Writing {}".format(fname_out))
+        c.write_cube_file(fname_out)
 
 # Extrapolating cube files
 print("Extrapolating {} cube files".format(len(args.cubes)))
+# cube files are read ahead by worker processes
+if args.output == 'slab':
+    # only the extrapolation surface is needed
+    grids = cube.iter_grids(args.cubes, workers=args.jobs,
+        func=functools.partial(cube.Cube.get_plane_above_atoms, d=args.height))
+else:
+    grids = cube.iter_grids(args.cubes, workers=args.jobs)
+batch = []
 for fname in args.cubes:
     print("------------")
     print("Reading {}".format(fname))
-    cube = cp2k.WfnCube.from_file(fname, read_data=True)
+    c = cp2k.WfnCube.from_file(fname)
+    if args.output == 'slab':
+        plane = next(grids)
+    else:
+        c.data = next(grids)
+        plane = c.get_plane_above_atoms(args.height)
 
     try:
-        cube.energy = spectrum.energylevels[cube.spin-1].levels[cube.wfn-1].energy
+        c.energy = spectrum.energylevels[c.spin-1].energies[c.wfn-1]
     except:
         print("Error: Missing energy level for cube file {}.")
         print("       Did you use the correct levels file?".format(fname))
     print("Spin {}, n = {}, E = {:.4f} eV"\
-            .format(cube.spin, cube.wfn, cube.energy))
-
-    plane = cube.get_plane_above_atoms(args.height)
+            .format(c.spin, c.wfn, c.energy))
 
     hartree = hartree_avg
     if args.weighted_avg:
@@ -139,14 +204,9 @@ for fname in args.cubes:
         weighted_hartree_avg = np.sum(weighted_hartree)
         print("Weighted average of Hartree potential: {:+.4f} eV" \
             .format(weighted_hartree_avg/eV2Ha))
-        hartree = weighted_hartree_avg
+        hartree = weighted_hartree_avg / eV2Ha
 
-    # Note: Working in Hartree atomic units here
-    E = (cube.energy - hartree) * eV2Ha * np.dot(cube.dz, cube.dz) / a02A**2
-    dKX = 2*np.pi*np.linalg.norm(cube.dz) / np.linalg.norm(cube.cell[0])
-    dKY = 2*np.pi*np.linalg.norm(cube.dz) / np.linalg.norm(cube.cell[1])
-
-    if E > 0:
+    if c.energy > hartree:
         msg = """\
 Trying to extrapolate unbound (=free electron) state {s}.
 No need to extrapolate this state or states at higher energies.
@@ -158,41 +218,15 @@ lies {diff:.2f} eV above this value, thus making it an unbound state. While
 your basis set may (or may not) be able to describe unbound states, they
 certainly don't decay exponentially when moving away from the sample surface
 and therefore cannot be extrapolated."""
-        raise ValueError(msg.format(s=fname, en=cube.energy, diff=cube.energy-hartree_avg))
-
-    fourier = np.fft.rfft2(plane)
-    nKX, nKY = fourier.shape
-
-    # Prepare matrix with prefactors that propagates Fourier components
-    # to next z-plane
-    #print("Calculating prefactors")
-    p = lambda i,j: np.exp( -np.sqrt( (i*dKX)**2 + (j*dKY)**2 - 2*E) )
-    prefactors = np.zeros(fourier.shape)
-    for i in range(nKX):
-        for j in range(nKY):
-            # rfft2 storage order in 1st dimension is 
-            #   0..G -(G-1)..-1 for even nKX
-            #   0..G -G..-1 for odd nKX
-            # Note: Could use np.fft.rfftfreq instead of hand-made formula
-            i_mod = i - (i//(nKX//2+1)) * nKX
-            prefactors[i,j] = p(i_mod, j)
-
-    iz_start = cube.get_index_above_atoms(args.height)
-    iz_end = cube.get_index_above_atoms(args.height+args.extent)
-    print("Extrapolation surface at z = {:.3f} Angstroms (plane index {})"\
-            .format(iz_start*cube.dz[2], iz_start))
-    cube.resize([ cube.shape[0], cube.shape[1], iz_end + 1])
-
-    for iz in range(iz_start+1, iz_end+1):
-        fourier *= prefactors
-        cube.set_plane('z', iz, np.fft.irfft2(fourier, plane.shape))
-        #print(np.mean(np.abs(tmp)))
+        raise ValueError(msg.format(s=fname, en=c.energy, diff=c.energy-hartree_avg))
 
-    fname_out = 'x.' + fname
-    print("Writing {}".format(fname_out))
-    cube.write_cube_file(fname_out)
+    batch.append((fname, c, plane, c.energy - hartree))
+    if len(batch) == args.batch:
+        write_batch(batch)
+        batch = []
 
+if batch:
+    write_batch(batch)
 
 print("")
 print("Job done.")
-    
@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+# Produce projected density of states from CP2K .pdos files
+# Usage: cp2k-pdos.py *.pdos --groups s=s p=p C=C
+import argparse
+import asetk.format.cp2k as cp2k
+import asetk.atomistic.dos as dos
+import numpy as np
+
+# Define command line parser
+parser = argparse.ArgumentParser(
+    description='Produce projected density of states from CP2K .pdos files')
+parser.add_argument('--version', action='version', version='%(prog)s 18.10.2026')
+parser.add_argument(
+    'pdos',
+    nargs='+',
+    metavar='WILDCARD', 
+    help='.pdos files of one CP2K run (all kinds, both spins)')
+parser.add_argument(
+    '--groups',
+    nargs='+',
+    metavar='NAME=PATTERN,...',
+    default=None,
+    help='Groups of channels to sum, e.g. "C_p=C:px,C:py,C:pz" or "d=d". \
+          A pattern matches "kind:orbital", "kind", "orbital" or the angular \
+          momentum of the orbital. By default, one PDOS per channel.')
+parser.add_argument(
+    '--delta',
+    metavar='ENERGY',
+    default=0.001,
+    type=float,
+    help='the energy grid spacing [eV]')
+parser.add_argument(
+    '--FWHM',
+    metavar='ENERGY',
+    type=float,
+    nargs='+',
+    default=[0.1],
+    help='Full-width half-maximum of broadening function [eV]. \
+          For several values, one file is written per value.')
+parser.add_argument(
+    '--bmethod',
+    default='Gaussian',
+    metavar='STRING',
+    help='Method used for broadening: "Gaussian" or "Lorentzian"')
+parser.add_argument(
+    '--bepsilon',
+    type=float,
+    default=1e-3,
+    metavar='WEIGHT',
+    help='Reduce computational cost by specifying quantiles that may be neglected.')
+parser.add_argument(
+    '--method',
+    default='fft',
+    metavar='STRING',
+    help='"fft": bin levels on energy grid and convolve with broadening \
+          function (fast). "exact": sum broadening functions at grid points.')
+
+args = parser.parse_args()
+
+groups = None
+if args.groups:
+    groups = {}
+    for g in args.groups:
+        name, patterns = g.split('=')
+        groups[name] = patterns.split(',')
+
+# Files of the same spin are merged
+pdoses = {}
+for fname in args.pdos:
+    p = cp2k.PDOS.from_file(fname)
+    if p.spin in pdoses:
+        pdoses[p.spin].merge(p)
+    else:
+        pdoses[p.spin] = p
+pdoses = [pdoses[s] for s in sorted(pdoses.keys())]
+for p in pdoses:
+    print(p)
+
+# All spins share the same energy grid
+egrid = dos.energy_grid(np.concatenate([p.energies for p in pdoses]),
+                        args.FWHM, args.bmethod, args.bepsilon, args.delta)
+
+for p in pdoses:
+    E, names, PDOSes = p.dos(groups, bmethod=args.bmethod, FWHM=args.FWHM,
+                             bepsilon=args.bepsilon, method=args.method,
+                             egrid=egrid)
+
+    for FWHM, PDOS in zip(args.FWHM, PDOSes):
+        if len(args.FWHM) == 1:
+            fname = "pdos_spin{}.dat".format(p.spin+1)
+        else:
+            fname = "pdos_spin{}_FWHM{}.dat".format(p.spin+1, FWHM)
+        header = "PDOS from {} files, FWHM={} eV, spin={}, Fermi={} eV\n E [eV] "\
+                .format(len(args.pdos), FWHM, p.spin+1, p.fermi) + ' '.join(names)
+        print("Writing {}".format(fname))
+        np.savetxt(fname, np.vstack([E, PDOS]).T, header=header)
@@ -4,14 +4,15 @@ import numpy as np
 import argparse
 
 import asetk.format.cp2k as cp2k
-import asetk.util.progressbar as progressbar
+import asetk.format.cube as cube
+import asetk.stm as stm
 import os
 
 # Define command line parser
 parser = argparse.ArgumentParser(
     description='Sums required wave functions for STM simulation \
                  from Gaussian Cube file.')
-parser.add_argument('--version', action='version', version='%(prog)s 15.02.2015')
+parser.add_argument('--version', action='version', version='%(prog)s 18.10.2026')
 parser.add_argument(
     '--cubes',
     nargs='+',
@@ -55,6 +56,21 @@ parser.add_argument(
     action='store_true',
     default=False,
     help='Use if cube files contain square of the wave function.')
+parser.add_argument(
+    '--heights',
+    nargs='+',
+    type=float,
+    metavar='HEIGHT',
+    default=None,
+    help='If specified, only the planes at these heights above the topmost \
+          atom [Angstroms] are summed. Each plane is written as compressed \
+          cube file (.npz) containing only this plane.')
+parser.add_argument(
+    '--jobs',
+    metavar='INT',
+    type=int,
+    default=1,
+    help='Number of processes reading cube files in parallel.')
 
 args = parser.parse_args()
 
@@ -70,9 +86,6 @@ elif (args.vmin is not None) and \
 else:
     raise ValueError("Please specify either --bias or --vmin, --vmax and --vstep")
 print("Performing summation for voltages {}".format(bias))
-bias = np.unique(bias)
-pos_bias = np.sort(bias[np.where(bias > 0)])
-neg_bias = np.sort(bias[np.where(bias <= 0)])[::-1]
 
 # Read energy levels
 lfname, lfext = os.path.splitext(args.levelsfile)
@@ -94,73 +107,32 @@ spectrum.shift(-fermi)
 # i.e. it should appear at a slightly negative energy.
 spectrum.shift(-1.0e-6)
 
-# Reading headers of cube files
-cubes = []
-print("\nReading headers of {} cube files".format(len(args.cubes)))
-bar = progressbar.ProgressBar(niter=len(args.cubes))
-
-for fname in args.cubes:
-    cubes.append( cp2k.WfnCube.from_file(fname) )
-    bar.iterate()
-print("\n")
+# Reading comment lines of cube files
+print("\nIndexing {} cube files".format(len(args.cubes)))
+cubes = cp2k.WfnCubeSet(args.cubes)
 
 # Perform summation
-for vlist in [pos_bias, neg_bias]:
-    # Prepare new cube file
-    sumcube = cp2k.WfnCube.from_file(cubes[0].filename, read_data=False)
-    sumcube.title = "STM cube\n"
-    sumcube.data = np.zeros(sumcube.shape)
-    for v in vlist:
-        print("{:+7.3f} V bias\n-----------------------------------".format(v))
-        sumcube.comment = "Sample bias {:+4.2f} V\n".format(v)
-        sumcube.filename = "stm_{:+4.2f}V.cube".format(v)
-
-        n_to_sum = 0
-        for spin, levels in zip(spectrum.spins, spectrum.energylevels):
-            for lindex, l in enumerate(levels):
-                e = l.energy
-                o = l.occupation
-
-                # If we don't need this level, continue
-                if hasattr(l, 'used') or e*v < 0 or np.abs(e) >= np.abs(v):
-                    continue
-
-                n_to_sum += 1
-
-                # find cube file
-                found = False
-                for cindex, c in enumerate(cubes):
-                    if c.wfn == lindex+1 and c.spin == spin+1:
-                        found = True
-                        print("Reading cube file for spin {s}, energy {e:.6f} eV, occupation {o}"\
-                              .format(s=spin+1,e=e, o=o))
-
-                        # Make local copy of cube file and then read
-                        tmp = cp2k.WfnCube.from_cube(c)
-                        tmp.read_cube_file(tmp.filename,read_data=True)
-
-                        # each cube file and corresponding level 
-                        # needs to be read only once.
-                        l.used = True
-                        #c.used = True
-
-                        if(not args.psi_squared):
-                            tmp.data = np.square(tmp.data)
-                        # For STM at zero temperature, 
-                        # the occupation of the level in the calculation is irrelevant
-                        # tmp *= o
-                        sumcube += tmp
-                        break
-
-                if not found:
-                    print("Missing cube file for spin {s}, energy {e:.6f} eV, occupation {o}"\
-                               .format(s=spin+1,e=e,o=o))
-        if n_to_sum == 0:
-            print("No new cubes for bias {:+4.3f}".format(v))
-        # When all required levels have been added, write sum            
-        print("Writing {}".format(sumcube.filename))
-        sumcube.write_cube_file()
-        print("")
+# Each cube file is read once, sums for all biases are accumulated
+summer = stm.BiasSummer(spectrum, cubes, psi_squared=args.psi_squared,
+                        heights=args.heights, workers=args.jobs)
+for v, result in summer.sums(bias):
+    if args.heights is None:
+        result.filename = "stm_{:+4.2f}V.cube".format(v)
+        print("Writing {}".format(result.filename))
+        result.write_cube_file()
+    else:
+        # cube of a single plane at the original position, such that
+        # e.g. stm.py finds it at the same height above the atoms
+        for h, iz, plane in zip(args.heights, summer.indices, result):
+            c = cube.Cube.from_cube(summer.header)
+            dz = c.dz
+            c.origin = c.origin + iz*dz
+            c.data = plane.data[:, :, np.newaxis]
+            c.cell[2] = dz
+            c.comment = "Sample bias {:+4.2f} V, z = {} [A]\n".format(v, h)
+            c.filename = "stm_{:+4.2f}V.dz{}.npz".format(v, h)
+            print("Writing {}".format(c.filename))
+            c.write_cube_file()
+    print("")
 
 print("\nDone\n")
-
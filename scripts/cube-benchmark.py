@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+from __future__ import division
+import numpy as np
+import argparse
+import os
+import tempfile
+import time
+
+import asetk.format.cube as cube
+import asetk.atomistic.fundamental as fu
+
+# Define command line parser
+parser = argparse.ArgumentParser(
+    description='Measures throughput of reading and writing Gaussian cube files.')
+parser.add_argument('--version', action='version', version='%(prog)s 18.10.2026')
+parser.add_argument(
+    '--cube',
+    metavar='FILENAME',
+    default=None,
+    help='Cube file to benchmark. If not specified, a cube file with \
+          random data is created in a temporary directory.')
+parser.add_argument(
+    '--shape',
+    nargs=3,
+    metavar='INT',
+    type=int,
+    default=[100, 100, 100],
+    help='Grid of the random cube file.')
+parser.add_argument(
+    '--tasks',
+    nargs='+',
+    metavar='KEYWORD',
+    default=['read', 'write'],
+    help='What to benchmark: \'read\' and/or \'write\'.')
+parser.add_argument(
+    '--engines',
+    nargs='+',
+    metavar='KEYWORD',
+    default=None,
+    help='Parsing engines to compare. Defaults to all available engines.')
+parser.add_argument(
+    '--repeat',
+    metavar='INT',
+    type=int,
+    default=3,
+    help='Take best time out of this many repetitions.')
+
+args = parser.parse_args()
+
+def best_time(f, repeat):
+    """Returns best wall time of f() out of repeat runs"""
+    times = []
+    for i in range(repeat):
+        t0 = time.time()
+        f()
+        times.append(time.time() - t0)
+    return min(times)
+
+def write_one_per_line(c, fname):
+    """Previous writer: one value per line via ndarray.tofile"""
+    f = open(fname, 'w')
+    c.data.tofile(f, sep='\n', format='%12.6e')
+    f.close()
+
+tmpdir = tempfile.mkdtemp()
+fname = args.cube
+if fname is None:
+    fname = os.path.join(tmpdir, 'random.cube')
+    shape = args.shape
+    atoms = fu.Atoms(numbers=[6], positions=[[0, 0, 0]], cell=np.diag(shape) * 0.1)
+    c = cube.Cube(title='Benchmark\n', comment='Random data\n',
+                  origin=np.zeros(3), atoms=atoms, data=np.random.randn(*shape))
+    print("Writing random cube file of shape {}".format(shape))
+    c.write_cube_file(fname)
+
+engines = args.engines
+if engines is None:
+    engines = ['split', 'numpy', 'fixedwidth']
+    try:
+        import pandas
+        engines.append('pandas')
+    except ImportError:
+        pass
+
+size = os.path.getsize(fname) / 1024**2
+print("{:20s} {:>10s} {:>10s}".format('task', 'time [s]', 'MB/s'))
+
+if 'read' in args.tasks:
+    for engine in engines:
+        t = best_time(lambda: cube.Cube.from_file(fname, read_data=True,
+                                                  engine=engine, cache=False),
+                      args.repeat)
+        print("{:20s} {:10.3f} {:10.1f}".format('read ' + engine, t, size / t))
+
+if 'write' in args.tasks:
+    c = cube.Cube.from_file(fname, read_data=True, cache=False)
+    out = os.path.join(tmpdir, 'out.cube')
+    for name, write in [
+            ('write one-per-line', lambda: write_one_per_line(c, out)),
+            ('write 6 per line', lambda: c.write_cube_file(out))]:
+        t = best_time(write, args.repeat)
+        size = os.path.getsize(out) / 1024**2
+        print("{:20s} {:10.3f} {:10.1f}".format(name, t, size / t))
+    os.remove(out)
+
+if args.cube is None:
+    os.remove(fname)
+os.rmdir(tmpdir)
@@ -0,0 +1,37 @@
+#!/usr/bin/env python
+import numpy as np
+import argparse
+import os
+from asetk.format.cube import Cube
+
+# Define command line parser
+parser = argparse.ArgumentParser(
+    description='Converts Gaussian cube files to compressed .npz cube files and back.')
+parser.add_argument('--version', action='version', version='%(prog)s 18.10.2026')
+parser.add_argument(
+    'cubes',
+    nargs='+',
+    metavar='FILENAMES',
+    help='Cube file(s) to be converted. Files ending in .npz are converted \
+          to .cube, all others to .npz.')
+parser.add_argument(
+    '--mode',
+    metavar='KEYWORD',
+    default='lossless',
+    help='Storage mode of .npz files: \'lossless\', \'float32\' or \'quantized\'.')
+
+args = parser.parse_args()
+
+for fname in args.cubes:
+    print("Reading cube file {}".format(fname))
+    c = Cube.from_file(fname, read_data=True)
+
+    base, ext = os.path.splitext(fname)
+    outname = base + ('.cube' if ext == '.npz' else '.npz')
+    print("Writing {}".format(outname))
+    c.write_cube_file(outname, mode=args.mode)
+    print("Compression ratio {:.1f}".format(
+        os.path.getsize(fname) / os.path.getsize(outname)))
+    print("")
+
+print("Job done")
@@ -78,6 +78,13 @@ parser.add_argument(
     metavar='INT',
     help='If specified, the data will be resampled on a cartesian grid of \
           nx x ny points.')
+parser.add_argument(
+    '--interpolation',
+    metavar='KEYWORD',
+    default='linear',
+    help='Interpolation used for resampling: \'nearest\', \'linear\', \
+          \'cubic\' or \'fourier\' (zero-padding in Fourier space, \
+          exact for band-limited periodic data).')
 parser.add_argument(
     '--format',
     metavar='STRING',
@@ -157,7 +164,8 @@ for fname in args.cubes + args.qe_cubes:
         plane = None
         index = c.get_index(args.normal, v)
         plane = c.get_plane(args.normal, index,
-                return_object=True, replica=args.replicate, resample=resample)
+                return_object=True, replica=args.replicate, resample=resample,
+                interpolation=args.interpolation)
         #elif kind == 'i':
         #    plane = c.get_isosurface_above_atoms(
         #            v, zcut=args.zcut, from_below=args.from_below,
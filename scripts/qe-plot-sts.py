@@ -72,6 +72,13 @@ parser.add_argument(
     metavar='INT',
     help='If specified, the data will be resampled on a cartesian grid of \
           nx x ny points.')
+parser.add_argument(
+    '--interpolation',
+    metavar='KEYWORD',
+    default='linear',
+    help='Interpolation used for resampling: \'nearest\', \'linear\', \
+          \'cubic\' or \'fourier\' (zero-padding in Fourier space, \
+          exact for band-limited periodic data).')
 parser.add_argument(
     '--format',
     metavar='STRING',
@@ -117,7 +124,7 @@ for fname in args.cubes + args.qe_cubes:
         c = cube.Cube.from_file(fname, read_data=True)
     elif fname in args.qe_cubes:
         format = 'qe_cube'
-    	tmp = qe.QECube.from_file(fname, read_data=True)
+        tmp = qe.QECube.from_file(fname, read_data=True)
         c = tmp.to_cube()
 
     dS = c.dx[0] * c.dy[1]
@@ -139,6 +146,10 @@ for fname in args.cubes + args.qe_cubes:
         plane = None
         plane = c.get_plane_above_atoms(p, return_object=True,
                                         replica=args.replicate, verbose=True)
+        weight = np.sum ( np.sum( plane.data ) ) * dS
+
+        if resample:
+            plane.resample(resample, interpolation=args.interpolation)
 
         #plane = c.get_plane(args.normal, index,
         #        return_object=True, replica=args.replicate, resample=resample)
@@ -146,7 +157,6 @@ for fname in args.cubes + args.qe_cubes:
         # for details of plane object, see asetk/format/cube.py
 
         data = plane.data
-        weight = np.sum ( np.sum( plane.data ) ) * dS
         imdata = plane.imdata
         extent = plane.extent
 
@@ -73,6 +73,13 @@ parser.add_argument(
     metavar='INT',
     help='If specified, the data will be resampled on a cartesian grid of \
           nx x ny points.')
+parser.add_argument(
+    '--interpolation',
+    metavar='KEYWORD',
+    default='linear',
+    help='Interpolation used for resampling: \'nearest\', \'linear\', \
+          \'cubic\' or \'fourier\' (zero-padding in Fourier space, \
+          exact for band-limited periodic data).')
 parser.add_argument(
     '--format',
     metavar='STRING',
@@ -129,6 +136,16 @@ for fname in args.stmcubes:
     else:
         resample = args.resample
 
+    isosurfaces = {}
+    if args.isovalues:
+        # computes all isosurfaces in a single pass over the grid
+        planes = c.get_isosurface_above_atoms(
+                args.isovalues, zcut=args.zcut, from_below=args.from_below,
+                return_object=True, 
+                replica=args.replicate, resample=resample,
+                interpolation=args.interpolation)
+        isosurfaces = dict(zip(args.isovalues, planes))
+
     for v,kind in jobs:
         planefile = None
         header = "STM simulation based on " + fname
@@ -143,12 +160,10 @@ for fname in args.stmcubes:
         if kind == 'h':
             plane = c.get_plane_above_atoms(v, 
                     return_object=True, from_below=args.from_below, 
-                    replica=args.replicate, resample=resample)
+                    replica=args.replicate, resample=resample,
+                    interpolation=args.interpolation)
         elif kind == 'i':
-            plane = c.get_isosurface_above_atoms(
-                    v, zcut=args.zcut, from_below=args.from_below,
-                    return_object=True, 
-                    replica=args.replicate, resample=resample)
+            plane = isosurfaces[v]
 
         # for details of plane object, see asetk/format/cube.py
         extent = plane.extent
@@ -1,16 +1,20 @@
 #!/usr/bin/env python
 import numpy as np
-import scipy.special as scsp
 import argparse
 import asetk.format.cp2k as cp2k
+from asetk.format.cube import Cube, iter_grids
+from asetk.format.cubecache import PlaneCache
 import asetk.util.progressbar as progressbar
 import asetk.atomistic.constants as constants
+import asetk.atomistic.fundamental as fu
+import asetk.stm.sts as sts
 import os.path
+import functools
 
 # Define command line parser
 parser = argparse.ArgumentParser(
     description='Performs Scanning Tunneling Spectroscopy Simulation.')
-parser.add_argument('--version', action='version', version='%(prog)s 13.12.2013')
+parser.add_argument('--version', action='version', version='%(prog)s 18.10.2026')
 parser.add_argument(
     '--cubes',
     nargs='+',
@@ -33,7 +37,8 @@ parser.add_argument(
     '--outfile',
     metavar='FILENAME',
     default='sts.cube',
-    help='Name of cube file for STS simulation.')
+    help='Name of cube file for STS simulation. For several heights, the \
+          height is inserted before the extension.')
 parser.add_argument(
     '--vmin',
     metavar='U',
@@ -83,11 +88,15 @@ parser.add_argument(
           weight of the broadening function outside of [-Eb, Eb] is \n\
           below bepsilon.')
 parser.add_argument(
+    '--heights',
     '--height',
+    nargs='+',
     metavar='DISTANCE',
-    default=2.5,
+    default=[2.5],
     type=float,
-    help='The height [Angstroms] above the topmost atom, where to extract the plane.')
+    help='The heights [Angstroms] above the topmost atom, where to extract \
+          the planes. One STS cube is written per height, reading each \
+          cube file only once.')
 parser.add_argument(
     '--normalize',
     dest='normalize',
@@ -101,25 +110,23 @@ parser.add_argument(
     default=None,
     help='If specified, the (relative) weights   \
             w_i = \int |\psi_i^2(x,y,z_0)| dx dy \
-          of all states are printed to file.')
+          of all states are printed to file (one column per height).')
+parser.add_argument(
+    '--planecache',
+    metavar='FILENAME',
+    default='planecache.npz',
+    help='File for caching the planes extracted from the cube files.')
+parser.add_argument(
+    '--jobs',
+    metavar='INT',
+    type=int,
+    default=1,
+    help='Number of processes reading cube files in parallel.')
 
 args = parser.parse_args()
 
-# Prepare broadening functions for later convolution.
-# The quantile function quantile(y) = x is defined such that
-# the integral of the probability density from -\infty to x equals y.
-if args.bmethod == 'Gaussian':
-    sigma = args.FWHM / np.log(8 * np.sqrt(2))
-    quantile = lambda y: np.sqrt(2) * scsp.erfinv(2.0*y -1.0) * sigma
-    broadening = lambda x: 1/(sigma * np.sqrt(2*np.pi)) \
-                         * np.exp( - x**2 / (2 * sigma**2) )
-elif args.bmethod == 'Lorentzian':
-    gamma = args.FWHM * 0.5
-    quantile = lambda y: np.tan(np.pi * (y - 0.5)) * gamma
-    broadening = lambda x: 1/np.pi * gamma / (x**2 + gamma**2)
-else:
-    print("Error: No broadening method recognized.")
-
+# The broadening window [E-Eb, E+Eb] determines which levels are needed
+quantile = fu.get_broadening(args.bmethod, args.FWHM)[1]
 eb = -quantile(args.bepsilon * 0.5)
 print("Using window [x{:.3f}eV, x+{:.3f}eV] for level broadening."\
       .format(-eb, eb))
@@ -147,53 +154,39 @@ else:
     for levels in spectrum.energylevels:
         levels.shift(-fermi)
 
-# Reading headers of cube files
-cubes = []
-print("\nReading headers of {n} cube files".format(n=len(args.cubes)))
-bar = progressbar.ProgressBar(niter=len(args.cubes))
-
-for fname in args.cubes:
-    cubes.append( cp2k.WfnCube.from_file(fname) )
-    bar.iterate()
-print("")
+# Reading comment lines of cube files
+print("\nIndexing {n} cube files".format(n=len(args.cubes)))
+cubes = cp2k.WfnCubeSet(args.cubes)
+cubes.join(spectrum)
 
-# Connecting energies with required cube files
 required_cubes = []
 for spin, levels in zip(spectrum.spins, spectrum.energylevels):
-    for index, l in enumerate(levels.levels):
-        e = l.energy
-        o = l.occupation
-        # If we need the cube file for this level..
-        if e >= args.vmin - eb and \
-           e <= args.vmax + eb:
-
-               found = False
-               for cube in cubes:
-                   #print "ind {}  {} spin {} {}".format(cube.wfn,index,cube.spin,spin)
-                   if cube.wfn == index+1 and cube.spin == spin + 1:
-                       cube.energy = e
-                       cube.occupation = o
-                       required_cubes.append(cube)
-                       found = True
-
-                       print("Found cube file for spin {s}, energy {e:.6f}, occupation {o}"\
-                             .format(s=spin+1,e=e, o=o))
-                       break
-               if not found:
-                   print("Missing cube file for spin {s}, energy {e:.6f}, occupation {o}"\
-                           .format(s=spin+1,e=e,o=o))
+    energies = levels.energies
+    # If we need the cube file for this level..
+    needed = np.flatnonzero((energies >= args.vmin - eb) & \
+                            (energies <= args.vmax + eb))
+    for index in needed:
+        e = energies[index]
+        o = levels.occupations[index]
+        cube = cubes.get((spin + 1, index + 1))
+        if cube is not None:
+            required_cubes.append(cube)
+            print("Found cube file for spin {s}, energy {e:.6f}, occupation {o}"\
+                  .format(s=spin+1,e=e, o=o))
+        else:
+            print("Missing cube file for spin {s}, energy {e:.6f}, occupation {o}"\
+                  .format(s=spin+1,e=e,o=o))
 
 # Prepare new cube file
 print("\nInitializing STS cube")
-stscube = cp2k.WfnCube.from_file(required_cubes[0].filename, read_data=True)
+stscube = cubes.header((required_cubes[0].spin, required_cubes[0].wfn))
 
 stscube.title = "STS data (z axis = energy)\n"
-stscube.comment = "Range [{:4.2f} V, {:4.2f} V], vstep {:4.3f} V, FWHM {:4.3f} V {}\n" \
+comment = "Range [{:4.2f} V, {:4.2f} V], vstep {:4.3f} V, FWHM {:4.3f} V {}\n" \
                .format(args.vmin, args.vmax, args.vstep, args.FWHM, args.bmethod)
 # adjust z-dimension for energy
-shape = np.array(stscube.data.shape)
+shape = np.array(stscube.shape)
 shape[2] = np.rint( (args.vmax - args.vmin) / args.vstep) + 1
-stscube.data = np.zeros(shape, dtype=float)
 
 # During export, these numbers will be
 # "converted from Angstrom to Bohr"
@@ -205,63 +198,78 @@ zrange = np.linspace(args.vmin, args.vmax, shape[2])
 
 if args.print_weights:
     wfile = open(args.print_weights, 'w')
-    wfile.write('#index  spin   energy[eV]   weight[a.u.]\n')
+    wfile.write('#index  spin   energy[eV]' \
+                + ''.join(['   weight[a.u.]'] * len(args.heights)) + '\n')
 
 # Perform STS calculation
-print("\nReading data of {n} cube files".format(n=len(required_cubes)))
+# Reading cube files is the most time consuming part of the routine.
+# Since we need only a few planes out of each cube file,
+# we save them to disk for reuse.
+cache = PlaneCache(args.planecache)
+cached = []
+for c in required_cubes:
+    cplanes = [cache.get(c.filename, h, args.psisquared) for h in args.heights]
+    cached.append(None if any(p is None for p in cplanes) else np.array(cplanes))
+print("\nFound planes of {} of {} cube files in {}".format(
+      len([p for p in cached if p is not None]), len(cached), args.planecache))
+print("Reading data of {n} cube files".format(n=len(required_cubes)))
 bar = progressbar.ProgressBar(niter=len(required_cubes))
 
-for cube in required_cubes:
+# Planes not cached yet are read ahead by worker processes.
+# All heights are extracted in a single pass over the cube file.
+planes = iter_grids(
+    [c.filename for c, p in zip(required_cubes, cached) if p is None],
+    func=functools.partial(Cube.get_planes_above_atoms, heights=args.heights),
+    workers=args.jobs)
 
-    # Reading cube files is the most time consuming part of the routine.
-    # Since we need only one plane out of each cube file,
-    # we save it to disk for reuse.
-    planefile = "{f}.z{d}".format(f=cube.filename,d=args.height)
+stsplanes = []
+for cube, plane in zip(required_cubes, cached):
 
-    # We don't want to keep all cubes in memory at once
-    tmp = cp2k.WfnCube.from_cube(cube)
-
-    plane = None
-    if( os.path.isfile(planefile) ):
-        plane = np.genfromtxt(planefile)
-
-    else:
-        tmp.read_cube_file(tmp.filename,read_data=True)
+    if plane is None:
+        # Only the planes are read from the cube file
+        plane = next(planes)
         if(not args.psisquared):
-            tmp.data = np.square(tmp.data)
+            plane = np.square(plane)
 
-        plane = tmp.get_plane_above_atoms(args.height)
         # For STS at zero temperature, 
         # the occupation of the level in the calculation is irrelevant
-        #plane = plane * tmp.occupation
-        np.savetxt(planefile, plane)
+        #plane = plane * cube.occupation
+        for h, p in zip(args.heights, plane):
+            cache.set(cube.filename, h, p, args.psisquared)
 
     if args.print_weights:
-        weight = np.sum( np.sum(plane) )
-        wfile.write('{:6d} {:5d} {:10.3f} {:14.4e}\n'.\
-                    format(cube.wfn, cube.spin, cube.energy, weight))
-
-    vmin = tmp.energy - eb
-    vmax = tmp.energy + eb
-    imin = (np.abs(zrange-vmin)).argmin()
-    imax = (np.abs(zrange-vmax)).argmin()
-
-    for i in range(imin,imax+1):
-        stscube.data[:,:,i] += plane * broadening(tmp.energy - zrange[i])
+        weights = np.sum(plane, axis=(1, 2))
+        wfile.write('{:6d} {:5d} {:10.3f}'.format(cube.wfn, cube.spin, cube.energy) \
+                    + ''.join([' {:14.4e}'.format(w) for w in weights]) + '\n')
 
+    stsplanes.append(plane)
     bar.iterate()
 print("\n")
+cache.save()
 
 if args.print_weights:
     wfile.close()
 
-# Normalize, if asked to
-if args.normalize is True:
-   print("Normalizing STS data to 1")
-   stscube.data /= np.sum(stscube.data)
-
-
-print("\nWriting {}".format(args.outfile))
-stscube.write_cube_file(args.outfile)
-
-    
+# All levels are broadened in a single matrix product for all heights
+nstates, nh, nx, ny = np.shape(stsplanes)
+stsdata = sts.sts(np.reshape(stsplanes, (nstates, nh * nx, ny)),
+                  [c.energy for c in required_cubes], zrange,
+                  bmethod=args.bmethod, FWHM=args.FWHM, bepsilon=args.bepsilon)
+stsdata = stsdata.reshape(nh, nx, ny, len(zrange))
+
+outbase, outext = os.path.splitext(args.outfile)
+for ih, h in enumerate(args.heights):
+    stscube.data = stsdata[ih]
+    stscube.comment = comment.replace('\n', ', height {:.2f} A\n'.format(h))
+
+    # Normalize, if asked to
+    if args.normalize is True:
+       print("Normalizing STS data to 1")
+       stscube.data /= np.sum(stscube.data)
+
+    if len(args.heights) == 1:
+        outfile = args.outfile
+    else:
+        outfile = "{}.z{}{}".format(outbase, h, outext)
+    print("\nWriting {}".format(outfile))
+    stscube.write_cube_file(outfile)